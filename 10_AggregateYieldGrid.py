@@ -0,0 +1,116 @@
+#==============================================================================
+# MIT License
+# 
+# Copyright (c) 2017 Angelo Podagrosi
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# 
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+This code bins the yield points into square grid cells at several zoom levels (tables
+'yield_grid_z{zoom}'; see 'yield_grid.py'), so maps zoomed out to field or farm level read
+a few thousand cells instead of every point.
+1) Each cell stores the number of points and the mean/min/max of each yield metric per field,
+   year and crop, with the cell square as 'geom_3857' (for GeoServer WMS layers or the vector
+   tiles of '6_SeedVectorTiles.py')
+2) The finest level is binned from 'yield_point'; each coarser level from the next finer level
+3) Incremental refresh: only the field/year groups of CSV files loaded since the last refresh
+   are recomputed; the first run (or a change of levels) bins every point
+        -- Requires 'geom_3857' ('4_SpatiallyEnable.py' or ingest geometry)
+
+Main components to be changed by user:
+1) Postgres database connection
+2) Zoom levels of the grid
+
+"""
+
+# Import necessary Python packages and libraries
+import datetime
+import pipeline_settings
+import pipeline_metrics
+import yield_grid
+import yield_tiles
+
+
+# Print current time to assist in tracking total processing time
+print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each step are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'yield_grid'
+
+# Zoom levels of the grid (cells are 1/32 of a map tile of the zoom; zoom 16 cells are about 19 m wide)
+gridZooms = yield_grid.GRID_ZOOMS
+# True: bin every point again; False: recompute only the field/year groups of files loaded since the last refresh
+    # (files are tracked by the manifest of '2_ProcessCSVs.py' with 'incrementalIngest'; rebuild after other loads)
+rebuildGrid = False
+
+# Connect to database
+try:
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
+    print("I am able to connect to the database! :)")
+except:
+    print("I am unable to connect to the database.")
+
+# Establish cursor connection to database; necessary to begin providing commands/queries to database
+cursor = connection.cursor()
+
+###############################################################################
+# Identify the field/year groups to recompute
+
+yield_grid.ensureGridTables(cursor, gridZooms)
+connection.commit()
+
+# Watermark read before the groups, so files loaded while binning are recomputed by the next run
+refreshedThrough = yield_tiles.manifestLoadedAt(cursor)
+levels = yield_grid.gridLevels(cursor)
+previousRefresh = [levels.get(zoom) for zoom in gridZooms]
+if rebuildGrid or any(refreshed is None for refreshed in previousRefresh):
+    groups = None
+    print("...Binning every yield point beginning at " + str(datetime.datetime.now()) + "...")
+else:
+    since = min(previousRefresh)
+    groups = yield_grid.changedGroups(cursor, since)
+    print("...Recomputing " + str(len(groups)) + " field/year groups of files loaded since " + str(since) + "...")
+
+###############################################################################
+# Refresh the levels, finest first (each coarser level is aggregated from the next finer one)
+
+finerZoom = None
+for zoom in sorted(gridZooms, reverse = True):
+    with pipeline_metrics.Step(METRICS_STAGE, 'grid_z' + str(zoom)) as stepLevel:
+        stepLevel.rows = yield_grid.refreshGridLevel(cursor, zoom, groups, finerZoom)
+    print(yield_grid.gridTable(zoom) + ": " + str(stepLevel.rows) + " cells")
+    finerZoom = zoom
+yield_grid.setRefreshedThrough(cursor, gridZooms, refreshedThrough)
+connection.commit()
+
+# Update the planner statistics of the refreshed tables
+for zoom in gridZooms:
+    cursor.execute("ANALYZE " + yield_grid.gridTable(zoom) + ";")
+connection.commit()
+
+print("Refreshed the yield grid (zoom " + str(min(gridZooms)) + " to " + str(max(gridZooms)) + ")")
+print("Current time: " + str(datetime.datetime.now()))
+
+# Close communication with the Postgres database server
+cursor.close()
+pipeline_settings.release(connection)
@@ -0,0 +1,114 @@
+#==============================================================================
+# MIT License
+# 
+# Copyright (c) 2017 Angelo Podagrosi
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# 
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+This code exports 'yield_point' to GeoParquet files partitioned by year, crop and field
+('year=2016/crop=corn/field_id=19/part-0.parquet'; see 'yield_export.py'), for analysis in
+notebooks, DuckDB or Spark without querying the production database.
+1) Every column of 'yield_point', the farm, field and farmer names and the point geometry (WKB)
+2) Rows are streamed from a server-side cursor, so memory stays flat whatever the table size
+3) Incremental export: only the year/field partitions of CSV files loaded since the last export
+   (recorded in the export folder) are written again; the first run (or a change of the
+   columns of 'yield_point') exports every point
+Requires 'pyarrow'.
+
+Main components to be changed by user:
+1) Postgres database connection
+2) Folder of the GeoParquet files
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import shutil
+import datetime
+import pipeline_settings
+import pipeline_metrics
+import yield_export
+import yield_tiles
+
+
+# Print current time to assist in tracking total processing time
+print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each step are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'geoparquet_export'
+
+# Folder of the partitioned GeoParquet files
+# (the value in the [paths] section of 'pipeline.ini' is used instead when present)
+exportDirectory = pipeline_settings.path('exportDirectory', r'FILE PATH TO FOLDER OF GEOPARQUET EXPORT')
+    # Example: r'C:\GIS\PrecisionAg\GeoParquet'
+# True: write again only the partitions of files loaded since the last export; False: export every point
+    # (files are tracked by the manifest of '2_ProcessCSVs.py' with 'incrementalIngest'; export everything after other loads)
+incrementalExport = True
+
+# Connect to database
+try:
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
+    print("I am able to connect to the database! :)")
+except:
+    print("I am unable to connect to the database.")
+
+# Establish cursor connection to database; necessary to begin providing commands/queries to database
+cursor = connection.cursor()
+
+###############################################################################
+# Identify the partitions to write
+
+os.makedirs(exportDirectory, exist_ok = True)
+columns = yield_export.exportColumns(cursor)
+state = yield_export.readState(exportDirectory)
+# Watermark read before the groups, so files loaded while exporting are exported again by the next run
+exportedThrough = yield_tiles.manifestLoadedAt(cursor)
+if incrementalExport and state.get('exported_through') and state.get('columns') == [list(column) for column in columns]:
+    groups = yield_export.changedGroups(cursor, state['exported_through'])
+    print("...Exporting " + str(len(groups)) + " year/field groups of files loaded since " + state['exported_through'] + "...")
+    yield_export.removeGroups(exportDirectory, groups)
+else:
+    groups = None
+    print("...Exporting every yield point beginning at " + str(datetime.datetime.now()) + "...")
+    for folder in os.listdir(exportDirectory):
+        if folder.startswith('year='):
+            shutil.rmtree(os.path.join(exportDirectory, folder))
+connection.rollback()
+
+###############################################################################
+# Write the partitions
+
+with pipeline_metrics.Step(METRICS_STAGE, 'write_partitions') as stepExport:
+    written = yield_export.exportPartitions(connection, exportDirectory, columns, groups) if groups is None or groups else {}
+    connection.rollback()
+    stepExport.rows = sum(written.values())
+
+yield_export.writeState(exportDirectory, {'exported_through': str(exportedThrough) if exportedThrough is not None else None,
+                                          'columns': [list(column) for column in columns]})
+print("Wrote " + str(stepExport.rows) + " points to " + str(len(written)) + " partitions: " + exportDirectory)
+print("Current time: " + str(datetime.datetime.now()))
+
+# Close communication with the Postgres database server
+cursor.close()
+pipeline_settings.release(connection)
@@ -0,0 +1,109 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+This code converts 'yield_point' and the yield scratch tables of an existing database to the
+compact storage schema ('real', 'double precision' and integer columns instead of 'numeric';
+see 'yield_compact.py'), as created by '1_CreatingDatabaseTables.py' with 'compactSchema'.
+1) Size of each table (including indexes) and average row width are measured
+2) Each table is converted by one 'ALTER TABLE' (the table, every partition and the indexes are
+   rewritten once) and committed; tables already compact are skipped, so the script may be run again
+3) Planner statistics are updated ('ANALYZE') and the sizes before and after are reported
+Run once, outside of the pipeline: the tables are locked while they are rewritten, and the
+rewrite needs free disk space for a second copy of the largest table.
+
+Main components to be changed by user:
+1) Postgres database connection
+2) Tables to convert
+
+"""
+
+# Import necessary Python packages and libraries
+import datetime
+import pipeline_settings
+import pipeline_metrics
+import yield_compact
+import yield_bulkload
+
+
+# Print current time to assist in tracking total processing time
+print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each step are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'compact_schema'
+
+# Tables to convert (scratch tables and 'yield_point'; names in lower case)
+tablesToConvert = yield_compact.COMPACT_TABLES
+
+# Connect to database
+try:
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
+    print("I am able to connect to the database! :)")
+except:
+    print("I am unable to connect to the database.")
+
+# Establish cursor connection to database; necessary to begin providing commands/queries to database
+cursor = connection.cursor()
+
+###############################################################################
+# Convert the tables
+
+sizesBefore = dict((table, yield_compact.tableSize(cursor, table)) for table in tablesToConvert)
+connection.commit()
+
+for table in tablesToConvert:
+    command = yield_compact.migrationCommand(cursor, table)
+    if command is None:
+        print("Already compact: " + table)
+        continue
+    print("...Converting " + table + " beginning at " + str(datetime.datetime.now()) + "...")
+    with pipeline_metrics.Step(METRICS_STAGE, 'convert ' + table) as stepConvert:
+        # Memory and parallel workers of the index builds of the rewrite (for its transaction only)
+        for setting in yield_bulkload.maintenanceSettings():
+            cursor.execute(setting)
+        cursor.execute(command)
+        connection.commit()
+        stepConvert.rows = sizesBefore[table][1]
+    print(command)
+
+# Converted columns lose their statistics
+with pipeline_metrics.Step(METRICS_STAGE, 'analyze'):
+    yield_bulkload.analyzeTables(cursor, tablesToConvert)
+    connection.commit()
+
+###############################################################################
+# Report the sizes before and after
+
+sizesAfter = dict((table, yield_compact.tableSize(cursor, table)) for table in tablesToConvert)
+connection.commit()
+for line in yield_compact.sizeReport(sizesBefore, sizesAfter):
+    print(line)
+print("Current time: " + str(datetime.datetime.now()))
+
+# Close communication with the Postgres database server
+cursor.close()
+pipeline_settings.release(connection)
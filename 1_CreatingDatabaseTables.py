@@ -37,8 +37,18 @@ This code creates tables within an existing local PostgreSQL database (identifie
         -- Create table to contain product (corn and soybean) information
       
         -- Sample scratch tables to contain data from raw precision agriculture CSVs
+            (UNLOGGED, as their rows are reloaded by every run)
         -- Final table to contain yield/harvest data from multiple sources
             from above scratch tables
+        -- Optionally with the compact storage schema ('real'/'double precision'/integer measurements
+           instead of 'numeric'; see 'yield_compact.py')
+        -- Manifest of the CSV files loaded into the final yield/harvest table
+        -- Summary of the final yield/harvest table by field, year and crop (for the web app's chart)
+        -- Quantile sketches of the yield metrics of each loaded file (for map class breaks)
+        -- Swath polygons with simplified copies of their geometry
+        -- Grid cells of the yield points at several zoom levels (for zoomed out maps)
+        -- Indexes and constraints dropped by the bulk-load mode of '2_ProcessCSVs.py' until they are rebuilt
+        -- With the embedded DuckDB backend, the tables of the core pipeline in a DuckDB file instead
 
 
 Main components to be changed by user:
@@ -52,16 +62,35 @@ Questions to angelo.podagrosi@gmail.com
 """
 
 # Import necessary Python packages and libraries
+import sys
 import datetime
-import psycopg2
+import pipeline_settings
+import yield_summary
+import yield_ingest
+import yield_sketch
+import yield_swath
+import yield_grid
+import yield_bulkload
+import yield_compact
+import yield_duckdb
     # Note psycopg2 was 'conda' installed - https://anaconda.org/anaconda/psycopg2
 
 # Print current time to assist in tracking total processing time
 print("Current time: " + str(datetime.datetime.now()))
 
+# Embedded DuckDB backend ('backend = duckdb' in the [pipeline] section of 'pipeline.ini'; see 'yield_duckdb.py'):
+# the tables are created in the DuckDB file and the Postgres code below is skipped
+if pipeline_settings.backend() == 'duckdb':
+    duckConnection = yield_duckdb.connect()
+    yield_duckdb.createTables(duckConnection)
+    duckConnection.close()
+    print("Created tables in DuckDB database: " + yield_duckdb.databasePath())
+    sys.exit()
+
 # Connect to database
 try:
-    connection = psycopg2.connect("dbname='PrecisionAg_v1' user='postgres' host='localhost' password='PASSWORD'")
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
     print("I am able to connect to the database! :)")
 except:
     print("I am unable to connect to the database.")
@@ -69,6 +98,29 @@ except:
 # Establish cursor connection to database; necessary to begin providing commands/queries to database
 cursor = connection.cursor()
 
+# Add the 'geom_3857' (Web Mercator) point column to the yield scratch tables and 'yield_point' when creating them
+    # Allows '2_ProcessCSVs.py' (with 'ingestGeometry' set to True) to write the geometry together with each row,
+    # rather than '4_SpatiallyEnable.py' populating it with an 'UPDATE' of the whole table. Requires PostGIS.
+ingestGeometry = True
+
+# Create 'yield_point' as a partitioned table (PostgreSQL 11 or later), one partition per harvest year
+    # Partitions are created by '2_ProcessCSVs.py' as new seasons are loaded (see 'yield_partitions.py')
+partitionYieldPoint = True
+# Also sub-partition each year by 'field_id'
+    # Read from 'partitionByField' in the [pipeline] section of 'pipeline.ini', shared with '2_ProcessCSVs.py'
+partitionByField = pipeline_settings.flag('pipeline', 'partitionByField', False)
+
+# Create the yield scratch tables '_CSVimport_yield_point_*' as UNLOGGED tables
+    # Their rows are not written to the write-ahead log (faster loads, less disk and replication traffic);
+    # after a database crash they are emptied, which is harmless as every run of '2_ProcessCSVs.py' reloads them
+unloggedScratchTables = True
+
+# Compact storage schema of the yield scratch tables and 'yield_point' (see 'yield_compact.py')
+    # True: monitor readings as 'real', coordinates as 'double precision', counts and identifiers as integers
+    #       (rows about half as wide as with 'numeric'); False: 'numeric' columns as declared below
+    # Existing tables are converted by '12_MigrateCompactSchema.py'
+compactSchema = True
+
 ###############################################################################
 """
 
@@ -270,6 +322,12 @@ crop_flw_v numeric(18,6) NOT NULL,
 date date NOT NULL,
 org_file VARCHAR(100) NULL,
 file_source VARCHAR(20) NULL,
+field_ID smallint NULL REFERENCES field (field_id),   -- populated during ingest from '_CSVimport_field_key'
+farmer_id smallint NULL REFERENCES farmer (farmer_ID),
+corn smallint NULL,   -- populated during ingest from 'products'
+soybean smallint NULL,
+spatial_outlier smallint NULL,   -- 1 = spatial outlier (when flagged during ingest; see 'yield_outliers.py')
+owner_id smallint NULL REFERENCES owner (owner_id),   -- owner of the field boundary containing the point (see 'yield_fields.py')
 CONSTRAINT yieldpointjd_id_pkey PRIMARY KEY (ID)
 );""",
 """
@@ -314,10 +372,23 @@ crop_flw_v numeric(18,6) NOT NULL,
 date date NOT NULL,
 org_file VARCHAR(100) NULL,
 file_source VARCHAR(20) NULL,
+field_ID smallint NULL REFERENCES field (field_id),   -- populated during ingest from '_CSVimport_field_key'
+farmer_id smallint NULL REFERENCES farmer (farmer_ID),
+corn smallint NULL,   -- populated during ingest from 'products'
+soybean smallint NULL,
+spatial_outlier smallint NULL,   -- 1 = spatial outlier (when flagged during ingest; see 'yield_outliers.py')
+owner_id smallint NULL REFERENCES owner (owner_id),   -- owner of the field boundary containing the point (see 'yield_fields.py')
 CONSTRAINT yieldpointagfiniti_id_pkey PRIMARY KEY (ID)
 );"""
 )
 
+if compactSchema:
+    commands_createPointScratchTablesForCSV = tuple(yield_compact.compactCreateCommand(command)
+                                                    for command in commands_createPointScratchTablesForCSV)
+if unloggedScratchTables:
+    commands_createPointScratchTablesForCSV = tuple(command.replace("CREATE TABLE", "CREATE UNLOGGED TABLE")
+                                                    for command in commands_createPointScratchTablesForCSV)
+
 # Loop through SQL commands using 'for' loop, executing each individually
 for command2 in commands_createPointScratchTablesForCSV:
     cursor.execute(command2)
@@ -335,6 +406,22 @@ print("Current time: " + str(datetime.datetime.now()))
 
 print("...Creating scratch table to contain final yield/harvest data from raw data received in CSV files...")
 
+# Primary key and partitioning of 'yield_point', from the options at the top of the script
+if partitionYieldPoint and partitionByField:
+    # The primary key of a partitioned table must include every partition key, and 'field_id' may be NULL;
+    # 'id' is indexed instead (below)
+    yieldPointTableEnd = """
+) PARTITION BY RANGE (date);"""
+elif partitionYieldPoint:
+    # The primary key of a partitioned table must include the partition key ('date')
+    yieldPointTableEnd = """,
+CONSTRAINT yield_point_id_pkey PRIMARY KEY (ID, date)
+) PARTITION BY RANGE (date);"""
+else:
+    yieldPointTableEnd = """,
+CONSTRAINT yield_point_id_pkey PRIMARY KEY (ID)
+);"""
+
 # Create SQL command
 commands_createFinalYieldPointTables = (
 """
@@ -382,16 +469,85 @@ crop_flw_v numeric(18,6) NOT NULL,
 date date NOT NULL,
 org_file VARCHAR(100) NULL,
 file_source VARCHAR(20) NULL,
+corn smallint NULL,
+soybean smallint NULL,
+spatial_outlier smallint NULL,
+owner_id smallint NULL REFERENCES owner (owner_id),
 field_ID smallint NULL REFERENCES field (field_id),   
-farmer_id smallint NULL REFERENCES farmer (farmer_ID),
-CONSTRAINT yield_point_id_pkey PRIMARY KEY (ID)
-);"""
+farmer_id smallint NULL REFERENCES farmer (farmer_ID)""" + yieldPointTableEnd
 )
 
+if compactSchema:
+    commands_createFinalYieldPointTables = yield_compact.compactCreateCommand(commands_createFinalYieldPointTables)
+
 cursor.execute(commands_createFinalYieldPointTables)
 
+# Index used to find (and replace) the rows of a reloaded file; created on every partition of a partitioned table
+cursor.execute("""CREATE INDEX yield_point_org_file ON yield_point (file_source, org_file);""")
+if partitionYieldPoint and partitionByField:
+    cursor.execute("""CREATE INDEX yield_point_id ON yield_point (id);""")
+
 print("Created final table to contain yield/harvest point data from all CSV files.")
 
+if ingestGeometry:
+    # Geometry columns populated during ingest; table names are lower case in the database
+    commands_addGEOMFields_ingest = (
+    """SELECT AddGeometryColumn('public', '_csvimport_yield_point_jd', 'geom_3857', 3857, 'POINT', 2);""",
+    """SELECT AddGeometryColumn('public', '_csvimport_yield_point_agfiniti', 'geom_3857', 3857, 'POINT', 2);""",
+    """SELECT AddGeometryColumn('public', 'yield_point', 'geom_3857', 3857, 'POINT', 2);"""
+    )
+    for command in commands_addGEOMFields_ingest:
+        cursor.execute(command)
+    print("Added 'geom_3857' field to scratch and final yield point tables.")
+
+# Create manifest of the raw CSV files loaded into 'yield_point'
+# Used by '2_ProcessCSVs.py' (when 'incrementalIngest' is True) to skip files already loaded and to replace the rows of changed files
+commands_createIngestManifestTable = (
+"""
+CREATE TABLE ingest_manifest(
+org_file VARCHAR(100) NOT NULL,
+file_source VARCHAR(20) NOT NULL,
+file_size bigint NOT NULL,
+file_mtime timestamp NOT NULL,
+content_hash CHAR(64) NOT NULL,   -- SHA-256 of the file contents
+row_count integer NOT NULL,
+loaded_at timestamp NOT NULL DEFAULT now(),
+CONSTRAINT ingest_manifest_pkey PRIMARY KEY (file_source, org_file)
+);"""
+)
+
+cursor.execute(commands_createIngestManifestTable)
+print("Created manifest table of loaded CSV files (ingest_manifest).")
+
+# Create table of the field/year groups of the rows replaced by reloads of changed files (see 'yield_ingest.py')
+# Read by the incremental tile seeding, grid and export ('6_SeedVectorTiles.py', '10_AggregateYieldGrid.py',
+# '11_ExportGeoParquet.py') to remove the tiles and groups a changed file no longer covers
+cursor.execute(yield_ingest.createReplacedGroupsTableCommand())
+print("Created table of replaced field/year groups (ingest_replaced_groups).")
+
+# Create pre-aggregated yield summary (count, sum, mean and percentiles per field, year and crop)
+# Refreshed by '2_ProcessCSVs.py' for the field/year groups of the loaded files (see 'yield_summary.py')
+cursor.execute(yield_summary.createSummaryTableCommand())
+print("Created yield summary table (yield_summary).")
+
+# Create quantile sketches of the yield metrics of each loaded file (used for map class breaks; see 'yield_sketch.py')
+cursor.execute(yield_sketch.createSketchTableCommand())
+print("Created yield sketch table (yield_sketch).")
+
+# Create table of swath polygons with simplified geometry columns (loaded by '9_LoadSwathPolygons.py'; see 'yield_swath.py')
+for command in yield_swath.createSwathTableCommands():
+    cursor.execute(command)
+print("Created swath polygon table (yield_swath).")
+
+# Create the multi-resolution grid tables of the yield points (built by '10_AggregateYieldGrid.py'; see 'yield_grid.py')
+yield_grid.ensureGridTables(cursor)
+print("Created yield grid tables (yield_grid_level, yield_grid_z" + str(min(yield_grid.GRID_ZOOMS)) + " to yield_grid_z"
+      + str(max(yield_grid.GRID_ZOOMS)) + ").")
+
+# Create table of the indexes and constraints dropped by the bulk-load mode of '2_ProcessCSVs.py' (see 'yield_bulkload.py')
+cursor.execute(yield_bulkload.createDeferredTableCommand())
+print("Created table of deferred indexes and constraints (bulk_load_deferred).")
+
 # Commit the changes to the database
 connection.commit()
 print("All database changes committed.")
@@ -402,4 +558,4 @@ print("Current time: " + str(datetime.datetime.now()))
 
 # Close communication with the Postgres database server
 cursor.close()
-connection.close()
\ No newline at end of file
+pipeline_settings.release(connection)
\ No newline at end of file
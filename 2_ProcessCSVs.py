@@ -38,7 +38,22 @@ This code populates the tables that have been created within the existing Postgr
         -- Sample scratch tables to contain data from CSVs, by vendor
             -- Add and populate 'field_ID' and 'farmer_ID' based on original file name from "AllFiles_Farm_Fields.csv"
         -- Combine scratch tables of CSVs by vendor into one file - "yield_point"
+        -- Remove junk points (header raised, implausible speed/flow/moisture/swath width, pass
+           start/end flow delay, outlying yields) before they are copied (see 'yield_cleaning.py')
+        -- Optionally drop or flag points differing from their spatial neighborhood (see 'yield_outliers.py')
+        -- Optionally assign 'field_ID' and 'owner_id' by the field boundary containing each point,
+           and remove the points outside every boundary (see 'yield_fields.py')
+        -- With the embedded DuckDB backend, the operational tables and vendor CSVs are loaded by
+           DuckDB ('yield_duckdb.py') instead
         -- Add flag for corn or soybean
+        -- When streaming, 'field_ID', 'farmer_ID' and the corn/soybean flags are attached to each
+           chunk of rows as it is loaded (see 'yield_lookups.py'), instead of by 'UPDATE' afterwards
+        -- Refresh the yield summary ('yield_summary') of the field/year groups of the loaded files
+           and write the web app's summary chart CSV (see 'yield_summary.py')
+        -- Replace the quantile sketches ('yield_sketch') of the loaded files (see 'yield_sketch.py')
+        -- Bulk-load mode (full-season rebuilds): load the scratch tables and 'yield_point' without their
+           indexes and constraints, then rebuild them over several connections (see 'yield_bulkload.py')
+        -- Update the planner statistics of the loaded tables ('ANALYZE')
 
 
 Main components to be changed by user:
@@ -53,16 +68,58 @@ Questions to angelo.podagrosi@gmail.com
 
 # Import necessary Python packages and libraries
 import os
+import sys
 import datetime
-import psycopg2
+import pipeline_settings
 import pandas as pd
+import yield_ingest
+import vendor_schemas
+import yield_geometry
+import yield_partitions
+import yield_lookups
+import yield_summary
+import yield_sketch
+import yield_cleaning
+import yield_outliers
+import yield_fields
+import yield_duckdb
+import yield_bulkload
+import pipeline_metrics
 
 # Print current time to assist in tracking total processing time
 print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each step are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'ingest_csvs'
+scriptStep = pipeline_metrics.Step(METRICS_STAGE, 'total').start()
+
+# Identify folders containing the raw CSV precision agriculture data
+# (values in the [paths] section of 'pipeline.ini' are used instead when present)
+directory_yieldJD = pipeline_settings.path('directory_yieldJD', r'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE CSVS - #1')
+    # Example: r'C:\GIS\PrecisionAg'
+directory_yieldAgFiniti = pipeline_settings.path('directory_yieldAgFiniti', r'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE CSVS - #2')
+
+# Embedded DuckDB backend ('backend = duckdb' in the [pipeline] section of 'pipeline.ini'; see 'yield_duckdb.py'):
+# the vendor CSVs are read by DuckDB's CSV reader and the Postgres code below is skipped
+if pipeline_settings.backend() == 'duckdb':
+    # Folder of the operational CSVs ('Table_Farmers.csv', 'products_combined.csv', 'AllFiles_Farm_Fields.csv', ...)
+    directory_operationalTables = pipeline_settings.path('directory_operationalTables', r'FILE PATH TO FOLDER OF OPERATIONAL TABLES')
+    duckConnection = yield_duckdb.connect()
+    for table, rows in yield_duckdb.loadOperationalTables(duckConnection, directory_operationalTables).items():
+        print("Copied " + str(rows) + " records from CSV to table: " + table)
+    for schema, directory in [(vendor_schemas.JOHN_DEERE, directory_yieldJD), (vendor_schemas.AGFINITI, directory_yieldAgFiniti)]:
+        with pipeline_metrics.Step(METRICS_STAGE, 'duckdb_' + schema.vendor) as stepVendor:
+            fileRows = yield_duckdb.ingestVendorCSVs(duckConnection, schema, directory)
+            stepVendor.rows = sum(fileRows.values())
+        print("Loaded " + str(stepVendor.rows) + " rows from " + str(len(fileRows)) + " CSVs into yield_point: " + schema.vendor)
+    duckConnection.close()
+    scriptStep.finish()
+    print("Current time: " + str(datetime.datetime.now()))
+    sys.exit()
 
 # Connect to database
+# Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
 try:
-    connection = psycopg2.connect("dbname='PrecisionAg_v1' user='postgres' host='localhost' password='PASSWORD'")
+    connection = pipeline_settings.connect()
     print("I am able to connect to the database! :)")
 except:
     print("I am unable to connect to the database.")
@@ -70,80 +127,163 @@ except:
 # Establish cursor connection to database; necessary to begin providing commands/queries to database
 cursor = connection.cursor()
 
-# Identify folders containing the raw CSV precision agriculture data
-directory_yieldJD = r'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE CSVS - #1'
-    # Example: r'C:\GIS\PrecisionAg'
-directory_yieldAgFiniti = r'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE CSVS - #2'
+# Ingest mode for the raw yield CSVs
+    # True: read each CSV in chunks and stream the rows to Postgres using 'COPY ... FROM STDIN'
+    #       (memory stays flat regardless of the number of files; no appended CSV is written)
+    # False: original approach; append every CSV into '_csvAppend_yield_point_*.csv' and 'COPY ... FROM' that file
+streamingIngest = True
+# Approximate memory ceiling (megabytes) for each chunk of raw CSV rows while streaming
+memoryLimitMB = 256
+# Parallel streaming: parse CSVs in a pool of processes while loader threads COPY the parsed chunks
+    # Each loader uses its own database connection; memory is roughly (parseWorkers + loadWorkers * (1 + queueChunks)) chunks
+    # (on Windows, parse processes are started without re-running this script; see 'yield_ingest.py')
+parallelIngest = False
+parseWorkers = max(1, (os.cpu_count() or 2) - 1)
+loadWorkers = 2
+queueChunks = 4
+# Incremental ingest (streaming only): use the 'ingest_manifest' table to load only new or changed CSVs
+    # The scratch tables are emptied at the start of each run and hold only the files loaded by this run;
+    # rows of changed files are replaced in 'yield_point' in the same transaction that updates the manifest.
+    # On re-runs the operational tables (farmer, owner, products, field) are left as they are and only
+    # the field key ('AllFiles_Farm_Fields.csv') is reloaded, so it must list the new files.
+incrementalIngest = True
+# Compute the Web Mercator point ('geom_3857') of each row during ingest (streaming only)
+    # Requires the 'geom_3857' columns created by '1_CreatingDatabaseTables.py' (with 'ingestGeometry' set to True)
+ingestGeometry = True
+
+# Partitioned 'yield_point' (created by '1_CreatingDatabaseTables.py' with 'partitionYieldPoint'; detected automatically)
+    # Sub-partitioned by 'field_id': 'partitionByField' in the [pipeline] section of 'pipeline.ini',
+    # shared with '1_CreatingDatabaseTables.py'
+partitionByField = pipeline_settings.flag('pipeline', 'partitionByField', False)
+    # Number of connections moving rows into separate partitions at the same time (1 = single 'INSERT' per vendor)
+partitionLoadWorkers = 4
+
+# Bulk-load mode (see 'yield_bulkload.py'): the scratch tables are made UNLOGGED, and the indexes, primary keys and
+# foreign keys of the scratch tables and 'yield_point' are dropped before the load and rebuilt after it,
+# over several connections at the same time
+    # Default: only when 'yield_point' is empty (first load or full-season rebuild); rebuilding the indexes of a
+    # full table costs more than updating them while loading a few new or changed files
+bulkLoadMode = yield_ingest.tableIsEmpty(cursor, "yield_point")
+    # Connections rebuilding indexes and constraints at the same time
+indexBuildWorkers = 4
+    # Memory of each index build ('maintenance_work_mem'; up to 'indexBuildWorkers' builds run at the same time)
+    # and parallel workers of each build ('max_parallel_maintenance_workers')
+maintenanceWorkMem = '1GB'
+parallelMaintenanceWorkers = 2
+
+# Yield summary ('yield_summary'): only the field/year groups of the files loaded by this run are recomputed
+    # True: recompute every group (for instance after editing 'yield_point' by hand); always done by the original approach
+rebuildSummary = False
+    # Summary chart CSV read by the web app (None to skip); example: r'C:\GIS\PrecisionAg\web\Data_SummaryChart_Yield_Dry_CORN.csv'
+summaryChartCSV = pipeline_settings.path('summaryChartCSV', None)
+
+# Remove junk points before they are loaded (thresholds by vendor in 'yield_cleaning.py')
+cleanYieldPoints = True
+# Spatial neighborhood outlier filter (streaming only; requires 'scipy'): points differing from the median
+# of their neighbors (same file and field) by more than a threshold of MADs ('yield_outliers.py');
+# holds the points of one file in memory until the end of the file
+spatialOutlierFilter = False
+    # True: drop the outliers; False: load them with 'spatial_outlier' = 1
+dropSpatialOutliers = True
+    # Threads filtering the fields of a file (or its neighbor queries) at the same time (parse processes already run in parallel)
+outlierWorkers = 1 if parallelIngest else max(1, os.cpu_count() or 1)
+# Field assignment by position (streaming only): 'field_id'/'owner_id' of the boundary of 'field_polygons_v1'
+# ('5_ImportFieldPolygonsSHP.py') containing each point replace the field key's ('yield_fields.py')
+    # Skipped (with a message) until the field polygons are loaded, for instance on the first run of the pipeline
+assignFieldsByBoundary = False
+    # True: remove the points outside every field boundary; False: keep them with the field key's 'field_id'
+clipToFieldBoundaries = False
+
+# Functions applied to every chunk of rows before it is copied to the database (streaming only)
+chunkTransforms = []
+yieldCleaner = yield_cleaning.YieldCleaner(stage = METRICS_STAGE)
+if cleanYieldPoints:
+    # First, so later transforms only process the points kept
+    chunkTransforms.append(yieldCleaner)
+if streamingIngest and spatialOutlierFilter:
+    chunkTransforms.append(yield_outliers.SpatialOutlierFilter(yield_outliers.DEFAULT_SETTINGS, dropSpatialOutliers,
+                                                               outlierWorkers, METRICS_STAGE))
+if ingestGeometry:
+    chunkTransforms.append(yield_geometry.addWebMercatorGeometry)
+
+# Operational tables are loaded on the first run only when ingesting incrementally
+loadOperationalTables = not (streamingIngest and incrementalIngest) or yield_ingest.tableIsEmpty(cursor, "farmer")
 
 ###############################################################################
 # Populate FARMER and OWNER tables
 
-print("...Populating farmer and owner tables...")
-# Populate ('COPY') SQL commands separated by commas
-commands_populateFarmerOwnerTable = (
-"""
-COPY farmer(first_name, middle_name, last_name, address1, address2, city, state, zip, phone_cell, phone_home)
-FROM 'FILE PATH TO FOLDER OF OPERATIONAL TABLES (such as C:\GIS\PrecisionAg\OperationalTables\) Table_Farmers.csv' DELIMITER ',' CSV HEADER;
-""",
-"""
-COPY owner(first_name, middle_name, last_name, address1, address2, city, state, zip, phone_cell, phone_home)
-FROM 'FILE PATH TO FOLDER OF OPERATIONAL TABLES (such as C:\GIS\PrecisionAg\OperationalTables\) Table_Owners.csv' DELIMITER ',' CSV HEADER;
-"""
-)
-
-# Loop through SQL commands using 'for' loop, executing each individually
-for command in commands_populateFarmerOwnerTable:
-    cursor.execute(command)
-print("Completed: Populated farmer and owner tables.")
-
-# Commit the changes to the database
-connection.commit()
-print("Current time: " + str(datetime.datetime.now()))
-
-
-# Populate 'products' table with information as to whether corn or soybean
-products_copy_command = (
-"""
-COPY products(productname, count, source, product, corn, soybean, company, document1, document2)
-FROM 'FILE PATH TO FOLDER OF OPERATIONAL TABLES (such as C:\GIS\PrecisionAg\OperationalTables\) products_combined.csv' DELIMITER ',' CSV HEADER;
-"""
-)
-cursor.execute(products_copy_command)
-print("Copied records from CSV to new table: Products (corn or soybean) (products)")
-# Commit the changes
-connection.commit()
-
-###############################################################################
-# Populate temporary ('_CSVimport_field') and then 'INSERT INTO' same information into final 'field' table
-# 'Farm_Fields' is used to identify the unique farm/field name combinations based on original data
+if loadOperationalTables:
+    print("...Populating farmer and owner tables...")
+    # Populate ('COPY') SQL commands separated by commas
+    commands_populateFarmerOwnerTable = (
+    """
+    COPY farmer(first_name, middle_name, last_name, address1, address2, city, state, zip, phone_cell, phone_home)
+    FROM 'FILE PATH TO FOLDER OF OPERATIONAL TABLES (such as C:\GIS\PrecisionAg\OperationalTables\) Table_Farmers.csv' DELIMITER ',' CSV HEADER;
+    """,
+    """
+    COPY owner(first_name, middle_name, last_name, address1, address2, city, state, zip, phone_cell, phone_home)
+    FROM 'FILE PATH TO FOLDER OF OPERATIONAL TABLES (such as C:\GIS\PrecisionAg\OperationalTables\) Table_Owners.csv' DELIMITER ',' CSV HEADER;
+    """
+    )
+
+    # Loop through SQL commands using 'for' loop, executing each individually
+    for command in commands_populateFarmerOwnerTable:
+        cursor.execute(command)
+    print("Completed: Populated farmer and owner tables.")
+
+    # Commit the changes to the database
+    connection.commit()
+    print("Current time: " + str(datetime.datetime.now()))
+
+
+    # Populate 'products' table with information as to whether corn or soybean
+    products_copy_command = (
+    """
+    COPY products(productname, count, source, product, corn, soybean, company, document1, document2)
+    FROM 'FILE PATH TO FOLDER OF OPERATIONAL TABLES (such as C:\GIS\PrecisionAg\OperationalTables\) products_combined.csv' DELIMITER ',' CSV HEADER;
+    """
+    )
+    cursor.execute(products_copy_command)
+    print("Copied records from CSV to new table: Products (corn or soybean) (products)")
+    # Commit the changes
+    connection.commit()
+
+    ###############################################################################
+    # Populate temporary ('_CSVimport_field') and then 'INSERT INTO' same information into final 'field' table
+    # 'Farm_Fields' is used to identify the unique farm/field name combinations based on original data
                      
-fields_copy_command = (
-"""
-COPY _CSVimport_field(jd_farm, jd_field, fv_farm, fv_field, agf_farm, agf_field, final_farm, finalfield, field_id, owner_id)
-FROM 'FILE PATH TO FOLDER OF OPERATIONAL TABLES (such as C:\GIS\PrecisionAg\OperationalTables\) Farm_Fields.csv' DELIMITER ',' CSV HEADER;
-"""
-)
-cursor.execute(fields_copy_command)
-print("Copied records from CSV to new table: Fields (_CSVimport_field)")
-# Commit the changes
-connection.commit()
-
-field_insertinto_command = (
-"""
-INSERT INTO field(field_id, farm_name, field_name, owner_id)
-SELECT field_id, final_farm, finalfield, owner_id
-FROM _CSVimport_field;
-"""
-)
-
-cursor.execute(field_insertinto_command)
-print("Moved records from temporary table (from CSV) to new final table: Field")
-# Commit the changes
-connection.commit()
+    fields_copy_command = (
+    """
+    COPY _CSVimport_field(jd_farm, jd_field, fv_farm, fv_field, agf_farm, agf_field, final_farm, finalfield, field_id, owner_id)
+    FROM 'FILE PATH TO FOLDER OF OPERATIONAL TABLES (such as C:\GIS\PrecisionAg\OperationalTables\) Farm_Fields.csv' DELIMITER ',' CSV HEADER;
+    """
+    )
+    cursor.execute(fields_copy_command)
+    print("Copied records from CSV to new table: Fields (_CSVimport_field)")
+    # Commit the changes
+    connection.commit()
+
+    field_insertinto_command = (
+    """
+    INSERT INTO field(field_id, farm_name, field_name, owner_id)
+    SELECT field_id, final_farm, finalfield, owner_id
+    FROM _CSVimport_field;
+    """
+    )
+
+    cursor.execute(field_insertinto_command)
+    print("Moved records from temporary table (from CSV) to new final table: Field")
+    # Commit the changes
+    connection.commit()
+else:
+    print("Operational tables already populated; not reloaded (incremental ingest).")
 
 
 # Populate temporary ('_CSVimport_field_key') and then 'INSERT INTO' same information into final 'field' table
 # 'AllFiles_Farm_Fields.csv' is a list of every file name and used to identify the event (planting/harvesting), year, farmerID and farm/field
+if not loadOperationalTables:
+    # Reload the list of files so that new files are identified
+    cursor.execute("TRUNCATE _CSVimport_field_key;")
 fieldskey_copy_command = (
 """
 COPY _CSVimport_field_key(file_name, source, event, year, farmerid, final_farm, final_field, notes)
@@ -158,7 +298,7 @@ connection.commit()
 # Adding 'field_id' field to "_CSVimport_field_key" and then populate based using 'inner join update'
 _csvimport_fieldkey_fieldID_command = ("""
 ALTER TABLE _csvimport_field_key
-ADD COLUMN field_ID smallint;""",
+ADD COLUMN IF NOT EXISTS field_ID smallint;""",
 """
 UPDATE _csvimport_field_key
 SET field_id = f.field_id
@@ -171,6 +311,53 @@ for cursorCommand in _csvimport_fieldkey_fieldID_command:
 print("Added 'field_ID' column to _CSVimport_field_key and populated with 'inner join update' on 'field' table")
 connection.commit()
 
+# Columns populated from the field key and products (created by '1_CreatingDatabaseTables.py'; added here for older databases)
+# Adding a column without a default does not rewrite the table
+addLookupColumns_cursorCommand = ("""
+ALTER TABLE _CSVimport_yield_point_jd
+ADD COLUMN IF NOT EXISTS field_ID smallint NULL REFERENCES field (field_id),
+ADD COLUMN IF NOT EXISTS farmer_id smallint NULL REFERENCES farmer (farmer_ID),
+ADD COLUMN IF NOT EXISTS corn smallint NULL,
+ADD COLUMN IF NOT EXISTS soybean smallint NULL,
+ADD COLUMN IF NOT EXISTS spatial_outlier smallint NULL,
+ADD COLUMN IF NOT EXISTS owner_id smallint NULL REFERENCES owner (owner_id);""",
+"""
+ALTER TABLE _CSVimport_yield_point_agfiniti
+ADD COLUMN IF NOT EXISTS field_ID smallint NULL REFERENCES field (field_id),
+ADD COLUMN IF NOT EXISTS farmer_id smallint NULL REFERENCES farmer (farmer_ID),
+ADD COLUMN IF NOT EXISTS corn smallint NULL,
+ADD COLUMN IF NOT EXISTS soybean smallint NULL,
+ADD COLUMN IF NOT EXISTS spatial_outlier smallint NULL,
+ADD COLUMN IF NOT EXISTS owner_id smallint NULL REFERENCES owner (owner_id);""",
+"""
+ALTER TABLE yield_point
+ADD COLUMN IF NOT EXISTS corn smallint NULL,
+ADD COLUMN IF NOT EXISTS soybean smallint NULL,
+ADD COLUMN IF NOT EXISTS spatial_outlier smallint NULL,
+ADD COLUMN IF NOT EXISTS owner_id smallint NULL REFERENCES owner (owner_id);"""
+)
+for command in addLookupColumns_cursorCommand:
+    cursor.execute(command)
+connection.commit()
+
+if streamingIngest:
+    # Read the field key and product flags once; every chunk gets 'field_id', 'farmer_id', 'corn' and 'soybean' before COPY
+    fieldKey = yield_lookups.loadFieldKey(cursor)
+    productFlags = yield_lookups.loadProductFlags(cursor, "yield_point")
+    chunkTransforms.append(yield_lookups.YieldLookups(fieldKey, productFlags))
+    print("Loaded lookups: " + str(len(fieldKey)) + " files in field key, " + str(len(productFlags)) + " products.")
+
+if streamingIngest and assignFieldsByBoundary:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (yield_fields.FIELD_TABLE,))
+    if cursor.fetchone()[0]:
+        # After the field key lookups, so the boundaries replace the field key's 'field_id'
+        fieldBoundaries = yield_fields.loadFieldBoundaries(cursor)
+        chunkTransforms.append(yield_fields.FieldAssigner(fieldBoundaries, clipToFieldBoundaries, METRICS_STAGE))
+        print("Loaded " + str(len(fieldBoundaries)) + " field boundaries.")
+    else:
+        print("Field polygon table not found; fields are assigned by the field key only.")
+        assignFieldsByBoundary = False
+
 ###############################################################################
 ###############################################################################
 """
@@ -180,10 +367,28 @@ combining the records into one raw CSV file.
 The code then uses 'COPY...FROM' to copy these records from the compiled CSV
 to the existing Postgres table to hold all of the raw CSV records.
 
+When 'streamingIngest' is True (top of script), the CSVs are instead read in chunks
+(see 'yield_ingest.py') and each chunk is copied with 'COPY...FROM STDIN', so no compiled
+CSV is written and memory use does not grow with the number of files.
+
 Included in the code below are several 'print' statements, currently commented out,
 that can be helpful when experimenting with the script or verifying the status during the processing.
 
 """
+###############################################################################
+# Bulk-load mode: drop the indexes and constraints of the scratch tables and 'yield_point' before the load
+# (recorded in 'bulk_load_deferred' and rebuilt after the rows are moved to 'yield_point')
+
+if bulkLoadMode:
+    for table in yield_bulkload.STAGING_TABLES:
+        # Scratch tables of databases created before they were UNLOGGED (the table is rewritten once)
+        if yield_bulkload.setUnlogged(cursor, table):
+            print("Made scratch table UNLOGGED: " + table)
+    with pipeline_metrics.Step(METRICS_STAGE, 'bulk_load_drop_indexes') as stepDrop:
+        stepDrop.rows = yield_bulkload.deferIndexes(cursor)
+    connection.commit()
+    print("Bulk-load mode: dropped " + str(stepDrop.rows) + " indexes and constraints of the scratch tables and 'yield_point'.")
+
 #########################################################
 # Yield - John Deere
 # Note that field 'id_pd' is being populated with the ID generated from the pandas dataframe.
@@ -192,50 +397,78 @@ that can be helpful when experimenting with the script or verifying the status d
 print("...Copying records from CSV to new table: John Deere yield data...")
 print("Current time: " + str(datetime.datetime.now()))
 
-yield_JD_columns = ['longitude','latitude','field','dataset','product','obj__id','distance_f','track_deg_','duration_s','elevation_','time','area_count','swth_wdth','y_offset_f','crop_flw_m','moisture__','yld_mass_w','yld_vol_we','yld_mass_d','yld_vol_dr','humidity__','air_temp__','wind_speed','soil_temp_','pass_num','speed_mph_','prod_ac_h_','crop_flw_v', 'date']
-
-# Create empty 'pandas' dataframe to contain dataframes of raw CSVs to be created
-dfs_yieldJD = []
-
-# 'for' loop through the files in the directory
-for input_file in os.listdir(directory_yieldJD):
-    # Print the file being processed
-    #print (os.path.join(directory, input_file))    
+# Column names and data types of the John Deere CSVs are declared in 'vendor_schemas.py'
+yield_JD_columns = vendor_schemas.stagingColumns(vendor_schemas.JOHN_DEERE)
+
+# Files to load: every CSV, or only the new or changed CSVs when ingesting incrementally
+manifestJD = []
+filesJD = None
+if streamingIngest and incrementalIngest:
+    cursor.execute("TRUNCATE _CSVimport_yield_point_JD;")
+    manifestJD = yield_ingest.planIncrementalLoad(cursor, directory_yieldJD, vendor_schemas.JOHN_DEERE)
+    filesJD = [entry.input_file for entry in manifestJD]
+    print(str(len(filesJD)) + " new or changed John Deere CSVs to load.")
+    connection.commit()
+
+stepJD = pipeline_metrics.Step(METRICS_STAGE, 'load_johndeere').start()
+stepJD.bytes = pipeline_metrics.fileBytes([os.path.join(directory_yieldJD, input_file) for input_file in yield_ingest.listYieldCSVs(directory_yieldJD, filesJD)])
+if streamingIngest and parallelIngest:
+    # Parse CSVs in parallel; loader connections commit their own chunks
+    fileRowsJD = yield_ingest.parallelStreamYieldDirectory(pipeline_settings.connectionFactory(loadWorkers), directory_yieldJD, vendor_schemas.JOHN_DEERE,
+                                                           memoryLimitMB, parseWorkers, loadWorkers, queueChunks, filesJD, chunkTransforms)
+    stepJD.rows = sum(fileRowsJD.values())
+    print("Copied " + str(sum(fileRowsJD.values())) + " records from CSVs to new table: John Deere yield data")
+elif streamingIngest:
+    # Stream each CSV in chunks directly into the existing Postgres table using 'COPY ... FROM STDIN'
+    fileRowsJD = yield_ingest.streamYieldDirectory(cursor, directory_yieldJD, vendor_schemas.JOHN_DEERE, memoryLimitMB, filesJD, chunkTransforms)
+    stepJD.rows = sum(fileRowsJD.values())
+    print("Copied " + str(sum(fileRowsJD.values())) + " records from CSVs to new table: John Deere yield data")
+else:
+    # Create empty 'pandas' dataframe to contain dataframes of raw CSVs to be created
+    dfs_yieldJD = []
+
+    # 'for' loop through the files in the directory
+    for input_file in os.listdir(directory_yieldJD):
+        # Print the file being processed
+        #print (os.path.join(directory, input_file))    
     
-    # Loop through only CSVs (file extension .csv)
-    if input_file[-4:] == '.csv':
-        print(input_file)
-        #print(str(input_file[:-4]))                
-
-        # Read the CSV into a 'pandas' dataframe using the 'yield_JD_columns' field headings
-        df = pd.read_csv((os.path.join(directory_yieldJD,input_file)),header = 0, names = yield_JD_columns)
-
-        # Add column to contain string of original CSV file name        
-        df['org_file'] = str(input_file[:-4])
-        df['file_source'] = "johndeere"
+        # Loop through only CSVs (file extension .csv)
+        if input_file[-4:] == '.csv':
+            print(input_file)
+            #print(str(input_file[:-4]))                
+
+            # Read the CSV into a 'pandas' dataframe using the 'yield_JD_columns' field headings
+            df = pd.read_csv((os.path.join(directory_yieldJD,input_file)),header = 0, names = yield_JD_columns)
+
+            # Add column to contain string of original CSV file name        
+            df['org_file'] = str(input_file[:-4])
+            df['file_source'] = "johndeere"
+            if cleanYieldPoints:
+                df = yieldCleaner.cleanFile(df)
         
-        # Append current 'pandas' data frame to existing 'dfs_yieldJD' dataframe
-        dfs_yieldJD.append(df)
-
-# Concatenate dataframes into new dataframe
-df_1 = pd.concat(dfs_yieldJD)
-# Output the final, appended dataframe ('dfs_yieldJD') to a CSV
-df_1.to_csv(os.path.join(directory_yieldJD, "_csvAppend_yield_point_JohnDeere2.csv"), encoding='utf-8')
-
-# Copy the CSV containing the appended raw CSV data into the existing Postgres table
-jdYieldCopy_Command = (
-"""
-COPY _CSVimport_yield_point_JD(id_pd, longitude, latitude, field, dataset, product, obj__id, distance_f, track_deg_, duration_s, elevation_, time, area_count, swth_wdth, y_offset_f, crop_flw_m, moisture__, yld_mass_w, yld_vol_we, yld_mass_d, yld_vol_dr, humidity__, air_temp__, wind_speed, soil_temp_, pass_num, speed_mph_, prod_ac_h_, crop_flw_v, date, org_file, file_source)
-FROM 'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE CSVS - #1 \_csvAppend_yield_point_JohnDeere2.csv' DELIMITER ',' CSV HEADER;
-"""
-)
-cursor.execute(jdYieldCopy_Command)
-print("Copied records from CSV to new table: John Deere yield data")
+            # Append current 'pandas' data frame to existing 'dfs_yieldJD' dataframe
+            dfs_yieldJD.append(df)
+
+    # Concatenate dataframes into new dataframe
+    df_1 = pd.concat(dfs_yieldJD)
+    # Output the final, appended dataframe ('dfs_yieldJD') to a CSV
+    df_1.to_csv(os.path.join(directory_yieldJD, "_csvAppend_yield_point_JohnDeere2.csv"), encoding='utf-8')
+
+    # Copy the CSV containing the appended raw CSV data into the existing Postgres table
+    jdYieldCopy_Command = (
+    """
+    COPY _CSVimport_yield_point_JD(id_pd, longitude, latitude, field, dataset, product, obj__id, distance_f, track_deg_, duration_s, elevation_, time, area_count, swth_wdth, y_offset_f, crop_flw_m, moisture__, yld_mass_w, yld_vol_we, yld_mass_d, yld_vol_dr, humidity__, air_temp__, wind_speed, soil_temp_, pass_num, speed_mph_, prod_ac_h_, crop_flw_v, date, org_file, file_source)
+    FROM 'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE CSVS - #1 \_csvAppend_yield_point_JohnDeere2.csv' DELIMITER ',' CSV HEADER;
+    """
+    )
+    stepJD.rows = len(df_1)
+    cursor.execute(jdYieldCopy_Command)
+    print("Copied records from CSV to new table: John Deere yield data")
 
 # Commit the changes
 connection.commit()
 print("Database changes committed: John Deere yield data.")
-print("Current time: " + str(datetime.datetime.now()))
+stepJD.finish()
 
 ###############################################################################
 #Yield - AgFiniti
@@ -245,129 +478,257 @@ print("Current time: " + str(datetime.datetime.now()))
 print("...Copying records from CSV to new table: AgFiniti yield data...")
 print("Current time: " + str(datetime.datetime.now()))
 
-yield_AgFiniti_columns = ['longitude','latitude','field','dataset','product','obj__id','track_deg_','swth_wdth','distance_f','duration_s','elevation_','area_count','diff_statu','time','x_offset_f','y_offset_f','satellites','hding_veh_','diff_statu_1','active_row','vdop','hdop','pdop','crop_flw_m','moisture__','grain_temp','pass_num','yld_mass_d','yld_vol_dr','yld_mass_w','yld_vol_we','speed_mph_','prod_ac_h_','crop_flw_v','date']
-
-# Create empty 'pandas' dataframe to contain dataframes of raw CSVs to be created
-dfs_yieldAF = []
-
-# 'for' loop through the files in the directory
-for input_file in os.listdir(directory_yieldAgFiniti):
-    # Print the file being processed
-    #print (os.path.join(directory, input_file))    
+# Column names and data types of the AgFiniti CSVs are declared in 'vendor_schemas.py'
+yield_AgFiniti_columns = vendor_schemas.stagingColumns(vendor_schemas.AGFINITI)
+
+# Files to load: every CSV, or only the new or changed CSVs when ingesting incrementally
+manifestAF = []
+filesAF = None
+if streamingIngest and incrementalIngest:
+    cursor.execute("TRUNCATE _CSVimport_yield_point_AgFiniti;")
+    manifestAF = yield_ingest.planIncrementalLoad(cursor, directory_yieldAgFiniti, vendor_schemas.AGFINITI)
+    filesAF = [entry.input_file for entry in manifestAF]
+    print(str(len(filesAF)) + " new or changed AgFiniti CSVs to load.")
+    connection.commit()
+
+stepAF = pipeline_metrics.Step(METRICS_STAGE, 'load_agfiniti').start()
+stepAF.bytes = pipeline_metrics.fileBytes([os.path.join(directory_yieldAgFiniti, input_file) for input_file in yield_ingest.listYieldCSVs(directory_yieldAgFiniti, filesAF)])
+if streamingIngest and parallelIngest:
+    # Parse CSVs in parallel; loader connections commit their own chunks
+    fileRowsAF = yield_ingest.parallelStreamYieldDirectory(pipeline_settings.connectionFactory(loadWorkers), directory_yieldAgFiniti, vendor_schemas.AGFINITI,
+                                                           memoryLimitMB, parseWorkers, loadWorkers, queueChunks, filesAF, chunkTransforms)
+    stepAF.rows = sum(fileRowsAF.values())
+    print("Copied " + str(sum(fileRowsAF.values())) + " records from CSVs to new table: Yield - AgFiniti data")
+elif streamingIngest:
+    # Stream each CSV in chunks directly into the existing Postgres table using 'COPY ... FROM STDIN'
+    fileRowsAF = yield_ingest.streamYieldDirectory(cursor, directory_yieldAgFiniti, vendor_schemas.AGFINITI, memoryLimitMB, filesAF, chunkTransforms)
+    stepAF.rows = sum(fileRowsAF.values())
+    print("Copied " + str(sum(fileRowsAF.values())) + " records from CSVs to new table: Yield - AgFiniti data")
+else:
+    # Create empty 'pandas' dataframe to contain dataframes of raw CSVs to be created
+    dfs_yieldAF = []
+
+    # 'for' loop through the files in the directory
+    for input_file in os.listdir(directory_yieldAgFiniti):
+        # Print the file being processed
+        #print (os.path.join(directory, input_file))    
     
-    # Loop through only CSVs (file extension .csv)
-    if input_file[-4:] == '.csv':
-        print(input_file)
-        #print(str(input_file[:-4]))                
+        # Loop through only CSVs (file extension .csv)
+        if input_file[-4:] == '.csv':
+            print(input_file)
+            #print(str(input_file[:-4]))                
         
-        # Read the CSV into a 'pandas' dataframe using the 'yield_AgFiniti_columns' field headings
-        df = pd.read_csv((os.path.join(directory_yieldAgFiniti,input_file)),header = 0, names = yield_AgFiniti_columns)
+            # Read the CSV into a 'pandas' dataframe using the 'yield_AgFiniti_columns' field headings
+            df = pd.read_csv((os.path.join(directory_yieldAgFiniti,input_file)),header = 0, names = yield_AgFiniti_columns)
         
-        # Add column to contain string of original CSV file name        
-        df['org_file'] = str(input_file[:-4])
-        df['file_source'] = "agfiniti"
+            # Add column to contain string of original CSV file name        
+            df['org_file'] = str(input_file[:-4])
+            df['file_source'] = "agfiniti"
+            if cleanYieldPoints:
+                df = yieldCleaner.cleanFile(df)
         
-        # Append current 'pandas' data frame to existing 'dfs_yieldJD' dataframe
-        dfs_yieldAF.append(df)
-
-# Concatenate dataframes into new dataframe
-df_1 = pd.concat(dfs_yieldAF)
-# Output the final, appended dataframe ('dfs_yieldJD') to a CSV
-df_1.to_csv(os.path.join(directory_yieldAgFiniti, "_csvAppend_yield_point_AgFiniti2.csv"), encoding='utf-8')
-
-# Copy the CSV containing the appended raw CSV data into the existing Postgres table
-yield_agfiniti_copy_command = (
-"""
-COPY _CSVimport_yield_point_AgFiniti(id_pd, longitude, latitude, field, dataset, product, obj__id, track_deg_, swth_wdth, distance_f, duration_s, elevation_, area_count, diff_statu, time, x_offset_f, y_offset_f, satellites, hding_veh_, diff_statu_1, active_row, vdop, hdop, pdop, crop_flw_m, moisture__, grain_temp, pass_num, yld_mass_d, yld_vol_dr, yld_mass_w, yld_vol_we, speed_mph_, prod_ac_h_, crop_flw_v, date, org_file, file_source)
-FROM 'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE CSVS - #2 \_csvAppend_yield_point_AgFiniti2.csv' DELIMITER ',' CSV HEADER;
-"""
-)
-cursor.execute(yield_agfiniti_copy_command)
-print("Copied records from CSV to new table: Yield - AgFiniti data")
+            # Append current 'pandas' data frame to existing 'dfs_yieldJD' dataframe
+            dfs_yieldAF.append(df)
+
+    # Concatenate dataframes into new dataframe
+    df_1 = pd.concat(dfs_yieldAF)
+    # Output the final, appended dataframe ('dfs_yieldJD') to a CSV
+    df_1.to_csv(os.path.join(directory_yieldAgFiniti, "_csvAppend_yield_point_AgFiniti2.csv"), encoding='utf-8')
+
+    # Copy the CSV containing the appended raw CSV data into the existing Postgres table
+    yield_agfiniti_copy_command = (
+    """
+    COPY _CSVimport_yield_point_AgFiniti(id_pd, longitude, latitude, field, dataset, product, obj__id, track_deg_, swth_wdth, distance_f, duration_s, elevation_, area_count, diff_statu, time, x_offset_f, y_offset_f, satellites, hding_veh_, diff_statu_1, active_row, vdop, hdop, pdop, crop_flw_m, moisture__, grain_temp, pass_num, yld_mass_d, yld_vol_dr, yld_mass_w, yld_vol_we, speed_mph_, prod_ac_h_, crop_flw_v, date, org_file, file_source)
+    FROM 'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE CSVS - #2 \_csvAppend_yield_point_AgFiniti2.csv' DELIMITER ',' CSV HEADER;
+    """
+    )
+    stepAF.rows = len(df_1)
+    cursor.execute(yield_agfiniti_copy_command)
+    print("Copied records from CSV to new table: Yield - AgFiniti data")
 
 # Commit the changes
 connection.commit()
 print("Database changes committed: Yield - AgFiniti data.")
-print("Current time: " + str(datetime.datetime.now()))
+if cleanYieldPoints and not parallelIngest:
+    # (parse processes of the parallel ingest print their own counts)
+    print("Cleaning of raw yield points: " + yieldCleaner.report())
+stepAF.finish()
 
 ###############################################################################
 # Add 'field_id' and 'farmer_id' to all the raw CSV point files and populate 
 # using inner join to “_CSVimport_field_key” on file name field (‘file_name’)
-
-print("""Adding 'field_id' and 'farmer_id' fields to CSV table and populating by joining to "field" table based on the original file name: _CSVimport_yield_point_agfiniti.""")
-yield_agfiniti_point_addFields_cursorCommand = ("""
+# (original approach only; when streaming they are attached to each chunk during the load)
+
+if streamingIngest:
+    # Report rows loaded without a match, rather than leaving NULLs unnoticed
+    missingFiles = yield_lookups.unmatchedFiles(fieldKey, list(fileRowsJD) + list(fileRowsAF))
+    if missingFiles:
+        print("WARNING: " + str(len(missingFiles)) + " files not found in the field key (field_id/farmer_id left NULL): " + str(missingFiles))
+    for table in ("_CSVimport_yield_point_jd", "_CSVimport_yield_point_agfiniti"):
+        missingProducts = yield_lookups.unmatchedProducts(cursor, table)
+        if missingProducts:
+            print("WARNING: products not found in 'products' (corn/soybean left NULL) in " + table + ": " + str(missingProducts))
+else:
+    print("""Adding 'field_id' and 'farmer_id' fields to CSV table and populating by joining to "field" table based on the original file name: _CSVimport_yield_point_agfiniti.""")
+    yield_agfiniti_point_addFields_cursorCommand = ("""
 ALTER TABLE _CSVimport_yield_point_agfiniti
-ADD COLUMN field_ID smallint NULL REFERENCES field (field_id),
-ADD COLUMN farmer_id smallint NULL REFERENCES farmer (farmer_ID);""",
-"""
+ADD COLUMN IF NOT EXISTS field_ID smallint NULL REFERENCES field (field_id),
+ADD COLUMN IF NOT EXISTS farmer_id smallint NULL REFERENCES farmer (farmer_ID);""",
+    """
 UPDATE _CSVimport_yield_point_agfiniti
 SET field_id = fk.field_id, farmer_id = fk.farmerid
 FROM _CSVimport_field_key as fk
 WHERE _CSVimport_yield_point_agfiniti.org_file = fk.file_name;"""
-)
-for command in yield_agfiniti_point_addFields_cursorCommand:
-    cursor.execute(command)
-print("""Completed populating 'field_id' and 'farmer_id' fields on CSV table: _CSVimport_yield_point_agfiniti.""")
-connection.commit()
-print("Current time: " + str(datetime.datetime.now()))
-
-print("""Adding 'field_id' and 'farmer_id' fields to CSV table and populating by joining to "field" table based on the original file name: _CSVimport_yield_point_jd.""")
-yield_jd_point_addFields_cursorCommand = ("""
+    )
+    for command in yield_agfiniti_point_addFields_cursorCommand:
+        pipeline_metrics.executeMeasured(cursor, METRICS_STAGE, 'field_farmer_agfiniti ' + command.split()[0].lower(), command)
+    print("""Completed populating 'field_id' and 'farmer_id' fields on CSV table: _CSVimport_yield_point_agfiniti.""")
+    connection.commit()
+
+    print("""Adding 'field_id' and 'farmer_id' fields to CSV table and populating by joining to "field" table based on the original file name: _CSVimport_yield_point_jd.""")
+    yield_jd_point_addFields_cursorCommand = ("""
 ALTER TABLE _CSVimport_yield_point_jd
-ADD COLUMN field_ID smallint NULL REFERENCES field (field_id),
-ADD COLUMN farmer_id smallint NULL REFERENCES farmer (farmer_ID);""",
-"""
+ADD COLUMN IF NOT EXISTS field_ID smallint NULL REFERENCES field (field_id),
+ADD COLUMN IF NOT EXISTS farmer_id smallint NULL REFERENCES farmer (farmer_ID);""",
+    """
 UPDATE _CSVimport_yield_point_jd
 SET field_id = fk.field_id, farmer_id = fk.farmerid
 FROM _CSVimport_field_key as fk
 WHERE _CSVimport_yield_point_jd.org_file = fk.file_name;"""
-)
-for command in yield_jd_point_addFields_cursorCommand:
-    cursor.execute(command)
-print("""Completed populating 'field_id' and 'farmer_id' fields on CSV table: _CSVimport_yield_point_jd.""")
-connection.commit()
-print("Current time: " + str(datetime.datetime.now()))
+    )
+    for command in yield_jd_point_addFields_cursorCommand:
+        pipeline_metrics.executeMeasured(cursor, METRICS_STAGE, 'field_farmer_johndeere ' + command.split()[0].lower(), command)
+    print("""Completed populating 'field_id' and 'farmer_id' fields on CSV table: _CSVimport_yield_point_jd.""")
+    connection.commit()
 
 ###############################################################################
 # Copy/move the two separate, vendor-specific tables of from raw CSV yield data into a final "yield" table
 
 print("""Copying/moving all records from raw CSV yield point files (both John Deere and AgFiniti) to "yield_point" table.""")
-yield_point_finaltable_populate_cursorCommand = ("""
-INSERT INTO yield_point(longitude,latitude,field,dataset,product,obj__id,track_deg_,swth_wdth,distance_f,duration_s,elevation_,area_count,diff_statu,"time",x_offset_f,y_offset_f,satellites,hding_veh_,diff_statu_1,active_row,vdop,hdop,pdop,crop_flw_m,moisture__,humidity__,air_temp__,grain_temp,soil_temp__,wind_speed,pass_num,yld_mass_d,yld_vol_dr,yld_mass_w,yld_vol_we,speed_mph_,prod_ac_h_,crop_flw_v,date,org_file,file_source,field_ID,farmer_id)
-SELECT longitude,latitude,field,dataset,product,obj__id,track_deg_,swth_wdth,distance_f,duration_s,elevation_,area_count, NULL, "time", NULL, y_offset_f, NULL, NULL, NULL, NULL, NULL, NULL, NULL, crop_flw_m, moisture__, humidity__, air_temp__, NULL, soil_temp_, wind_speed, pass_num, yld_mass_d, yld_vol_dr, yld_mass_w, yld_vol_we, speed_mph_, prod_ac_h_, crop_flw_v, date, org_file, file_source, field_id, farmer_id
-FROM _CSVimport_yield_point_jd;""",
-"""
-INSERT INTO yield_point(longitude,latitude,field,dataset,product,obj__id,track_deg_,swth_wdth,distance_f,duration_s,elevation_,area_count,diff_statu,"time",x_offset_f,y_offset_f,satellites,hding_veh_,diff_statu_1,active_row,vdop,hdop,pdop,crop_flw_m,moisture__,humidity__,air_temp__,grain_temp,soil_temp__,wind_speed,pass_num,yld_mass_d,yld_vol_dr,yld_mass_w,yld_vol_we,speed_mph_,prod_ac_h_,crop_flw_v,date,org_file,file_source,field_ID,farmer_id)
-SELECT longitude,latitude,field,dataset,product,obj__id,track_deg_,swth_wdth,distance_f,duration_s,elevation_,area_count, diff_statu, "time", x_offset_f, y_offset_f, satellites, hding_veh_, diff_statu_1, active_row, vdop, hdop, pdop, crop_flw_m, moisture__, NULL, NULL, grain_temp, NULL, NULL, pass_num, yld_mass_d, yld_vol_dr, yld_mass_w, yld_vol_we, speed_mph_, prod_ac_h_, crop_flw_v, date, org_file, file_source, field_id, farmer_id
-FROM _CSVimport_yield_point_AgFiniti;""")
+# Planner statistics of the loaded scratch tables (read by the 'INSERT' and the summary groups below)
+yield_bulkload.analyzeTables(cursor, yield_bulkload.STAGING_TABLES)
+# The column mapping of each vendor's scratch table to "yield_point" is declared in 'vendor_schemas.py'
+yieldPointExtraColumns = ['org_file', 'file_source', 'field_id', 'farmer_id', 'corn', 'soybean']
+if streamingIngest and ingestGeometry:
+    yieldPointExtraColumns.append('geom_3857')
+if streamingIngest and spatialOutlierFilter and not dropSpatialOutliers:
+    yieldPointExtraColumns.append('spatial_outlier')
+if streamingIngest and assignFieldsByBoundary:
+    yieldPointExtraColumns.append('owner_id')
+yield_point_finaltable_populate_cursorCommand = (
+yield_ingest.yieldPointInsertCommand(vendor_schemas.JOHN_DEERE, yieldPointExtraColumns),
+yield_ingest.yieldPointInsertCommand(vendor_schemas.AGFINITI, yieldPointExtraColumns)
+)
 
-for command in yield_point_finaltable_populate_cursorCommand:
-    cursor.execute(command)
+partitionedYieldPoint = yield_partitions.isPartitioned(cursor, "yield_point")
+if partitionedYieldPoint:
+    # Create the partitions of any new season (and field); committed so that other connections can load them
+    partitionKeys = yield_partitions.partitionKeys(cursor, [vendor_schemas.JOHN_DEERE, vendor_schemas.AGFINITI], partitionByField)
+    yield_partitions.ensurePartitions(cursor, partitionKeys, partitionByField)
+    connection.commit()
+    print("Partitions of 'yield_point' ready for: " + str(partitionKeys))
+
+parallelPartitionLoad = partitionedYieldPoint and partitionLoadWorkers > 1
+reloadPlan = manifestJD + manifestAF
+summaryGroups = yield_summary.stagingGroups(cursor, [vendor_schemas.JOHN_DEERE, vendor_schemas.AGFINITI])
+if streamingIngest and incrementalIngest:
+    # Summary groups of the rows being replaced (a changed file may no longer cover them)
+    summaryGroups |= yield_summary.fileGroups(cursor, reloadPlan)
+    # ... recorded, with their extents, for the incremental tiles, grid and export too (committed with the manifest)
+    yield_ingest.recordReplacedGroups(cursor, reloadPlan)
+    # Remove the existing rows of new or changed files; the new rows are inserted below and
+    # the deletion is committed with the manifest. When partitions are loaded over separate
+    # connections, each of those partitions deletes its own old rows in its load transaction (old rows
+    # left in other partitions, by a file moved to another year or field, are deleted here and may stay
+    # visible next to the new rows until the commit below)
+    loadedPartitions = []
+    if parallelPartitionLoad:
+        loadedPartitions = [yield_partitions.partitionName(year, fieldID, partitionByField) for year, fieldID in partitionKeys]
+    with pipeline_metrics.Step(METRICS_STAGE, 'yield_point_delete_reloaded'):
+        yield_ingest.deleteYieldPointFiles(cursor, reloadPlan, loadedPartitions)
+stepYieldPoint = pipeline_metrics.Step(METRICS_STAGE, 'yield_point_insert', rows = 0).start()
+if parallelPartitionLoad:
+    # Move rows into each partition over separate connections at the same time (each commits on its own,
+    # together with the deletion of the old rows of the reloaded files in that partition)
+    rowsMoved = yield_partitions.parallelInsertPartitions(pipeline_settings.connectionFactory(partitionLoadWorkers),
+                                                          [vendor_schemas.JOHN_DEERE, vendor_schemas.AGFINITI],
+                                                          partitionKeys, yieldPointExtraColumns, partitionByField, partitionLoadWorkers,
+                                                          reloadPlan)
+    print("Moved " + str(rowsMoved) + " records into the partitions of 'yield_point'.")
+    stepYieldPoint.rows = rowsMoved
+else:
+    for command in yield_point_finaltable_populate_cursorCommand:
+        cursor.execute(command)
+        stepYieldPoint.rows += cursor.rowcount
+if streamingIngest and incrementalIngest:
+    # Record the loaded files in the manifest, committed together with their rows
+    yield_ingest.recordManifest(cursor, manifestJD, fileRowsJD)
+    yield_ingest.recordManifest(cursor, manifestAF, fileRowsAF)
 print("""Completed copying/moving all records from raw CSV yield point files (both John Deere and AgFiniti) to "yield_point" table.""")
 connection.commit()
-print("Current time: " + str(datetime.datetime.now()))
+stepYieldPoint.finish()
+
+# Rebuild the indexes and constraints dropped by the bulk-load mode (also those left dropped by a failed run),
+# over separate connections, then update the planner statistics of 'yield_point'
+with pipeline_metrics.Step(METRICS_STAGE, 'bulk_load_rebuild_indexes') as stepRebuild:
+    stepRebuild.rows = yield_bulkload.rebuildDeferred(pipeline_settings.connectionFactory(indexBuildWorkers), cursor, indexBuildWorkers,
+                                                      maintenanceWorkMem, parallelMaintenanceWorkers)
+connection.commit()
+if stepRebuild.rows:
+    print("Rebuilt indexes and constraints (" + str(stepRebuild.rows) + " commands).")
+with pipeline_metrics.Step(METRICS_STAGE, 'analyze'):
+    yield_bulkload.analyzeTables(cursor, [yield_bulkload.YIELD_POINT])
+connection.commit()
 
 ###############################################################################
 # Add 'corn' and 'soybean' flags to the planting and yield tables and populate product "products" table populated manually based on unique product names
+# (original approach only; when streaming the flags are copied from the scratch tables above)
 
-print("""Adding 'corn' and 'soybean' fields to final yield tables and populating by joining to "products" table based on 'product' and 'source' fields.""")
-yield_addCornSoybeanFields_cursorCommand = ("""
+if not streamingIngest:
+    print("""Adding 'corn' and 'soybean' fields to final yield tables and populating by joining to "products" table based on 'product' and 'source' fields.""")
+    yield_addCornSoybeanFields_cursorCommand = ("""
 ALTER TABLE yield_point
-ADD COLUMN corn smallint NULL,
-ADD COLUMN soybean smallint NULL;""",
-"""
+ADD COLUMN IF NOT EXISTS corn smallint NULL,
+ADD COLUMN IF NOT EXISTS soybean smallint NULL;""",
+    """
 UPDATE yield_point
 SET corn = products.corn, soybean = products.soybean
 FROM products
-WHERE yield_point.product = products.productname AND products.source='yield_point';"""
-)
-for command in yield_addCornSoybeanFields_cursorCommand:
-    cursor.execute(command)
-print("""Completed populating 'corn' and 'soybean' fields on yield tables.""")
+WHERE yield_point.product = products.productname AND products.source='yield_point'
+AND yield_point.corn IS NULL;  -- only rows not yet flagged (rows loaded by this run when ingesting incrementally)"""
+    )
+    for command in yield_addCornSoybeanFields_cursorCommand:
+        pipeline_metrics.executeMeasured(cursor, METRICS_STAGE, 'corn_soybean ' + command.split()[0].lower(), command)
+    print("""Completed populating 'corn' and 'soybean' fields on yield tables.""")
+    connection.commit()
+
+###############################################################################
+# Refresh the pre-aggregated yield summary ("yield_summary") read by the web app's summary chart
+# Only the field/year groups of the files loaded by this run are recomputed when ingesting incrementally
+
+print("""Refreshing yield summary ("yield_summary").""")
+cursor.execute(yield_summary.createSummaryTableCommand())   # for databases created before the summary table
+refreshAllSummary = rebuildSummary or not (streamingIngest and incrementalIngest)
+with pipeline_metrics.Step(METRICS_STAGE, 'yield_summary_refresh') as stepSummary:
+    stepSummary.rows = yield_summary.refreshSummary(cursor, None if refreshAllSummary else summaryGroups)
 connection.commit()
-print("Current time: " + str(datetime.datetime.now()))
+print("Refreshed " + str(stepSummary.rows) + " summary rows" + (" (all groups)." if refreshAllSummary else
+      " for field/year groups: " + str(sorted(summaryGroups))))
+if summaryChartCSV:
+    chartRows = yield_summary.exportSummaryChartCSV(cursor, summaryChartCSV)
+    print("Wrote " + str(chartRows) + " rows to summary chart CSV: " + summaryChartCSV)
+
+# Quantile sketches of the loaded files, merged by '7_GenerateYieldStyles.py' into the class breaks of each layer
+cursor.execute(yield_sketch.createSketchTableCommand())   # for databases created before the sketch table
+with pipeline_metrics.Step(METRICS_STAGE, 'yield_sketch_refresh') as stepSketch:
+    stepSketch.rows = yield_sketch.refreshFileSketches(cursor, None if refreshAllSummary else manifestJD + manifestAF)
+connection.commit()
+print("Refreshed " + str(stepSketch.rows) + " quantile sketch buckets" + (" (all files)." if refreshAllSummary else
+      " of " + str(len(manifestJD) + len(manifestAF)) + " loaded files."))
 
+scriptStep.finish()
+print("Current time: " + str(datetime.datetime.now()))
 
 # Close communication with the Postgres database server
 cursor.close()
-connection.close()
\ No newline at end of file
+pipeline_settings.release(connection)
\ No newline at end of file
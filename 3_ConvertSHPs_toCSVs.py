@@ -26,14 +26,22 @@
 """
 SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
 
-This code will convert swath polygon shapefiles to CSVs and add WKT geometry field
+This code will convert swath polygon shapefiles to CSVs (or GeoParquet) with a geometry field
 1) Script will loop through folder searching for '.shp' files on which to perform operations
 2) Output directory will contain output CSVs
         -- Note that output directories need to be created before script execution
+3) Output format (variable 'outputFormat'):
+        -- 'wkb_csv': CSV with a hex WKB geometry field ('WKB'); compact, and can be
+           'COPY'-loaded into a PostGIS geometry column without parsing WKT
+        -- 'geoparquet': GeoParquet file (requires 'pyarrow'), geometry stored as WKB
+        -- 'wkt_csv': original CSV with a WKT geometry field ('WKT')
+4) Shapefiles are converted in a pool of processes; features are read and written in
+   batches, and the number of features and time taken are reported for each file
 
 Main components to be changed by user:
 1) Create output directory to contain CSVs generated by script
 2) Input and output directory paths (top)
+3) Output format, batch size and number of worker processes (top)
 
 Code created spring 2017 by Angelo Podagrosi
 Questions to angelo.podagrosi@gmail.com
@@ -43,12 +51,15 @@ Questions to angelo.podagrosi@gmail.com
 # Import necessary Python packages and libraries
 import os
 import sys
-import csv
 import datetime
+import concurrent.futures
+import pipeline_settings
+import pipeline_metrics
 
 # Verifying import of necessary versions 'gdal' and 'ogr' libraries
 try:
     from osgeo import ogr, gdal
+    import swath_convert
 except:
     sys.exit('ERROR: cannot find GDAL/OGR modules')
 
@@ -59,72 +70,53 @@ if version_num < 1100000:
 
 # Print current time to assist in tracking total processing time
 print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each file are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'convert_swaths'
 
 # Input directories of polygon swath shapefiles and output directories of CSVs to be generated
-directoryInput_yield_swathSHP_JD = r'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE SHAPEFILES - #1\Swath'
+# (values in the [paths] section of 'pipeline.ini' are used instead when present)
+directoryInput_yield_swathSHP_JD = pipeline_settings.path('directoryInput_yield_swathSHP_JD', r'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE SHAPEFILES - #1\Swath')
     # Example: r'C:\GIS\PrecisionAg\Operational\'
-directoryOutput_yield_swathCSV_JD = r'FILE PATH TO FOLDER TO CONTAIN CSV OUTPUTS - #1\CSV_WKT'
+directoryOutput_yield_swathCSV_JD = pipeline_settings.path('directoryOutput_yield_swathCSV_JD', r'FILE PATH TO FOLDER TO CONTAIN CSV OUTPUTS - #1\CSV_WKT')
 
-directoryInput_yield_swathSHP_AgFiniti = r'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE SHAPEFILES - #2\Swath'
-directoryOutput_yield_swathCSV_AgFiniti = r'FILE PATH TO FOLDER TO CONTAIN CSV OUTPUTS - #2\CSV_WKT'
+directoryInput_yield_swathSHP_AgFiniti = pipeline_settings.path('directoryInput_yield_swathSHP_AgFiniti', r'FILE PATH TO FOLDER OF RAW PRECISION AGRICULTURE SHAPEFILES - #2\Swath')
+directoryOutput_yield_swathCSV_AgFiniti = pipeline_settings.path('directoryOutput_yield_swathCSV_AgFiniti', r'FILE PATH TO FOLDER TO CONTAIN CSV OUTPUTS - #2\CSV_WKT')
+
+# Output format: 'wkb_csv', 'geoparquet' or 'wkt_csv' (see overview above)
+outputFormat = 'wkb_csv'
+# Number of features held in memory and written at a time
+batchSize = 10000
+# Number of shapefiles converted at the same time
+workers = max(1, (os.cpu_count() or 2) - 1)
 
 ###############################################################################
 ## MAIN SOURCE for code below: https://gis.stackexchange.com/questions/19163/how-to-convert-shp-to-csv-including-attributes-and-geometry
+# The conversion of each shapefile ('convertSwathSHP') is in 'swath_convert.py', so it can run in worker processes
 
-# Definition function to process shapefiles to CSVs
+# Definition function to process shapefiles to CSVs (or GeoParquet), several shapefiles at a time
 def processSwathSHP(inputSHPdir, outputCSVdir, name):
     print("Current time: " + str(datetime.datetime.now()))
-    print("Processing SHP data: " + str(name))    
-    for input_file in os.listdir(inputSHPdir):
-        #print (os.path.join(swathYield_JD_folder, input_file))    
-        #print(input_file)
-        
-        # Loop through only shapefiles (file extension .shp)
-        if input_file[-4:] == '.shp':
-            # Print file name
-            print(input_file)
-            
-            # Identify only the file name itself
-            file_name = str(input_file[:-4])
-            driver = ogr.GetDriverByName("ESRI Shapefile")
-            # Access the shapefile as read-only
-            dataSource = driver.Open((os.path.join(inputSHPdir, input_file)), 0)    # 0 means read-only; 1 means writeable.
-            
-            # .GetLayer allows access to features in a layer - http://pcjericks.github.io/py-gdalogr-cookbook/layers.html#iterate-over-features
-            layer = dataSource.GetLayer()
-                # For instance could access attributes of a specific field using: for feature in layer: print feature.GetField("Elevation_")
-            
-            # Identify the CSV filename to be created
-            csvFile = open(str((os.path.join(outputCSVdir,file_name)) + ".csv") , 'wb')  # Note a change is necessary here for Python 3.x
-            
-            # Access the fields of the layer and count of fields - http://pcjericks.github.io/py-gdalogr-cookbook/layers.html#get-shapefile-fields-get-the-user-defined-fields
-            dfn = layer.GetLayerDefn()
-            nFields = dfn.GetFieldCount()
-    
-            fields = []
-            for i in range(nFields):
-                fields.append(dfn.GetFieldDefn(i).GetName())
-            
-            # Append new field to contain WKT 
-            fields.append('WKT')
-            
-            csvWriter = csv.DictWriter(csvFile, fields)
-            try:
-                csvWriter.writeheader()
-            except:
-                csvFile.write(','.join(fields)+'\n')
-    
-            for feature in layer:
-                attributes = feature.items()
-                geom = feature.GetGeometryRef()
-                attributes['WKT'] = geom.ExportToWkt() 
-                csvWriter.writerow(attributes)
-            
-            del csvWriter, layer, dataSource
-            csvFile.close()
-    print("Completed processing shapefiles to CSV: " + str(name))
-    print("Current time: " + str(datetime.datetime.now()))
+    print("Processing SHP data: " + str(name))
+    # Loop through only shapefiles (file extension .shp)
+    shpFiles = [os.path.join(inputSHPdir, input_file) for input_file in sorted(os.listdir(inputSHPdir)) if input_file[-4:] == '.shp']
+
+    step = pipeline_metrics.Step(METRICS_STAGE, name, rows = 0).start()
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = dict((pool.submit(swath_convert.convertSwathSHP, shpFile, outputCSVdir, outputFormat, batchSize), shpFile) for shpFile in shpFiles)
+        for future in concurrent.futures.as_completed(futures):
+            file_name, count, seconds = future.result()
+            # Bytes read: the geometry (.shp) and attribute (.dbf) files
+            shpBytes = pipeline_metrics.fileBytes([futures[future], futures[future][:-4] + '.dbf'])
+            pipeline_metrics.record(METRICS_STAGE, name + ": " + file_name, seconds, count, shpBytes)
+            step.rows += count
+            step.bytes = (step.bytes or 0) + shpBytes
+            print(file_name + ": " + str(count) + " features in " + str(round(seconds, 2)) + " seconds")
+    step.finish()
+    print("Completed processing " + str(len(shpFiles)) + " shapefiles (" + str(step.rows) + " features): " + str(name))
 #############
 
-processSwathSHP(directoryInput_yield_swathSHP_JD, directoryOutput_yield_swathCSV_JD, "Yield - John Deere")
-processSwathSHP(directoryInput_yield_swathSHP_AgFiniti, directoryOutput_yield_swathCSV_AgFiniti, "Yield - AgFiniti")
\ No newline at end of file
+# Guard needed so worker processes (which re-import this script as '__mp_main__' on Windows) do not start the conversion again;
+# the conversion still runs when this script is a stage of 'run_pipeline.py'
+if __name__ != '__mp_main__':
+    processSwathSHP(directoryInput_yield_swathSHP_JD, directoryOutput_yield_swathCSV_JD, "Yield - John Deere")
+    processSwathSHP(directoryInput_yield_swathSHP_AgFiniti, directoryOutput_yield_swathCSV_AgFiniti, "Yield - AgFiniti")
\ No newline at end of file
@@ -28,7 +28,11 @@ SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
 
 1) Code will add the appopriate geometry field to selected database table and then 
 spatially-enable (to Web Mercator in this case) using latitude and longitude fields.
-2) Spatial index is created.
+        -- When '2_ProcessCSVs.py' already wrote 'geom_3857' during ingest ('ingestGeometry'),
+           the field exists and only rows still missing a geometry (loaded without it) are updated
+2) Spatial index is created (once, after the load), with the index build settings of 'yield_bulkload.py';
+   the planner statistics of 'yield_point' are then updated ('ANALYZE').
+3) With the embedded DuckDB backend, the same is done in the DuckDB file (R-tree index; see 'yield_duckdb.py').
 
 Main components to be changed by user:
 1) Postgres database connection
@@ -40,16 +44,33 @@ Questions to angelo.podagrosi@gmail.com
 """
 
 # Import necessary Python packages and libraries
+import sys
 import datetime
-import psycopg2
+import pipeline_settings
+import pipeline_metrics
+import yield_bulkload
+import yield_duckdb
 
 
 # Print current time to assist in tracking total processing time
 print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each step are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'spatially_enable'
+
+# Embedded DuckDB backend ('backend = duckdb' in the [pipeline] section of 'pipeline.ini'; see 'yield_duckdb.py')
+if pipeline_settings.backend() == 'duckdb':
+    duckConnection = yield_duckdb.connect()
+    with pipeline_metrics.Step(METRICS_STAGE, 'duckdb_geometry') as stepGeometry:
+        stepGeometry.rows = yield_duckdb.spatiallyEnable(duckConnection)
+    duckConnection.close()
+    print("Populated geometry field and spatial index (" + str(stepGeometry.rows) + " rows updated).")
+    print("Current time: " + str(datetime.datetime.now()))
+    sys.exit()
 
 # Connect to database
 try:
-    connection = psycopg2.connect("dbname='PrecisionAg_v1' user='postgres' host='localhost' password='PASSWORD'")
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
     print("I am able to connect to the database! :)")
 except:
     print("I am unable to connect to the database.")
@@ -71,40 +92,56 @@ SELECT AddGeometryColumn('public', 'yield_point', 'geom_3857', 3857, 'POINT', 2)
 """)
     # Appears to be case-sensitive (case of file name needed to match case of table name in dbase)
 
-cursor.execute(commands_addGEOMFields_points)
-
-print("Added 'geom_3857' field to final point files.")
+# The field already exists if it was created for ingest by '1_CreatingDatabaseTables.py'
+cursor.execute("""
+SELECT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'yield_point' AND column_name = 'geom_3857');
+""")
+if cursor.fetchone()[0]:
+    print("'geom_3857' field already exists on final point files.")
+else:
+    cursor.execute(commands_addGEOMFields_points)
+    print("Added 'geom_3857' field to final point files.")
 connection.commit()
 
 # Populate the 'geom_3857' geometry field based on the latitude and longitude fields, 
 # imported in datum WGS84.
+# Fallback for data loaded without geometry; rows that received 'geom_3857' during ingest are not rewritten
 commands_populateGEOMFields_points = (
 """
-UPDATE yield_point SET geom_3857 = ST_Transform((ST_SetSRID(ST_MakePoint(yield_point.longitude, yield_point.latitude), 4326)), 3857);
+UPDATE yield_point SET geom_3857 = ST_Transform((ST_SetSRID(ST_MakePoint(yield_point.longitude, yield_point.latitude), 4326)), 3857)
+WHERE geom_3857 IS NULL;
 """)
 
 print("...Populating geometry field to final point files beginning at " + str(datetime.datetime.now()) + "...")
-cursor.execute(commands_populateGEOMFields_points)
+pipeline_metrics.executeMeasured(cursor, METRICS_STAGE, 'geometry_update', commands_populateGEOMFields_points)
 
-print("Populated geometry fields to final point files.")
+print("Populated geometry fields to final point files (" + str(cursor.rowcount) + " rows updated).")
 connection.commit()
-print("Current time: " + str(datetime.datetime.now()))
 
 
 ## Creating spatial indexes on geometry columns
 commands_createSpatialIndex = (
 """
-CREATE INDEX yield_point_geom3857 ON yield_point USING gist(geom_3857);
+CREATE INDEX IF NOT EXISTS yield_point_geom3857 ON yield_point USING gist(geom_3857);
 """)
 
 print("...Creating spatial index on geometry columns " + str(datetime.datetime.now()) + "...")
 
-cursor.execute(commands_createSpatialIndex)
+with pipeline_metrics.Step(METRICS_STAGE, 'spatial_index'):
+    # Memory and parallel workers of the index build (for its transaction only)
+    for command in yield_bulkload.maintenanceSettings():
+        cursor.execute(command)
+    cursor.execute(commands_createSpatialIndex)
+    connection.commit()
+
+# Planner statistics of 'yield_point', including its new geometry
+with pipeline_metrics.Step(METRICS_STAGE, 'analyze'):
+    yield_bulkload.analyzeTables(cursor, [yield_bulkload.YIELD_POINT])
+    connection.commit()
 
 print("Created spatial indexes on geometry columns")
-connection.commit()
 print("Current time: " + str(datetime.datetime.now()))
 
 # Close communication with the Postgres database server
 cursor.close()
-connection.close()
\ No newline at end of file
+pipeline_settings.release(connection)
\ No newline at end of file
@@ -28,11 +28,17 @@
 SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
 
 1) Script creates database table to contain polygons of farm fields.
-2) Populates this new table based on polygons from existing shapefile.
+2) Populates this new table based on polygons from existing shapefile, or from every
+   shapefile in a folder.
+        -- Features are read sequentially and their geometry exported as WKB (binary)
+        -- Rows are sent to the database in batches using parameterized 'INSERT's
+           ('execute_values'), so farm/field names containing quotes are handled
 
 Main components to be changed by user:
 1) Postgres database connection
-2) File path to folder of shapefiles (variable 'srcFile')
+2) File path to a shapefile or to a folder of shapefiles (variable 'srcFile')
+3) Number of polygons sent to the database per batch (variable 'batchSize')
+4) With the embedded DuckDB backend, the shapefiles are loaded into the DuckDB file instead (see 'yield_duckdb.py')
 
 Code created spring 2017 by Angelo Podagrosi
 Questions to angelo.podagrosi@gmail.com
@@ -40,9 +46,35 @@ Questions to angelo.podagrosi@gmail.com
 """
 
 #########################
+import os
 import sys
 import datetime
 import psycopg2
+import pipeline_settings
+import psycopg2.extras
+import yield_duckdb
+
+srcFile = pipeline_settings.path('srcFile', r'FILE PATH TO FOLDER OF FINAL FARM FIELD POLYGON SHAPEFILE\Final_Fields_v1.shp')
+    # May also be a folder; every shapefile (.shp) in the folder is loaded
+# Number of polygons sent to the database per batch
+batchSize = 1000
+# Keep the 'id' attribute of the shapefile as the table's 'id' (ids must be unique across all loaded shapefiles);
+# if False, the database assigns the 'id'
+useShapefileIDs = True
+
+# Embedded DuckDB backend ('backend = duckdb' in the [pipeline] section of 'pipeline.ini'; see 'yield_duckdb.py'):
+# the shapefiles are read by DuckDB's spatial extension and the Postgres code below is skipped
+if pipeline_settings.backend() == 'duckdb':
+    print("Current time: " + str(datetime.datetime.now()))
+    if os.path.isdir(srcFile):
+        shpFiles = [os.path.join(srcFile, input_file) for input_file in sorted(os.listdir(srcFile)) if input_file[-4:] == '.shp']
+    else:
+        shpFiles = [srcFile]
+    duckConnection = yield_duckdb.connect()
+    polygons = yield_duckdb.importFieldPolygons(duckConnection, shpFiles)
+    duckConnection.close()
+    print("Loaded " + str(polygons) + " field polygons from " + str(len(shpFiles)) + " shapefiles.")
+    sys.exit()
 
 try:
     from osgeo import ogr, gdal
@@ -54,7 +86,8 @@ print("Current time: " + str(datetime.datetime.now()))
 
 # Connect to database
 try:
-    connection = psycopg2.connect("dbname='PrecisionAg_v1' user='postgres' host='localhost' password='PASSWORD'")
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
     print("I am able to connect to the database! :)")
 except:
     print("I am unable to connect to the database.")
@@ -93,38 +126,65 @@ connection.commit()
 # Helpful links:
 # http://andrewgaidus.com/Build_Query_Spatial_Database/
 
-srcFile = r'FILE PATH TO FOLDER OF FINAL FARM FIELD POLYGON SHAPEFILE\Final_Fields_v1.shp'
 #shapefile = osgeo.ogr.Open(srcFile)
 #layer = shapefile.GetLayer(0)
 
-driver = ogr.GetDriverByName("ESRI Shapefile")
-dataSource = driver.Open(srcFile, 0)     # 0 means read-only; 1 means writeable.
-# .GetLayer allows access to features in a layer - http://pcjericks.github.io/py-gdalogr-cookbook/layers.html#iterate-over-features
-layer = dataSource.GetLayer()
-# For instance could access attributes of a specific field using: for feature in layer: print feature.GetField("Elevation_")
-
-#for feature in layer:
-for i in range(layer.GetFeatureCount()):   
-    # Identify each feature and their attributes
-    #attributes = feature.items()
-    #print(attributes)
-    
-    # Identify each of the individual attributes for each feature
-        # Helpful link to identify each attribute: https://pcjericks.github.io/py-gdalogr-cookbook/vector_layers.html#iterate-over-features
-        # Also helpful: http://andrewgaidus.com/Build_Query_Spatial_Database/
-    feature = layer.GetFeature(i)
-    recordID = feature.GetField("id")
-    fieldID = feature.GetField("field_id")
-    finalFarm = feature.GetField("Final_Farm")
-    finalField = feature.GetField("FinalField")
-    ownerID = feature.GetField("owner_id")
-    print("FieldID: " + str(fieldID) + ", " + "Final_Farm: " + finalFarm + ", " + "FinalField: " + finalField + ", " + "Owner_ID: " + str(ownerID))
-    geometry = feature.GetGeometryRef()
-    wkt = geometry.ExportToWkt()
-
-    #Insert data into database, converting WKT geometry to a PostGIS geography
-    # Struggled with ‘INSERT INTO…VALUES’ because script initially was unable to read strings of farm/field names. Needed to differentiate the values as string with single quotes (‘ ‘)
-    cursor.execute("INSERT INTO field_polygons_v1 (id, field_id, final_farm, finalfield, owner_ID, geom) VALUES ({},{},'{}','{}',{}, ST_GeomFromText('{}','4326'))".format(recordID, fieldID, finalFarm, finalField, ownerID, wkt))
+# Definition function to load the field polygons of one shapefile in batches; returns the number of polygons loaded
+def loadFieldPolygonsSHP(cursor, shpPath, batchSize):
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    dataSource = driver.Open(shpPath, 0)     # 0 means read-only; 1 means writeable.
+    # .GetLayer allows access to features in a layer - http://pcjericks.github.io/py-gdalogr-cookbook/layers.html#iterate-over-features
+    layer = dataSource.GetLayer()
+
+    if useShapefileIDs:
+        insertCommand = "INSERT INTO field_polygons_v1 (id, field_id, final_farm, finalfield, owner_ID, geom) VALUES %s"
+        template = "(%s, %s, %s, %s, %s, ST_GeomFromWKB(%s, 4326))"
+    else:
+        insertCommand = "INSERT INTO field_polygons_v1 (field_id, final_farm, finalfield, owner_ID, geom) VALUES %s"
+        template = "(%s, %s, %s, %s, ST_GeomFromWKB(%s, 4326))"
+
+    rows = []
+    count = 0
+    # Read the features sequentially (rather than by random access with 'GetFeature')
+    layer.ResetReading()
+    for feature in layer:
+        # Identify each of the individual attributes for each feature
+            # Helpful link to identify each attribute: https://pcjericks.github.io/py-gdalogr-cookbook/vector_layers.html#iterate-over-features
+            # Also helpful: http://andrewgaidus.com/Build_Query_Spatial_Database/
+        values = [feature.GetField("field_id"), feature.GetField("Final_Farm"), feature.GetField("FinalField"),
+                  feature.GetField("owner_id"), psycopg2.Binary(bytes(feature.GetGeometryRef().ExportToWkb()))]
+        if useShapefileIDs:
+            values.insert(0, feature.GetField("id"))
+        rows.append(tuple(values))
+
+        # Send a batch of polygons as parameters (values are quoted by psycopg2; geometry is sent as WKB)
+        if len(rows) >= batchSize:
+            psycopg2.extras.execute_values(cursor, insertCommand, rows, template = template, page_size = batchSize)
+            count += len(rows)
+            rows = []
+    if rows:
+        psycopg2.extras.execute_values(cursor, insertCommand, rows, template = template, page_size = batchSize)
+        count += len(rows)
+
+    del layer, dataSource
+    return count
+
+# Identify the shapefile(s) to load
+if os.path.isdir(srcFile):
+    shpFiles = [os.path.join(srcFile, input_file) for input_file in sorted(os.listdir(srcFile)) if input_file[-4:] == '.shp']
+else:
+    shpFiles = [srcFile]
+
+totalPolygons = 0
+for shpFile in shpFiles:
+    polygons = loadFieldPolygonsSHP(cursor, shpFile, batchSize)
+    totalPolygons += polygons
+    print("Loaded " + str(polygons) + " field polygons from: " + os.path.basename(shpFile))
+
+if useShapefileIDs:
+    # Move the 'id' sequence past the ids supplied by the shapefiles
+    cursor.execute("""SELECT setval(pg_get_serial_sequence('field_polygons_v1', 'id'), (SELECT max(id) FROM field_polygons_v1));""")
+print("Loaded " + str(totalPolygons) + " field polygons in total.")
 
 # Commit the changes to the database    
 connection.commit()
@@ -132,4 +192,4 @@ connection.commit()
 ############################
 # Close communication with the Postgres database server
 cursor.close()
-connection.close()
\ No newline at end of file
+pipeline_settings.release(connection)
\ No newline at end of file
@@ -0,0 +1,140 @@
+#==============================================================================
+# MIT License
+# 
+# Copyright (c) 2017 Angelo Podagrosi
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# 
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+1) Code renders a Mapbox Vector Tile (MVT) pyramid of the yield points (and field polygons)
+with PostGIS ('ST_AsMVT') and writes it to a static tile cache (see 'yield_tiles.py').
+        -- One 'yield' layer carries the year, crop and yield metrics of every point, so the
+           web map filters and styles one tile source instead of a WMS layer per year/crop/metric
+        -- Tiles are rendered on several database connections at the same time
+2) Incremental seeding: only the tiles intersecting the extent of CSV files loaded since the
+last seed (recorded in the cache) are rendered again; the first run seeds the whole extent.
+        -- Requires 'geom_3857' ('4_SpatiallyEnable.py' or ingest geometry) and its spatial index
+3) Zoomed out tiles draw the cells of the yield grid ('10_AggregateYieldGrid.py'), when built,
+instead of every point
+
+Main components to be changed by user:
+1) Postgres database connection
+2) File path of the tile cache (MBTiles file or folder of '{z}/{x}/{y}.pbf' tiles)
+3) Zoom levels to seed
+
+"""
+
+# Import necessary Python packages and libraries
+import datetime
+import pipeline_settings
+import pipeline_metrics
+import yield_tiles
+import yield_grid
+
+
+# Print current time to assist in tracking total processing time
+print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each step are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'vector_tiles'
+
+# Tile cache: a file ending '.mbtiles', or a folder (tiles written as '{z}/{x}/{y}.pbf')
+# (the value in the [paths] section of 'pipeline.ini' is used instead when present)
+tileCache = pipeline_settings.path('tileCache', r'FILE PATH TO TILE CACHE\yield_point.mbtiles')
+    # Example: r'C:\GIS\PrecisionAg\Tiles\yield_point.mbtiles'
+# Zoom levels to seed (zoom 12 is about 10 m per pixel, zoom 18 about 0.6 m)
+minZoom = 12
+maxZoom = 18
+# Number of database connections rendering tiles at the same time
+tileWorkers = 4
+# True: re-seed only the tiles of files loaded since the last seed; False: re-seed the whole extent
+    # (files are tracked by the manifest of '2_ProcessCSVs.py' with 'incrementalIngest'; re-seed everything after other loads)
+incrementalSeed = True
+# Include the field polygons ('5_ImportFieldPolygonsSHP.py') as layer 'fields'
+includeFieldPolygons = True
+# Draw the 'yield' layer of tiles up to the finest zoom of the yield grid ('10_AggregateYieldGrid.py') from its cells
+useYieldGrid = True
+
+# Connect to database
+try:
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
+    print("I am able to connect to the database! :)")
+except:
+    print("I am unable to connect to the database.")
+
+# Establish cursor connection to database; necessary to begin providing commands/queries to database
+cursor = connection.cursor()
+
+###############################################################################
+# Identify the tiles to seed
+
+if includeFieldPolygons and not yield_tiles.tableExists(cursor, yield_tiles.FIELD_TABLE):
+    print("Field polygon table not found; seeding the yield points only.")
+    includeFieldPolygons = False
+
+gridTables = {}
+if useYieldGrid and yield_tiles.tableExists(cursor, yield_grid.GRID_LEVEL_TABLE):
+    gridTables = yield_grid.tileGridTables(sorted(yield_grid.gridLevels(cursor)), minZoom, maxZoom)
+    if gridTables:
+        print("Tiles of zoom " + str(min(gridTables)) + " to " + str(max(gridTables)) + " are drawn from the yield grid")
+
+cache = yield_tiles.openCache(tileCache)
+# Watermark read before the extents, so files loaded while seeding are seeded again by the next run
+seededThrough = yield_tiles.manifestLoadedAt(cursor)
+previousSeed = cache.getMetadata('seeded_through') if incrementalSeed else None
+if previousSeed:
+    # Files loaded since, and the rows they replaced (so tiles a changed file no longer covers are rendered again)
+    extents = yield_tiles.changedFileExtents(cursor, previousSeed)
+    print("Files loaded since " + previousSeed + ": " + str(len(extents)))
+    extents += yield_tiles.replacedExtents(cursor, previousSeed)
+else:
+    extents = yield_tiles.dataExtent(cursor, includeFieldPolygons)
+connection.rollback()
+tiles = yield_tiles.pyramidTiles(extents, minZoom, maxZoom)
+print("...Seeding " + str(len(tiles)) + " tiles (zoom " + str(minZoom) + " to " + str(maxZoom) + ") beginning at "
+      + str(datetime.datetime.now()) + "...")
+
+###############################################################################
+# Render the tiles and write them to the cache
+
+with pipeline_metrics.Step(METRICS_STAGE, 'seed_tiles') as stepTiles:
+    written, removed = yield_tiles.seedTiles(pipeline_settings.connectionFactory(tileWorkers), cache, tiles,
+                                             yield_tiles.METRICS, includeFieldPolygons, tileWorkers, gridTables)
+    stepTiles.rows = written
+
+metadata = {'format': 'pbf', 'minzoom': minZoom, 'maxzoom': maxZoom,
+            'json': yield_tiles.tileJSON(yield_tiles.METRICS, includeFieldPolygons, minZoom, maxZoom, gridTables)}
+if not previousSeed:
+    metadata['name'] = 'yield_point'
+if extents:
+    metadata['bounds'] = yield_tiles.lonLatBounds(extents, cache.getMetadata('bounds') if previousSeed else None)
+if seededThrough is not None:
+    metadata['seeded_through'] = seededThrough
+cache.setMetadata(metadata)
+cache.close()
+print("Wrote " + str(written) + " tiles and removed " + str(removed) + " empty tiles: " + tileCache)
+print("Current time: " + str(datetime.datetime.now()))
+
+# Close communication with the Postgres database server
+cursor.close()
+pipeline_settings.release(connection)
@@ -0,0 +1,109 @@
+#==============================================================================
+# MIT License
+# 
+# Copyright (c) 2017 Angelo Podagrosi
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# 
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+1) Code computes the class breaks of each yield layer (year, crop and metric) from the
+quantile sketches kept by '2_ProcessCSVs.py' (table 'yield_sketch'; see 'yield_sketch.py').
+        -- Sketches of every file of a season are merged (a few hundred rows), so no
+           query sorts the points of the season
+        -- Quantile (equal count) or natural (Jenks) breaks
+2) Writes a GeoServer YSLD point style for each layer, in the layout and color ramp of
+'yield_point_2016_corn_yieldvolume.ysld' (see 'yield_styles.py').
+
+Main components to be changed by user:
+1) Postgres database connection
+2) Folder the styles are written to
+3) Metrics, layers, number of classes and classification method
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import datetime
+import pipeline_settings
+import pipeline_metrics
+import yield_sketch
+import yield_styles
+
+
+# Print current time to assist in tracking total processing time
+print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each step are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'yield_styles'
+
+# Folder the YSLD files are written to ('<layer name>.ysld')
+# (the value in the [paths] section of 'pipeline.ini' is used instead when present)
+styleDirectory = pipeline_settings.path('styleDirectory', r'FILE PATH TO FOLDER OF GEOSERVER STYLES')
+    # Example: r'C:\GIS\PrecisionAg\Styles'
+# Metrics to classify (sketched during ingest: 'yield_sketch.METRICS')
+styleMetrics = ['yld_vol_dr', 'yld_mass_d']
+# Crops to style ('other' is rows whose product is not flagged corn or soybean)
+styleCrops = ['corn', 'soybean']
+# Number of classes and classification method: 'quantile' (equal count) or 'natural' (Jenks)
+styleClasses = 7
+classMethod = 'quantile'
+
+# Connect to database
+try:
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
+    print("I am able to connect to the database! :)")
+except:
+    print("I am unable to connect to the database.")
+
+# Establish cursor connection to database; necessary to begin providing commands/queries to database
+cursor = connection.cursor()
+
+###############################################################################
+# Class breaks and style of every year/crop/metric layer
+
+if not os.path.isdir(styleDirectory):
+    os.makedirs(styleDirectory)
+
+with pipeline_metrics.Step(METRICS_STAGE, 'styles') as stepStyles:
+    stepStyles.rows = 0
+    for metric in styleMetrics:
+        for year, crop in yield_sketch.sketchSubsets(cursor, metric):
+            if crop not in styleCrops:
+                continue
+            sketch = yield_sketch.loadSketch(cursor, metric, year, crop)
+            if classMethod == 'natural':
+                breaks = sketch.naturalBreaks(styleClasses)
+            else:
+                breaks = sketch.quantileBreaks(styleClasses)
+            name = yield_styles.layerName(year, crop, metric)
+            yield_styles.writeYSLD(os.path.join(styleDirectory, name + '.ysld'), name, metric, breaks)
+            stepStyles.rows += 1
+            print("Wrote style " + name + " (" + str(sketch.total) + " points): " + ', '.join('{:.2f}'.format(value) for value in breaks))
+
+connection.rollback()
+print("Wrote " + str(stepStyles.rows) + " styles to: " + styleDirectory)
+print("Current time: " + str(datetime.datetime.now()))
+
+# Close communication with the Postgres database server
+cursor.close()
+pipeline_settings.release(connection)
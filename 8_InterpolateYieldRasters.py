@@ -0,0 +1,116 @@
+#==============================================================================
+# MIT License
+# 
+# Copyright (c) 2017 Angelo Podagrosi
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# 
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+This code interpolates a continuous yield surface of every field and year and writes it as
+Cloud-Optimized GeoTIFFs, one per field/year/metric (see 'yield_rasters.py').
+1) The yield points of each field inside its boundary ('field_polygons_v1') are gridded at
+   'cellSize' meters by inverse distance weighting (IDW) of the nearest points (KD-tree)
+2) Rasters are tiled, compressed and carry overviews, so a map or zonal analysis reads
+   only the tiles and resolution it needs
+3) Fields are interpolated in a pool of processes
+        -- Requires GDAL and 'scipy', the spatial index of '4_SpatiallyEnable.py' and the
+           field polygons of '5_ImportFieldPolygonsSHP.py'
+
+Main components to be changed by user:
+1) Output directory of the rasters (created if missing)
+2) Cell size, IDW settings, metrics, years and number of worker processes (top)
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import sys
+import datetime
+import concurrent.futures
+import pipeline_settings
+import pipeline_metrics
+
+# Verifying import of necessary 'gdal' and 'scipy' libraries
+try:
+    from osgeo import gdal
+    import scipy.spatial
+    import yield_rasters
+except:
+    sys.exit('ERROR: cannot find GDAL or scipy modules')
+
+# Print current time to assist in tracking total processing time
+print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each field are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'yield_rasters'
+
+# Output directory of the rasters
+# (the value in the [paths] section of 'pipeline.ini' is used instead when present)
+rasterDirectory = pipeline_settings.path('rasterDirectory', r'FILE PATH TO FOLDER OF YIELD RASTERS')
+    # Example: r'C:\GIS\PrecisionAg\Rasters'
+# Metrics interpolated (one raster each)
+rasterMetrics = ['yld_vol_dr', 'yld_mass_d']
+# Years interpolated (None for every year)
+rasterYears = None
+# Cell size (meters), IDW power, number of nearest points and search radius (meters)
+cellSize = 5.0
+idwPower = 2.0
+idwNeighbors = 12
+idwRadius = 20.0
+# Number of fields interpolated at the same time
+workers = max(1, (os.cpu_count() or 2) - 1)
+
+###############################################################################
+# Interpolate every field and year, several fields at a time
+
+def interpolateFields():
+    connection = pipeline_settings.connect()
+    cursor = connection.cursor()
+    fieldYears = yield_rasters.fieldYears(cursor, rasterYears)
+    cursor.close()
+    pipeline_settings.release(connection)
+    print(str(len(fieldYears)) + " field/years to interpolate.")
+
+    if not os.path.isdir(rasterDirectory):
+        os.makedirs(rasterDirectory)
+    # Worker processes open their own connections
+    connectionString = pipeline_settings.connectionString()
+    step = pipeline_metrics.Step(METRICS_STAGE, 'interpolate', rows = 0).start()
+    rasterCount = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(yield_rasters.interpolateField, connectionString, fieldID, year, rasterMetrics, rasterDirectory,
+                               cellSize, idwPower, idwNeighbors, idwRadius) for fieldID, year in fieldYears]
+        for future in concurrent.futures.as_completed(futures):
+            fieldID, year, points, rasterFiles, seconds = future.result()
+            pipeline_metrics.record(METRICS_STAGE, "field " + str(fieldID) + " " + str(year), seconds, points, rasters = len(rasterFiles))
+            step.rows += points
+            rasterCount += len(rasterFiles)
+            print("Field " + str(fieldID) + " (" + str(year) + "): " + str(points) + " points, " + ', '.join(rasterFiles)
+                  + " in " + str(round(seconds, 2)) + " seconds")
+    step.finish()
+    print("Wrote " + str(rasterCount) + " rasters to: " + rasterDirectory)
+
+# Guard needed so worker processes (which re-import this script as '__mp_main__' on Windows) do not start the interpolation again;
+# the interpolation still runs when this script is a stage of 'run_pipeline.py'
+if __name__ != '__mp_main__':
+    interpolateFields()
+    print("Current time: " + str(datetime.datetime.now()))
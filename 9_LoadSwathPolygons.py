@@ -0,0 +1,117 @@
+#==============================================================================
+# MIT License
+# 
+# Copyright (c) 2017 Angelo Podagrosi
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# 
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+This code loads the swath polygon files written by '3_ConvertSHPs_toCSVs.py' ('wkb_csv', 'wkt_csv'
+or 'geoparquet' output) into table 'yield_swath' (see 'yield_swath.py').
+1) Each CSV or GeoParquet file (requires 'pyarrow') is streamed into the database with 'COPY ... FROM STDIN' and moved to 'yield_swath'
+   in one statement; the polygons of a file loaded again replace its earlier polygons
+2) 'field_id', 'farmer_id', 'year' and the corn/soybean flags are resolved from the original
+   file name and product, as for the yield points (run after '2_ProcessCSVs.py')
+3) Simplified copies of the polygons are stored at a few tolerances for low zoom maps
+4) Spatial indexes are created (once, after the load)
+
+Main components to be changed by user:
+1) Postgres database connection
+2) Folders of swath CSV/GeoParquet files (the output folders of '3_ConvertSHPs_toCSVs.py')
+3) Coordinate system of the swath shapefiles
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import datetime
+import pipeline_settings
+import pipeline_metrics
+import yield_swath
+
+
+# Print current time to assist in tracking total processing time
+print("Current time: " + str(datetime.datetime.now()))
+# Time, rows and memory of each step are appended to 'pipeline_metrics.jsonl' (see 'pipeline_metrics.py')
+METRICS_STAGE = 'swath_polygons'
+
+# Folders of swath CSV/GeoParquet files (the output folders of '3_ConvertSHPs_toCSVs.py') and the vendor of each
+# (values in the [paths] section of 'pipeline.ini' are used instead when present)
+directory_swathCSV_JD = pipeline_settings.path('directoryOutput_yield_swathCSV_JD', r'FILE PATH TO FOLDER TO CONTAIN CSV OUTPUTS - #1\CSV_WKT')
+directory_swathCSV_AgFiniti = pipeline_settings.path('directoryOutput_yield_swathCSV_AgFiniti', r'FILE PATH TO FOLDER TO CONTAIN CSV OUTPUTS - #2\CSV_WKT')
+swathDirectories = [(directory_swathCSV_JD, 'johndeere'), (directory_swathCSV_AgFiniti, 'agfiniti')]
+# EPSG code of the swath shapefiles' coordinate system
+sourceSRID = 4326
+
+# Connect to database
+try:
+    # Connection settings are read from 'pipeline.ini' (see 'pipeline_settings.py')
+    connection = pipeline_settings.connect()
+    print("I am able to connect to the database! :)")
+except:
+    print("I am unable to connect to the database.")
+
+# Establish cursor connection to database; necessary to begin providing commands/queries to database
+cursor = connection.cursor()
+
+###############################################################################
+# Create the swath table (if missing) and load every swath CSV
+
+for command in yield_swath.createSwathTableCommands():
+    cursor.execute(command)
+connection.commit()
+
+fieldKey = yield_swath.loadSwathFieldKey(cursor)
+for directory, fileSource in swathDirectories:
+    swathFiles = sorted(input_file for input_file in os.listdir(directory) if os.path.splitext(input_file)[1] in ('.csv', '.parquet'))
+    step = pipeline_metrics.Step(METRICS_STAGE, 'load_' + fileSource, rows = 0).start()
+    step.bytes = pipeline_metrics.fileBytes([os.path.join(directory, input_file) for input_file in swathFiles])
+    for input_file in swathFiles:
+        orgFile, extension = os.path.splitext(input_file)
+        # Each file is replaced and committed on its own
+        if extension == '.parquet':
+            rows = yield_swath.loadSwathParquet(cursor, os.path.join(directory, input_file), orgFile, fileSource, fieldKey, sourceSRID)
+        else:
+            rows = yield_swath.loadSwathCSV(cursor, os.path.join(directory, input_file), orgFile, fileSource, fieldKey, sourceSRID)
+        connection.commit()
+        step.rows += rows
+        print(input_file + ": " + str(rows) + " swath polygons" + ("" if orgFile in fieldKey else " (file not in field key)"))
+    step.finish()
+    print("Loaded " + str(step.rows) + " swath polygons from " + str(len(swathFiles)) + " files: " + fileSource)
+
+###############################################################################
+# Spatial indexes of the full resolution and simplified geometries
+
+print("...Creating spatial indexes on swath geometry columns " + str(datetime.datetime.now()) + "...")
+with pipeline_metrics.Step(METRICS_STAGE, 'spatial_index'):
+    for command in yield_swath.createSwathIndexCommands():
+        cursor.execute(command)
+    cursor.execute("ANALYZE " + yield_swath.SWATH_TABLE + ";")
+    connection.commit()
+
+print("Created spatial indexes on swath geometry columns")
+print("Current time: " + str(datetime.datetime.now()))
+
+# Close communication with the Postgres database server
+cursor.close()
+pipeline_settings.release(connection)
@@ -0,0 +1,267 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+This code benchmarks the yield ingest on synthetic data against a throwaway local
+PostgreSQL/PostGIS database, so the ingest paths can be compared at production volumes.
+1) Column distributions are learned from the sample CSVs of each vendor and synthetic
+   harvest CSVs are written for each requested size (see 'yield_synthetic.py'); files
+   already generated with the same size and seed are reused
+2) A new database (default 'precisionag_benchmark') is created, PostGIS enabled and the
+   tables created by running '1_CreatingDatabaseTables.py' against it
+3) For each size and each ingest path, the following steps are timed:
+        -- parse: read and type every CSV in chunks, without the database
+        -- load: scratch tables, by ingest path
+            -- 'legacy': original approach (untyped 'pandas' read of every file, concatenated, one COPY)
+            -- 'streaming': chunked typed read, COPY FROM STDIN, Web Mercator geometry computed in the chunks
+            -- 'parallel': as 'streaming', with CSVs parsed in a process pool while loader threads COPY
+        -- yield_point: 'INSERT ... SELECT' from the scratch tables
+        -- spatial: geometry 'UPDATE' of rows without geometry, and spatial index build
+        -- queries: the summary queries below ('SUMMARY_QUERIES')
+4) Every step is written to the metrics file (rows/sec, peak memory; see 'pipeline_metrics.py')
+   and a table of rows/sec per step and path is printed at the end
+        -- Python allocation peaks ('tracemalloc') only with '--tracemalloc', as tracing slows the Python steps
+
+Usage:
+    python benchmark_ingest.py --rows 1000000 10000000 --paths legacy streaming parallel
+
+Main components to be changed by user:
+1) Sample CSV folders (default: the [paths] of 'pipeline.ini' used by '2_ProcessCSVs.py')
+2) Connection used to create the benchmark database (default: 'pipeline.ini' with database 'postgres');
+   the user needs the right to create databases
+Note: the 'legacy' path holds every row in memory at once; leave it out for the largest sizes.
+
+"""
+
+# Import necessary Python packages and libraries
+import io
+import os
+import sys
+import runpy
+import json
+import argparse
+import psycopg2
+import psycopg2.extensions
+import pandas as pd
+import pipeline_settings
+import pipeline_metrics
+import vendor_schemas
+import yield_ingest
+import yield_geometry
+import yield_partitions
+import yield_synthetic
+
+METRICS_STAGE = 'benchmark'
+SCHEMAS = [vendor_schemas.JOHN_DEERE, vendor_schemas.AGFINITI]
+INGEST_PATHS = ('legacy', 'streaming', 'parallel')
+
+# Queries timed after each load (the web map's summary chart and layers)
+SUMMARY_QUERIES = [
+    ('summary_by_field', """
+SELECT field, date_part('year', date) AS year, product, count(*), avg(yld_vol_dr) AS avg_yield_dry
+FROM yield_point GROUP BY field, date_part('year', date), product;"""),
+    ('season_layer', """
+SELECT count(*), avg(yld_vol_dr), avg(moisture__) FROM yield_point
+WHERE date >= '2016-01-01' AND date < '2017-01-01';"""),
+    ('map_window', """
+SELECT count(*) FROM yield_point
+WHERE geom_3857 && ST_Transform(ST_MakeEnvelope(-89.2, 40.1, -89.1, 40.2, 4326), 3857);"""),
+]
+
+
+def benchmarkConnectionString(dbname):
+    """Return the configured connection string with its database replaced by 'dbname'."""
+    parameters = psycopg2.extensions.parse_dsn(pipeline_settings.connectionString())
+    parameters['dbname'] = dbname
+    return psycopg2.extensions.make_dsn(**parameters)
+
+
+def createBenchmarkDatabase(dbname, adminDatabase):
+    """Drop and create the throwaway database 'dbname' with PostGIS, and point 'pipeline_settings' at it."""
+    configured = psycopg2.extensions.parse_dsn(pipeline_settings.connectionString()).get('dbname')
+    if dbname == configured:
+        raise ValueError("The benchmark database must not be the configured database '{}'".format(configured))
+    admin = psycopg2.connect(benchmarkConnectionString(adminDatabase))
+    # CREATE/DROP DATABASE cannot run inside a transaction
+    admin.autocommit = True
+    adminCursor = admin.cursor()
+    adminCursor.execute('DROP DATABASE IF EXISTS "{}";'.format(dbname))
+    adminCursor.execute('CREATE DATABASE "{}";'.format(dbname))
+    admin.close()
+
+    # The scripts (and 'pipeline_settings.connect') now use the benchmark database
+    config = pipeline_settings.readConfig()
+    if not config.has_section('database'):
+        config.add_section('database')
+    for key, value in psycopg2.extensions.parse_dsn(benchmarkConnectionString(dbname)).items():
+        config.set('database', key, value)
+
+    connection = pipeline_settings.connect()
+    connection.cursor().execute("CREATE EXTENSION IF NOT EXISTS postgis;")
+    connection.commit()
+    pipeline_settings.release(connection)
+    runpy.run_path(os.path.join(pipeline_settings.SCRIPT_DIR, '1_CreatingDatabaseTables.py'), run_name = 'benchmark_stage')
+
+
+def generateData(sampleDirs, outputDir, rows, seed):
+    """Write 'rows' synthetic points (split between the vendors) unless already generated; returns {vendor: folder}."""
+    folders = {}
+    for schema in SCHEMAS:
+        folder = os.path.join(outputDir, '{}_{}_seed{}'.format(rows, schema.vendor, seed))
+        folders[schema.vendor] = folder
+        if os.path.isdir(folder) and yield_ingest.listYieldCSVs(folder):
+            continue
+        os.makedirs(folder, exist_ok = True)
+        with pipeline_metrics.Step(METRICS_STAGE, '{} generate {}'.format(rows, schema.vendor), rows = rows // len(SCHEMAS)):
+            profile = yield_synthetic.learnProfile(sampleDirs[schema.vendor], schema)
+            yield_synthetic.generateYieldCSVs(profile, schema, folder, rows // len(SCHEMAS), seed = seed)
+    return folders
+
+
+def legacyLoad(cursor, directory, schema):
+    """Original approach: read every CSV (untyped), concatenate, and COPY the appended rows at once; returns rows."""
+    frames = []
+    for input_file in yield_ingest.listYieldCSVs(directory):
+        df = pd.read_csv(os.path.join(directory, input_file), header = 0, names = vendor_schemas.stagingColumns(schema))
+        df['org_file'] = str(input_file[:-4])
+        df['file_source'] = schema.vendor
+        frames.append(df)
+    df = pd.concat(frames)
+    buffer = io.StringIO()
+    df.to_csv(buffer, header = False, encoding = 'utf-8')
+    buffer.seek(0)
+    cursor.copy_expert(yield_ingest.copyCommand(schema.stagingTable, yield_ingest.copyColumns(df)), buffer)
+    return len(df)
+
+
+def benchmarkPath(connection, folders, rows, path, memoryLimitMB, parseWorkers, loadWorkers):
+    """Run and time every step of one ingest path on freshly emptied tables."""
+    cursor = connection.cursor()
+    cursor.execute("TRUNCATE yield_point, _CSVimport_yield_point_JD, _CSVimport_yield_point_AgFiniti;")
+    cursor.execute("DROP INDEX IF EXISTS yield_point_geom3857;")
+    connection.commit()
+    label = '{} {} '.format(rows, path)
+    transforms = [] if path == 'legacy' else [yield_geometry.addWebMercatorGeometry]
+
+    for schema in SCHEMAS:
+        directory = folders[schema.vendor]
+        inputBytes = pipeline_metrics.fileBytes([os.path.join(directory, name) for name in yield_ingest.listYieldCSVs(directory)])
+        with pipeline_metrics.Step(METRICS_STAGE, label + 'load ' + schema.vendor, bytesRead = inputBytes) as step:
+            if path == 'legacy':
+                step.rows = legacyLoad(cursor, directory, schema)
+            elif path == 'streaming':
+                step.rows = sum(yield_ingest.streamYieldDirectory(cursor, directory, schema, memoryLimitMB, None, transforms).values())
+            else:
+                step.rows = sum(yield_ingest.parallelStreamYieldDirectory(lambda: psycopg2.connect(pipeline_settings.connectionString()),
+                                                                          directory, schema, memoryLimitMB, parseWorkers, loadWorkers,
+                                                                          files = None, transforms = transforms).values())
+            connection.commit()
+
+    extraColumns = ['org_file', 'file_source'] + ([] if path == 'legacy' else ['geom_3857'])
+    with pipeline_metrics.Step(METRICS_STAGE, label + 'yield_point', rows = 0) as step:
+        if yield_partitions.isPartitioned(cursor, 'yield_point'):
+            yield_partitions.ensurePartitions(cursor, yield_partitions.partitionKeys(cursor, SCHEMAS))
+        for schema in SCHEMAS:
+            cursor.execute(yield_ingest.yieldPointInsertCommand(schema, extraColumns))
+            step.rows += cursor.rowcount
+        connection.commit()
+
+    pipeline_metrics.executeMeasured(cursor, METRICS_STAGE, label + 'spatial update', """
+UPDATE yield_point SET geom_3857 = ST_Transform(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326), 3857)
+WHERE geom_3857 IS NULL;""")
+    connection.commit()
+    with pipeline_metrics.Step(METRICS_STAGE, label + 'spatial index', rows = rows):
+        cursor.execute("CREATE INDEX yield_point_geom3857 ON yield_point USING gist(geom_3857);")
+        cursor.execute("ANALYZE yield_point;")
+        connection.commit()
+
+    for name, query in SUMMARY_QUERIES:
+        pipeline_metrics.executeMeasured(cursor, METRICS_STAGE, label + 'query ' + name, query)
+        cursor.fetchall()
+    cursor.close()
+
+
+def benchmarkParse(folders, rows, memoryLimitMB):
+    """Time reading and typing every CSV in chunks, without the database."""
+    for schema in SCHEMAS:
+        directory = folders[schema.vendor]
+        with pipeline_metrics.Step(METRICS_STAGE, '{} parse {}'.format(rows, schema.vendor), rows = 0) as step:
+            for input_file in yield_ingest.listYieldCSVs(directory):
+                for df in yield_ingest.iterYieldChunks(os.path.join(directory, input_file), schema, input_file[:-4], memoryLimitMB):
+                    step.rows += len(df)
+
+
+def printReport(records):
+    """Print rows/sec of every step (rows) by size and path (columns)."""
+    table = {}
+    for entry in records:
+        size, name = entry['step'].split(' ', 1)
+        table.setdefault(name, {})[size] = entry['rows_per_sec']
+    for name in sorted(table):
+        print('{:<40} {}'.format(name, '  '.join('{}: {}'.format(size, rate) for size, rate in sorted(table[name].items(), key = lambda item: int(item[0])))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the yield ingest on synthetic data in a throwaway database.')
+    parser.add_argument('--rows', type = int, nargs = '+', default = [1000000], help = 'synthetic points per run (for instance 1000000 10000000 100000000)')
+    parser.add_argument('--paths', nargs = '+', choices = INGEST_PATHS, default = list(INGEST_PATHS), help = 'ingest paths to compare')
+    parser.add_argument('--samples-jd', default = pipeline_settings.path('directory_yieldJD'), help = 'folder of John Deere sample CSVs')
+    parser.add_argument('--samples-agfiniti', default = pipeline_settings.path('directory_yieldAgFiniti'), help = 'folder of AgFiniti sample CSVs')
+    parser.add_argument('--data', default = os.path.join(pipeline_settings.SCRIPT_DIR, 'benchmark_data'), help = 'folder of the synthetic CSVs')
+    parser.add_argument('--database', default = 'precisionag_benchmark', help = 'throwaway database (dropped and created)')
+    parser.add_argument('--admin-database', default = 'postgres', help = 'database connected to when creating the benchmark database')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--memory-limit-mb', type = int, default = yield_ingest.DEFAULT_MEMORY_LIMIT_MB)
+    parser.add_argument('--parse-workers', type = int, default = None)
+    parser.add_argument('--load-workers', type = int, default = 2)
+    parser.add_argument('--tracemalloc', action = 'store_true', help = 'also record Python allocation peaks (slows Python steps several times)')
+    parser.add_argument('--metrics', default = os.path.join(pipeline_settings.SCRIPT_DIR, 'benchmark_metrics.jsonl'), help = 'JSON lines output')
+    args = parser.parse_args()
+
+    if not args.samples_jd or not args.samples_agfiniti:
+        sys.exit('ERROR: sample CSV folders are required (--samples-jd/--samples-agfiniti or [paths] of pipeline.ini)')
+    pipeline_metrics.METRICS_FILE = args.metrics
+    # Tracing allocations distorts rows/sec, so it is off unless asked for
+    pipeline_metrics.TRACE_ALLOCATIONS = args.tracemalloc
+    sampleDirs = {vendor_schemas.JOHN_DEERE.vendor: args.samples_jd, vendor_schemas.AGFINITI.vendor: args.samples_agfiniti}
+
+    firstRecord = sum(1 for line in open(args.metrics)) if os.path.exists(args.metrics) else 0
+    createBenchmarkDatabase(args.database, args.admin_database)
+    for rows in args.rows:
+        folders = generateData(sampleDirs, args.data, rows, args.seed)
+        benchmarkParse(folders, rows, args.memory_limit_mb)
+        for path in args.paths:
+            connection = pipeline_settings.connect()
+            try:
+                benchmarkPath(connection, folders, rows, path, args.memory_limit_mb, args.parse_workers, args.load_workers)
+            finally:
+                pipeline_settings.release(connection)
+
+    with open(args.metrics) as metricsFile:
+        records = [json.loads(line) for line in list(metricsFile)[firstRecord:]]
+    printReport([entry for entry in records if entry['stage'] == METRICS_STAGE and entry['step'].split(' ', 1)[0].isdigit()])
+    print("Metrics written to: " + args.metrics)
@@ -0,0 +1,182 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Performance metrics of the pipeline stages, written as JSON lines (one record per
+measured step) so runs can be compared and the slowest step of a season found.
+Each record holds:
+        -- 'run_id', 'stage', 'step', 'started', 'status' ('ok' or 'error')
+        -- 'wall_seconds', 'rows', 'bytes' (input bytes read) and 'rows_per_sec'
+        -- 'peak_rss_mb': peak resident memory of this process so far, and
+           'children_peak_rss_mb': largest worker process so far (not on Windows)
+        -- 'python_peak_mb': peak memory allocated by Python during the step ('tracemalloc'; only
+           when tracing is turned on and one stage runs at a time, as the peak is process-wide)
+Settings (section [metrics] of 'pipeline.ini'):
+        -- file: JSON lines file, appended to (default 'pipeline_metrics.jsonl' beside the scripts)
+        -- tracemalloc: 'true' to trace Python allocations (off by default: tracing slows Python code many times)
+Steps of one stage running at the same time in different threads share the Python allocation peak.
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+import tracemalloc
+import pipeline_settings
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak memory is then read with 'psutil' if installed
+    resource = None
+
+METRICS_FILE = pipeline_settings.setting('metrics', 'file', os.path.join(pipeline_settings.SCRIPT_DIR, 'pipeline_metrics.jsonl'))
+TRACE_ALLOCATIONS = pipeline_settings.flag('metrics', 'tracemalloc', False)
+# Identifies the records of one run; shared by the stages run by 'run_pipeline.py' and by worker processes
+RUN_ID = os.environ.setdefault('PIPELINE_RUN_ID', datetime.datetime.now().strftime('%Y%m%dT%H%M%S'))
+
+_writeLock = threading.Lock()
+_stepsLock = threading.Lock()
+_openSteps = []
+# Stages run at the same time in threads of this process ('run_pipeline.py'); their Python allocation peaks mix
+_concurrentStages = 1
+
+
+def setConcurrentStages(stageWorkers):
+    """Record how many stages run at the same time in this process; 'python_peak_mb' is only recorded for one."""
+    global _concurrentStages
+    _concurrentStages = max(1, int(stageWorkers))
+
+
+def _tracePeaks():
+    return TRACE_ALLOCATIONS and _concurrentStages == 1
+
+
+def peakRSSMB(children=False):
+    """Return the peak resident memory (megabytes) of this process (or of its largest child process), or None."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return round(peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+    if children:
+        return None
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024.0 * 1024.0), 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+def writeRecord(record):
+    """Append one metrics record to the JSON lines file."""
+    with _writeLock:
+        with open(METRICS_FILE, 'a') as metricsFile:
+            metricsFile.write(json.dumps(record) + '\n')
+
+
+def record(stage, step, wallSeconds, rows=None, bytesRead=None, status='ok', **extra):
+    """Write the record of a step measured elsewhere (for instance in a worker process); returns it."""
+    entry = {'run_id': RUN_ID, 'stage': stage, 'step': step,
+             'started': (datetime.datetime.now() - datetime.timedelta(seconds = wallSeconds)).isoformat(),
+             'status': status, 'wall_seconds': round(wallSeconds, 3), 'rows': rows, 'bytes': bytesRead,
+             'rows_per_sec': round(rows / wallSeconds, 1) if rows and wallSeconds > 0 else None,
+             'peak_rss_mb': peakRSSMB(), 'children_peak_rss_mb': peakRSSMB(children = True)}
+    entry.update(extra)
+    writeRecord(entry)
+    return entry
+
+
+class Step(object):
+    """Measures one step of a stage and writes its record when finished.
+
+    Use as a context manager ('with Step(...) as step:') or call 'start' and 'finish';
+    set 'rows' and 'bytes' while the step runs when they are only known then.
+    """
+
+    def __init__(self, stage, step, rows=None, bytesRead=None):
+        self.stage = stage
+        self.step = step
+        self.rows = rows
+        self.bytes = bytesRead
+        self.pythonPeak = 0
+        self.startTime = None
+
+    def start(self):
+        with _stepsLock:
+            if _tracePeaks() and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if _tracePeaks() and tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+                # Keep the peak of the enclosing steps before restarting the peak for this step
+                peak = tracemalloc.get_traced_memory()[1]
+                for openStep in _openSteps:
+                    openStep.pythonPeak = max(openStep.pythonPeak, peak)
+                tracemalloc.reset_peak()
+            _openSteps.append(self)
+        self.startTime = time.time()
+        return self
+
+    def finish(self, status='ok'):
+        """Write the record of the step; returns it."""
+        wallSeconds = time.time() - self.startTime
+        pythonPeakMB = None
+        with _stepsLock:
+            if self in _openSteps:
+                _openSteps.remove(self)
+            if _tracePeaks() and tracemalloc.is_tracing():
+                self.pythonPeak = max(self.pythonPeak, tracemalloc.get_traced_memory()[1])
+                for openStep in _openSteps:
+                    openStep.pythonPeak = max(openStep.pythonPeak, self.pythonPeak)
+                pythonPeakMB = round(self.pythonPeak / (1024.0 * 1024.0), 1)
+        entry = record(self.stage, self.step, wallSeconds, self.rows, self.bytes, status, python_peak_mb = pythonPeakMB)
+        print("[metrics] " + self.stage + " / " + self.step + ": " + str(entry['wall_seconds']) + " seconds"
+              + ("" if entry['rows'] is None else ", " + str(entry['rows']) + " rows")
+              + ("" if entry['rows_per_sec'] is None else " (" + str(entry['rows_per_sec']) + " rows/sec)"))
+        return entry
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.finish('ok' if excType is None else 'error')
+        return False
+
+
+def executeMeasured(cursor, stage, step, command, parameters=None):
+    """Execute and measure one SQL command; the rows are the command's row count. Returns the row count."""
+    with Step(stage, step) as measured:
+        cursor.execute(command, parameters)
+        measured.rows = cursor.rowcount if cursor.rowcount >= 0 else None
+    return cursor.rowcount
+
+
+def fileBytes(paths):
+    """Return the total size (bytes) of the existing files in 'paths'."""
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
@@ -0,0 +1,210 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Connection and path settings shared by the numbered scripts and 'run_pipeline.py'.
+1) Settings are read from 'pipeline.ini' in the folder of the scripts (or the file
+   named by the environment variable 'PRECISIONAG_CONFIG'); see 'pipeline_example.ini'
+        -- [database]: 'psycopg2' connection parameters (dbname, user, host, password, port)
+        -- [paths]: folders and files used by the scripts, by the name of the script variable
+        -- [pipeline]: stages to run, number of stages run at the same time, database backend, partitioning of 'yield_point'
+        -- [duckdb]: database file of the embedded DuckDB backend (see 'yield_duckdb.py')
+2) Without a config file (or for a setting it does not contain) the value written
+   in the script is used, so each script can still be run on its own
+3) When run by 'run_pipeline.py', database connections come from one shared
+   connection pool instead of each script connecting on its own; the parallel workers
+   of a script draw from it too ('connectionFactory'). 'connect' waits for a free
+   connection when they are all in use
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import configparser
+import threading
+import psycopg2
+import psycopg2.pool
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.environ.get('PRECISIONAG_CONFIG', os.path.join(SCRIPT_DIR, 'pipeline.ini'))
+
+# Connection used by the scripts when no [database] section is configured
+DEFAULT_CONNECTION_STRING = "dbname='PrecisionAg_v1' user='postgres' host='localhost' password='PASSWORD'"
+
+_config = None
+_pool = None
+_poolLock = threading.Condition()
+_inUse = 0
+# Connections taken from the pool: id(connection) -> (thread that took it, connection)
+_held = {}
+# Connections added to the pool for the parallel workers of the stage running in each thread
+_granted = {}
+
+
+def readConfig(configFile=None):
+    """Return the parsed config file (cached); an empty configuration if the file does not exist."""
+    global _config
+    if _config is None or configFile is not None:
+        config = configparser.ConfigParser(interpolation = None)
+        # Keep the case of option names, which match the (camelCase) script variables
+        config.optionxform = str
+        config.read(configFile or CONFIG_FILE)
+        _config = config
+    return _config
+
+
+def setting(section, option, default=None):
+    """Return the text value of 'option' in 'section', or 'default' if it is not configured."""
+    return readConfig().get(section, option, fallback = default)
+
+
+def flag(section, option, default=False):
+    """Return the configured value of a true/false 'option' in 'section', or 'default'."""
+    value = setting(section, option)
+    if value is None:
+        return default
+    return value.strip().lower() in ('true', 'yes', '1')
+
+
+def path(option, default=None):
+    """Return the configured value of a [paths] option (named as the script variable), or 'default'."""
+    return setting('paths', option, default)
+
+
+def backend():
+    """Return the database backend of the scripts: 'postgres' (default) or 'duckdb' (embedded, see 'yield_duckdb.py')."""
+    return setting('pipeline', 'backend', 'postgres').strip().lower()
+
+
+def connectionString():
+    """Return the 'psycopg2' connection string built from the [database] section (or the default)."""
+    config = readConfig()
+    if not config.has_section('database'):
+        return DEFAULT_CONNECTION_STRING
+    return ' '.join("{}='{}'".format(key, value.replace('\\', '\\\\').replace("'", "\\'")) for key, value in config.items('database'))
+
+
+###############################################################################
+# Connections
+
+def openPool(maxConnections, minConnections=0):
+    """Open the shared connection pool used by 'connect' (thread safe; used by 'run_pipeline.py').
+
+    Up to 'maxConnections' connections are kept open and reused; 'minConnections' are opened at once.
+    """
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(minConnections, maxConnections, connectionString())
+            # Returned connections are only kept open while the pool holds fewer than 'minconn'
+            _pool.minconn = maxConnections
+    return _pool
+
+
+def closePool():
+    """Close every connection of the shared pool."""
+    global _pool, _inUse
+    with _poolLock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _inUse = 0
+            _held.clear()
+            _granted.clear()
+
+
+def connect():
+    """Return a database connection: from the shared pool when open (waiting for a free one), otherwise a new connection."""
+    global _inUse
+    with _poolLock:
+        pool = _pool
+        if pool is not None:
+            while _inUse >= pool.maxconn:
+                _poolLock.wait()
+            _inUse += 1
+    if pool is None:
+        return psycopg2.connect(connectionString())
+    try:
+        connection = pool.getconn()
+    except Exception:
+        with _poolLock:
+            _inUse -= 1
+            _poolLock.notify()
+        raise
+    with _poolLock:
+        _held[id(connection)] = (threading.get_ident(), connection)
+    return connection
+
+
+def connectionFactory(workers):
+    """Return the function giving each of 'workers' parallel workers its connection (handed back with 'release').
+
+    When the shared pool is open it is enlarged by the workers of the stage running in this thread
+    (the most asked for by the stage, added to those of the other stages running) until 'releaseStage',
+    so they draw from the pool instead of opening connections of their own.
+    """
+    thread = threading.get_ident()
+    with _poolLock:
+        if _pool is not None:
+            extra = max(0, int(workers) - _granted.get(thread, 0))
+            _granted[thread] = _granted.get(thread, 0) + extra
+            _pool.maxconn += extra
+            _pool.minconn += extra
+            _poolLock.notify_all()
+    return connect
+
+
+def release(connection):
+    """Return a connection obtained from 'connect' to the pool (rolling back anything uncommitted), or close it."""
+    global _inUse
+    with _poolLock:
+        pool = _pool
+        pooled = pool is not None and _held.pop(id(connection), None) is not None
+    if not pooled:
+        # No pool, or not a connection of the pool
+        connection.close()
+        return
+    try:
+        pool.putconn(connection)
+    finally:
+        with _poolLock:
+            _inUse -= 1
+            _poolLock.notify()
+
+
+def releaseStage():
+    """Return the connections a stage run in this thread still holds (for instance after an error) and the connections added for its workers."""
+    thread = threading.get_ident()
+    with _poolLock:
+        connections = [connection for owner, connection in _held.values() if owner == thread]
+    for connection in connections:
+        release(connection)
+    with _poolLock:
+        extra = _granted.pop(thread, 0)
+        if _pool is not None and extra:
+            _pool.maxconn -= extra
+            _pool.minconn -= extra
@@ -0,0 +1,207 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+SCRIPT OVERVIEW AND CODE TO BE CHANGED BY USER
+
+This code runs the numbered scripts as the stages of one pipeline.
+1) Connection and path settings are read from 'pipeline.ini' (see 'pipeline_example.ini'
+   and 'pipeline_settings.py'); every stage shares one database connection pool
+2) Each stage declares the stages it depends on (list 'STAGES' below):
+        -- create_tables      '1_CreatingDatabaseTables.py'
+        -- ingest_csvs        '2_ProcessCSVs.py'            after create_tables
+        -- convert_swaths     '3_ConvertSHPs_toCSVs.py'     (no database; runs alongside the others)
+        -- spatially_enable   '4_SpatiallyEnable.py'        after ingest_csvs
+        -- field_polygons     '5_ImportFieldPolygonsSHP.py' after ingest_csvs (needs the 'field' rows)
+        -- vector_tiles       '6_SeedVectorTiles.py'        after spatially_enable, field_polygons and yield_grid
+        -- yield_styles       '7_GenerateYieldStyles.py'    after ingest_csvs
+        -- yield_rasters      '8_InterpolateYieldRasters.py' after spatially_enable and field_polygons
+        -- swath_polygons     '9_LoadSwathPolygons.py'      after convert_swaths and ingest_csvs
+        -- yield_grid         '10_AggregateYieldGrid.py'    after spatially_enable
+        -- geoparquet_export  '11_ExportGeoParquet.py'      after ingest_csvs and field_polygons
+3) Stages whose dependencies have completed run at the same time (up to 'stageWorkers'),
+   so the total time is that of the longest chain of stages rather than the sum of all stages
+4) If a stage fails, the stages depending on it are skipped; the others still run
+5) With the embedded DuckDB backend ('backend = duckdb' in 'pipeline.ini') only the stages
+   of 'DUCKDB_STAGES' run, one at a time (see 'yield_duckdb.py')
+6) The time and memory of every stage (and of the steps within it) are appended to
+   'pipeline_metrics.jsonl' with the same 'run_id' (see 'pipeline_metrics.py')
+
+Usage:
+    python run_pipeline.py                                  (stages from 'pipeline.ini')
+    python run_pipeline.py ingest_csvs spatially_enable     (only the named stages)
+
+Main components to be changed by user:
+1) 'pipeline.ini' (connection, paths, stages to run)
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import sys
+import time
+import runpy
+import datetime
+import collections
+import concurrent.futures
+import pipeline_settings
+import pipeline_metrics
+
+Stage = collections.namedtuple('Stage', ['name', 'script', 'dependencies'])
+
+STAGES = [
+    Stage('create_tables', '1_CreatingDatabaseTables.py', ()),
+    Stage('ingest_csvs', '2_ProcessCSVs.py', ('create_tables',)),
+    Stage('convert_swaths', '3_ConvertSHPs_toCSVs.py', ()),
+    Stage('spatially_enable', '4_SpatiallyEnable.py', ('ingest_csvs',)),
+    Stage('field_polygons', '5_ImportFieldPolygonsSHP.py', ('ingest_csvs',)),
+    Stage('vector_tiles', '6_SeedVectorTiles.py', ('spatially_enable', 'field_polygons', 'yield_grid')),
+    Stage('yield_styles', '7_GenerateYieldStyles.py', ('ingest_csvs',)),
+    Stage('yield_rasters', '8_InterpolateYieldRasters.py', ('spatially_enable', 'field_polygons')),
+    Stage('swath_polygons', '9_LoadSwathPolygons.py', ('convert_swaths', 'ingest_csvs')),
+    Stage('yield_grid', '10_AggregateYieldGrid.py', ('spatially_enable',)),
+    Stage('geoparquet_export', '11_ExportGeoParquet.py', ('ingest_csvs', 'field_polygons')),
+]
+
+# Stages the DuckDB backend implements
+DUCKDB_STAGES = ['create_tables', 'ingest_csvs', 'spatially_enable', 'field_polygons']
+
+# Module name the scripts are run under (anything but '__main__'/'__mp_main__')
+STAGE_RUN_NAME = 'pipeline_stage'
+
+
+def selectStages(stages, names):
+    """Return the stages named in 'names' (all stages for 'all'), in pipeline order.
+
+    Dependencies on stages that are not selected are treated as already done.
+    """
+    if not names or names == ['all']:
+        return list(stages)
+    known = set(stage.name for stage in stages)
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError("Unknown stages: {} (expected: {})".format(unknown, sorted(known)))
+    selected = set(names)
+    return [stage._replace(dependencies = tuple(name for name in stage.dependencies if name in selected))
+            for stage in stages if stage.name in selected]
+
+
+def checkStages(stages):
+    """Raise ValueError if a dependency is missing or the dependencies form a cycle."""
+    byName = dict((stage.name, stage) for stage in stages)
+    for stage in stages:
+        for name in stage.dependencies:
+            if name not in byName:
+                raise ValueError("Stage '{}' depends on unknown stage '{}'".format(stage.name, name))
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if set(stage.dependencies) <= done]
+        if not ready:
+            raise ValueError("Stage dependencies form a cycle: {}".format([stage.name for stage in remaining]))
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage.name not in done]
+
+
+def runStage(stage):
+    """Run the script of 'stage' in this process (recorded in the metrics file as stage 'pipeline'); returns the seconds taken."""
+    startTime = time.time()
+    with pipeline_metrics.Step('pipeline', stage.name):
+        try:
+            runpy.run_path(os.path.join(pipeline_settings.SCRIPT_DIR, stage.script), run_name = STAGE_RUN_NAME)
+        except SystemExit as exit:
+            # A script may end early with 'sys.exit()' (for instance after running on the DuckDB backend)
+            if exit.code not in (None, 0):
+                raise
+        finally:
+            # Connections a failed stage did not release go back to the pool for the other stages
+            pipeline_settings.releaseStage()
+    return time.time() - startTime
+
+
+def runPipeline(stages, stageWorkers):
+    """Run 'stages', each as soon as its dependencies have completed; returns {stage name: status}."""
+    checkStages(stages)
+    status = dict((stage.name, 'pending') for stage in stages)
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers = stageWorkers) as pool:
+        while True:
+            for stage in stages:
+                if status[stage.name] != 'pending':
+                    continue
+                dependencies = [status[name] for name in stage.dependencies]
+                if any(state in ('failed', 'skipped') for state in dependencies):
+                    status[stage.name] = 'skipped'
+                    print("[pipeline] Skipped " + stage.name + " (a stage it depends on did not complete)")
+                elif all(state == 'done' for state in dependencies):
+                    status[stage.name] = 'running'
+                    print("[pipeline] Started " + stage.name + " (" + stage.script + ") at " + str(datetime.datetime.now()))
+                    running[pool.submit(runStage, stage)] = stage
+            if not running:
+                break
+            finished, unfinished = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    seconds = future.result()
+                    status[stage.name] = 'done'
+                    print("[pipeline] Completed " + stage.name + " in " + str(round(seconds, 1)) + " seconds")
+                except BaseException as error:
+                    # Includes 'sys.exit' called by a script with an error
+                    status[stage.name] = 'failed'
+                    print("[pipeline] FAILED " + stage.name + ": " + repr(error))
+    return status
+
+
+if __name__ == '__main__':
+    startTime = time.time()
+    print("Current time: " + str(datetime.datetime.now()))
+    stageNames = sys.argv[1:] or [name.strip() for name in pipeline_settings.setting('pipeline', 'stages', 'all').split(',')]
+    stages = selectStages(STAGES, stageNames)
+    stageWorkers = int(pipeline_settings.setting('pipeline', 'stageWorkers', '3'))
+    if pipeline_settings.backend() == 'duckdb':
+        # The stages share one database file; they run one at a time
+        skipped = [stage.name for stage in stages if stage.name not in DUCKDB_STAGES]
+        if skipped:
+            print("[pipeline] Not run with the DuckDB backend: " + ', '.join(skipped))
+        names = [stage.name for stage in stages if stage.name in DUCKDB_STAGES]
+        stages = selectStages(stages, names) if names else []
+        stageWorkers = 1
+
+    # Python allocation peaks are process-wide: recorded only when one stage runs at a time
+    pipeline_metrics.setConcurrentStages(stageWorkers)
+
+    # One pooled connection per stage running at the same time (enlarged for the parallel workers of a stage,
+    # see 'pipeline_settings.connectionFactory')
+    pipeline_settings.openPool(max(1, stageWorkers))
+    try:
+        status = runPipeline(stages, stageWorkers)
+    finally:
+        pipeline_settings.closePool()
+
+    print("[pipeline] " + ', '.join(name + ': ' + state for name, state in status.items()))
+    print("[pipeline] Total time: " + str(round(time.time() - startTime, 1)) + " seconds")
+    print("Current time: " + str(datetime.datetime.now()))
+    sys.exit(0 if all(state == 'done' for state in status.values()) else 1)
@@ -0,0 +1,151 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Conversion of one swath polygon shapefile to a CSV or GeoParquet file, used by
+'3_ConvertSHPs_toCSVs.py'. Kept in a module (rather than in the script) so the
+functions can be sent to the worker processes of a process pool, whether the
+script is run on its own or as a stage of 'run_pipeline.py'.
+        -- 'wkb_csv': CSV with a hex WKB geometry field ('WKB')
+        -- 'wkt_csv': CSV with a WKT geometry field ('WKT')
+        -- 'geoparquet': GeoParquet file (requires 'pyarrow'), geometry stored as WKB
+Features are read and written in batches, so memory does not grow with the size
+of the shapefile.
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import csv
+import json
+import time
+from osgeo import ogr
+
+# Output file extension of each format
+OUTPUT_EXTENSIONS = {'wkb_csv': '.csv', 'wkt_csv': '.csv', 'geoparquet': '.parquet'}
+# Number of features held in memory and written at a time
+DEFAULT_BATCH_SIZE = 10000
+
+
+def writeSwathCSV(layer, fields, outputPath, outputFormat, batchSize=DEFAULT_BATCH_SIZE):
+    """Write the features of 'layer' to a CSV in batches, geometry as hex WKB or WKT; returns the number of features."""
+    geometryField = 'WKT' if outputFormat == 'wkt_csv' else 'WKB'
+    count = 0
+    # Text mode with newline='' as required by the 'csv' module in Python 3.x
+    with open(outputPath, 'w', newline = '', encoding = 'utf-8') as csvFile:
+        csvWriter = csv.writer(csvFile)
+        csvWriter.writerow(fields + [geometryField])
+        rows = []
+        for feature in layer:
+            geom = feature.GetGeometryRef()
+            if geom is None:
+                geometry = ''
+            elif outputFormat == 'wkt_csv':
+                geometry = geom.ExportToWkt()
+            else:
+                geometry = bytes(geom.ExportToWkb()).hex()
+            rows.append([feature.GetField(i) for i in range(len(fields))] + [geometry])
+            if len(rows) >= batchSize:
+                csvWriter.writerows(rows)
+                count += len(rows)
+                rows = []
+        csvWriter.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def writeSwathGeoParquet(layer, fields, outputPath, batchSize=DEFAULT_BATCH_SIZE):
+    """Write the features of 'layer' to GeoParquet in batches (one row group per batch); returns the number of features."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Declare the column types from the shapefile's field types, so every batch has the same schema
+    dfn = layer.GetLayerDefn()
+    arrowTypes = {ogr.OFTInteger: pa.int32(), ogr.OFTInteger64: pa.int64(), ogr.OFTReal: pa.float64()}
+    schema = pa.schema([pa.field(fields[i], arrowTypes.get(dfn.GetFieldDefn(i).GetType(), pa.string()))
+                        for i in range(len(fields))] + [pa.field('geometry', pa.binary())])
+
+    # GeoParquet metadata identifying the WKB geometry column and its coordinate reference system
+    geoColumn = {'encoding': 'WKB', 'geometry_types': []}
+    spatialRef = layer.GetSpatialRef()
+    if spatialRef is not None and hasattr(spatialRef, 'ExportToPROJJSON'):
+        geoColumn['crs'] = json.loads(spatialRef.ExportToPROJJSON())
+    schema = schema.with_metadata({'geo': json.dumps({'version': '1.0.0', 'primary_column': 'geometry',
+                                                      'columns': {'geometry': geoColumn}})})
+
+    # Date and other non-numeric fields are written as text
+    textFields = [i for i in range(len(fields)) if schema.field(i).type == pa.string()]
+
+    count = 0
+    writer = pq.ParquetWriter(outputPath, schema)
+    try:
+        columns = [[] for i in range(len(fields) + 1)]
+        for feature in layer:
+            values = [feature.GetField(i) for i in range(len(fields))]
+            for i in textFields:
+                if values[i] is not None:
+                    values[i] = str(values[i])
+            for i in range(len(fields)):
+                columns[i].append(values[i])
+            geom = feature.GetGeometryRef()
+            columns[-1].append(bytes(geom.ExportToWkb()) if geom is not None else None)
+            if len(columns[-1]) >= batchSize:
+                writer.write_table(pa.Table.from_arrays(columns, schema = schema))
+                count += len(columns[-1])
+                columns = [[] for i in range(len(fields) + 1)]
+        if columns[-1]:
+            writer.write_table(pa.Table.from_arrays(columns, schema = schema))
+            count += len(columns[-1])
+    finally:
+        writer.close()
+    return count
+
+
+def convertSwathSHP(shpPath, outputDir, outputFormat='wkb_csv', batchSize=DEFAULT_BATCH_SIZE):
+    """Convert one swath shapefile into 'outputDir'; returns (file name, number of features, seconds)."""
+    startTime = time.time()
+    # Identify only the file name itself
+    file_name = os.path.basename(shpPath)[:-4]
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    # Access the shapefile as read-only
+    dataSource = driver.Open(shpPath, 0)    # 0 means read-only; 1 means writeable.
+
+    # .GetLayer allows access to features in a layer - http://pcjericks.github.io/py-gdalogr-cookbook/layers.html#iterate-over-features
+    layer = dataSource.GetLayer()
+
+    # Access the fields of the layer and count of fields - http://pcjericks.github.io/py-gdalogr-cookbook/layers.html#get-shapefile-fields-get-the-user-defined-fields
+    dfn = layer.GetLayerDefn()
+    fields = [dfn.GetFieldDefn(i).GetName() for i in range(dfn.GetFieldCount())]
+
+    outputPath = os.path.join(outputDir, file_name) + OUTPUT_EXTENSIONS[outputFormat]
+    if outputFormat == 'geoparquet':
+        count = writeSwathGeoParquet(layer, fields, outputPath, batchSize)
+    else:
+        count = writeSwathCSV(layer, fields, outputPath, outputFormat, batchSize)
+
+    del layer, dataSource
+    return file_name, count, time.time() - startTime
@@ -0,0 +1,204 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Registry of the raw precision agriculture yield CSV layouts, by vendor.
+For every column of a vendor's CSV the registry declares:
+        -- the column heading in the raw CSV ('source')
+        -- the column of the vendor scratch table '_CSVimport_yield_point_*' ('staging')
+        -- the column of the final 'yield_point' table ('final')
+        -- the 'pandas' data type used to read it ('dtype'); 'date' columns are read
+           as text and converted once per distinct value using the vendor's date format
+
+Reading with explicit data types avoids 'pandas' inferring the type of every column
+of every file, and raises an error on a malformed value instead of silently falling
+back to (memory hungry) text columns.
+
+Main components to be changed by user:
+1) Columns of each vendor's CSV, if the vendor changes its export layout
+2) Date format of each vendor
+
+"""
+
+# Import necessary Python packages and libraries
+import collections
+import pandas as pd
+
+VendorColumn = collections.namedtuple('VendorColumn', ['source', 'staging', 'final', 'dtype'])
+VendorSchema = collections.namedtuple('VendorSchema', ['vendor', 'stagingTable', 'dateFormat', 'columns'])
+
+# Repeated text values (field, product, monitor settings) are stored as 'category'
+TEXT = 'category'
+NUMBER = 'float64'
+DATE = 'date'
+# Counts and identifiers are read as (nullable) integers, 'Int16' or 'Int32'; a fractional value raises an error
+
+###############################################################################
+# Yield - John Deere
+
+JOHN_DEERE = VendorSchema(
+    vendor = 'johndeere',
+    stagingTable = '_CSVimport_yield_point_JD',
+    dateFormat = '%m/%d/%Y',
+    columns = [
+        VendorColumn('Longitude', 'longitude', 'longitude', NUMBER),
+        VendorColumn('Latitude', 'latitude', 'latitude', NUMBER),
+        VendorColumn('Field', 'field', 'field', TEXT),
+        VendorColumn('Dataset', 'dataset', 'dataset', TEXT),
+        VendorColumn('Product', 'product', 'product', TEXT),
+        VendorColumn('Obj__Id', 'obj__id', 'obj__id', 'Int32'),
+        VendorColumn('Distance_f', 'distance_f', 'distance_f', NUMBER),
+        VendorColumn('Track_deg_', 'track_deg_', 'track_deg_', NUMBER),
+        VendorColumn('Duration_s', 'duration_s', 'duration_s', NUMBER),
+        VendorColumn('Elevation_', 'elevation_', 'elevation_', NUMBER),
+        VendorColumn('Time', 'time', 'time', DATE),
+        VendorColumn('Area_Count', 'area_count', 'area_count', TEXT),
+        VendorColumn('Swth_Wdth_', 'swth_wdth', 'swth_wdth', NUMBER),
+        VendorColumn('Y_Offset_f', 'y_offset_f', 'y_offset_f', NUMBER),
+        VendorColumn('Crop_Flw_M', 'crop_flw_m', 'crop_flw_m', NUMBER),
+        VendorColumn('Moisture__', 'moisture__', 'moisture__', NUMBER),
+        VendorColumn('Yld_Mass_W', 'yld_mass_w', 'yld_mass_w', NUMBER),
+        VendorColumn('Yld_Vol_We', 'yld_vol_we', 'yld_vol_we', NUMBER),
+        VendorColumn('Yld_Mass_D', 'yld_mass_d', 'yld_mass_d', NUMBER),
+        VendorColumn('Yld_Vol_Dr', 'yld_vol_dr', 'yld_vol_dr', NUMBER),
+        VendorColumn('Humidity__', 'humidity__', 'humidity__', NUMBER),
+        VendorColumn('Air_Temp__', 'air_temp__', 'air_temp__', NUMBER),
+        VendorColumn('Wind_Speed', 'wind_speed', 'wind_speed', NUMBER),
+        VendorColumn('Soil_Temp_', 'soil_temp_', 'soil_temp__', NUMBER),
+        VendorColumn('Pass_Num', 'pass_num', 'pass_num', 'Int16'),
+        VendorColumn('Speed_mph_', 'speed_mph_', 'speed_mph_', NUMBER),
+        VendorColumn('Prod_ac_h_', 'prod_ac_h_', 'prod_ac_h_', NUMBER),
+        VendorColumn('Crop_Flw_V', 'crop_flw_v', 'crop_flw_v', NUMBER),
+        VendorColumn('Date', 'date', 'date', DATE),
+    ])
+
+###############################################################################
+# Yield - AgFiniti
+
+AGFINITI = VendorSchema(
+    vendor = 'agfiniti',
+    stagingTable = '_CSVimport_yield_point_AgFiniti',
+    dateFormat = '%m/%d/%Y',
+    columns = [
+        VendorColumn('Longitude', 'longitude', 'longitude', NUMBER),
+        VendorColumn('Latitude', 'latitude', 'latitude', NUMBER),
+        VendorColumn('Field', 'field', 'field', TEXT),
+        VendorColumn('Dataset', 'dataset', 'dataset', TEXT),
+        VendorColumn('Product', 'product', 'product', TEXT),
+        VendorColumn('Obj__Id', 'obj__id', 'obj__id', 'Int32'),
+        VendorColumn('Track_deg_', 'track_deg_', 'track_deg_', NUMBER),
+        VendorColumn('Swth_Wdth_', 'swth_wdth', 'swth_wdth', NUMBER),
+        VendorColumn('Distance_f', 'distance_f', 'distance_f', NUMBER),
+        VendorColumn('Duration_s', 'duration_s', 'duration_s', NUMBER),
+        VendorColumn('Elevation_', 'elevation_', 'elevation_', NUMBER),
+        VendorColumn('Area_Count', 'area_count', 'area_count', TEXT),
+        VendorColumn('Diff_Statu', 'diff_statu', 'diff_statu', TEXT),
+        VendorColumn('Time', 'time', 'time', DATE),
+        VendorColumn('X_Offset_f', 'x_offset_f', 'x_offset_f', NUMBER),
+        VendorColumn('Y_Offset_f', 'y_offset_f', 'y_offset_f', NUMBER),
+        VendorColumn('Satellites', 'satellites', 'satellites', 'Int16'),
+        VendorColumn('Hding_Veh_', 'hding_veh_', 'hding_veh_', NUMBER),
+        VendorColumn('Diff_Sta_1', 'diff_statu_1', 'diff_statu_1', TEXT),
+        VendorColumn('Active_Row', 'active_row', 'active_row', 'Int16'),
+        VendorColumn('VDOP', 'vdop', 'vdop', NUMBER),
+        VendorColumn('HDOP', 'hdop', 'hdop', NUMBER),
+        VendorColumn('PDOP', 'pdop', 'pdop', NUMBER),
+        VendorColumn('Crop_Flw_M', 'crop_flw_m', 'crop_flw_m', NUMBER),
+        VendorColumn('Moisture__', 'moisture__', 'moisture__', NUMBER),
+        VendorColumn('Grain_Temp', 'grain_temp', 'grain_temp', NUMBER),
+        VendorColumn('Pass_Num', 'pass_num', 'pass_num', 'Int16'),
+        VendorColumn('Yld_Mass_D', 'yld_mass_d', 'yld_mass_d', NUMBER),
+        VendorColumn('Yld_Vol_Dr', 'yld_vol_dr', 'yld_vol_dr', NUMBER),
+        VendorColumn('Yld_Mass_W', 'yld_mass_w', 'yld_mass_w', NUMBER),
+        VendorColumn('Yld_Vol_We', 'yld_vol_we', 'yld_vol_we', NUMBER),
+        VendorColumn('Speed_mph_', 'speed_mph_', 'speed_mph_', NUMBER),
+        VendorColumn('Prod_ac_h_', 'prod_ac_h_', 'prod_ac_h_', NUMBER),
+        VendorColumn('Crop_Flw_V', 'crop_flw_v', 'crop_flw_v', NUMBER),
+        VendorColumn('Date', 'date', 'date', DATE),
+    ])
+
+VENDOR_SCHEMAS = {
+    JOHN_DEERE.vendor: JOHN_DEERE,
+    AGFINITI.vendor: AGFINITI,
+}
+
+###############################################################################
+# Reading the raw CSVs using a vendor schema
+
+def stagingColumns(schema):
+    """Return the scratch table column names of the vendor's CSV columns, in CSV order."""
+    return [column.staging for column in schema.columns]
+
+
+def finalColumns(schema):
+    """Return a dictionary of scratch table column name -> 'yield_point' column name."""
+    return dict((column.staging, column.final) for column in schema.columns)
+
+
+def readOptions(schema):
+    """Return the 'pd.read_csv' keyword arguments (column names and data types) for the vendor's CSVs."""
+    dtypes = {}
+    for column in schema.columns:
+        # Dates are read as text (category) and converted once per distinct value by 'parseDates'
+        dtypes[column.staging] = TEXT if column.dtype == DATE else column.dtype
+    return {'header': 0, 'names': stagingColumns(schema), 'dtype': dtypes}
+
+
+def checkHeader(csvPath, schema):
+    """Raise ValueError if the heading of 'csvPath' does not match the vendor's declared columns."""
+    header = pd.read_csv(csvPath, nrows = 0).columns
+    expected = [column.source for column in schema.columns]
+    if [name.lower() for name in header] != [name.lower() for name in expected]:
+        raise ValueError("Unexpected columns for vendor '{}' in {}: {}".format(schema.vendor, csvPath, list(header)))
+
+
+def parseDateColumn(series, dateFormat):
+    """Convert a column of date strings, parsing each distinct string only once."""
+    # Every point harvested on a day repeats the same date string, so only the categories are parsed
+    categorical = series.astype('category')
+    parsed = pd.to_datetime(categorical.cat.categories, format = dateFormat)
+    values = parsed.take(categorical.cat.codes.to_numpy(), allow_fill = True, fill_value = pd.NaT)
+    return pd.Series(values, index = series.index, name = series.name)
+
+
+def parseDates(df, schema):
+    """Convert the vendor's date columns of 'df' in place; returns 'df'."""
+    for column in schema.columns:
+        if column.dtype == DATE:
+            df[column.staging] = parseDateColumn(df[column.staging], schema.dateFormat)
+    return df
+
+
+def readVendorCSV(csvPath, schema, chunksize=None, nrows=None):
+    """Read a raw CSV with the vendor's declared data types.
+
+    Returns a dataframe, or an iterator of dataframes when 'chunksize' is given.
+    """
+    options = readOptions(schema)
+    if chunksize is None:
+        return parseDates(pd.read_csv(csvPath, nrows = nrows, **options), schema)
+    return (parseDates(df, schema) for df in pd.read_csv(csvPath, chunksize = chunksize, **options))
@@ -0,0 +1,202 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Bulk-load mode of '2_ProcessCSVs.py' (variable 'bulkLoadMode'), for full-season rebuilds.
+1) The scratch tables '_CSVimport_yield_point_*' are UNLOGGED (created so by '1_CreatingDatabaseTables.py'):
+   their rows are not written to the write-ahead log, and are emptied after a database crash
+   (they are reloaded by every run)
+2) Before the load, the indexes, primary keys and foreign keys of the scratch tables and 'yield_point'
+   are dropped, so 'COPY'/'INSERT' neither update indexes nor check foreign keys row by row
+        -- Their definitions are recorded in table 'bulk_load_deferred' in the transaction dropping them,
+           so a run failing before the rebuild leaves them to be rebuilt by the next run
+3) After the load they are rebuilt over several database connections at the same time, each with a
+   larger 'maintenance_work_mem' (and parallel workers per index build):
+        -- every index first (including those of the primary keys), all at the same time
+        -- then the primary keys (attaching the indexes just built) and the foreign keys ('NOT VALID')
+        -- then the foreign keys are validated (one query per key), one table per connection
+4) 'ANALYZE' updates the planner statistics of the loaded tables
+
+"""
+
+# Import necessary Python packages and libraries
+import concurrent.futures
+import yield_partitions
+import pipeline_settings
+
+DEFERRED_TABLE = 'bulk_load_deferred'
+# Table names are lower case in the database
+STAGING_TABLES = ['_csvimport_yield_point_jd', '_csvimport_yield_point_agfiniti']
+YIELD_POINT = yield_partitions.YIELD_POINT
+BULK_LOAD_TABLES = STAGING_TABLES + [YIELD_POINT]
+
+# Rebuild steps, run in order
+BUILD_INDEX = 1
+ADD_CONSTRAINT = 2
+VALIDATE_CONSTRAINT = 3
+
+DEFAULT_MAINTENANCE_WORK_MEM = '1GB'
+DEFAULT_PARALLEL_WORKERS = 2
+
+
+def createDeferredTableCommand():
+    """Return the 'CREATE TABLE IF NOT EXISTS' command of the table of dropped indexes and constraints."""
+    return """
+CREATE TABLE IF NOT EXISTS {}(
+table_name VARCHAR(63) NOT NULL,
+object_name VARCHAR(63) NOT NULL,
+step smallint NOT NULL,   -- 1 = build index, 2 = add constraint, 3 = validate constraint
+command text NOT NULL,
+CONSTRAINT bulk_load_deferred_pkey PRIMARY KEY (table_name, object_name, step)
+);""".format(DEFERRED_TABLE)
+
+
+def maintenanceSettings(maintenanceWorkMem=DEFAULT_MAINTENANCE_WORK_MEM, parallelWorkers=DEFAULT_PARALLEL_WORKERS):
+    """Return the 'SET LOCAL' commands of a transaction building indexes ('max_parallel_maintenance_workers': PostgreSQL 11 or later).
+
+    Run them in the transaction of the index build: they end with it, so pooled connections are handed back unchanged.
+    """
+    return ["SET LOCAL maintenance_work_mem = '{}';".format(maintenanceWorkMem),
+            "SET LOCAL max_parallel_maintenance_workers = {};".format(int(parallelWorkers))]
+
+
+def setUnlogged(cursor, table):
+    """Make 'table' UNLOGGED if it is a logged table (the table is rewritten); returns True if it was changed."""
+    cursor.execute("SELECT relpersistence FROM pg_class WHERE oid = %s::regclass;", (table,))
+    if cursor.fetchone()[0] != 'p':
+        return False
+    cursor.execute("ALTER TABLE {} SET UNLOGGED;".format(table))
+    return True
+
+
+def _rebuildIndexCommand(indexDefinition):
+    # 'pg_get_indexdef' returns 'CREATE [UNIQUE] INDEX name ON [ONLY] table ...'; without 'ONLY' the index of a
+    # partitioned table is built on every partition, including those created during the load
+    return indexDefinition.replace(' INDEX ', ' INDEX IF NOT EXISTS ', 1).replace(' ON ONLY ', ' ON ', 1) + ';'
+
+
+def deferIndexes(cursor, tables=BULK_LOAD_TABLES):
+    """Record and drop the indexes, primary/unique keys and foreign keys of 'tables'; returns the number dropped.
+
+    Commit before loading; 'rebuildDeferred' creates them again.
+    """
+    cursor.execute(createDeferredTableCommand())
+    dropped = 0
+    for table in tables:
+        partitioned = yield_partitions.isPartitioned(cursor, table)
+        deferred = []
+        drops = []
+        cursor.execute("""
+SELECT conname, contype, pg_get_constraintdef(oid), CASE WHEN contype = 'f' THEN NULL ELSE pg_get_indexdef(conindid) END
+FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+ORDER BY contype, conname;""", (table,))
+        for name, kind, definition, indexDefinition in cursor.fetchall():
+            if kind == 'f' and not partitioned:
+                # Added without checking the rows, then checked by a single query
+                deferred.append((name, ADD_CONSTRAINT, "ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID;".format(table, name, definition)))
+                deferred.append((name, VALIDATE_CONSTRAINT, "ALTER TABLE {} VALIDATE CONSTRAINT {};".format(table, name)))
+            elif partitioned:
+                # Partitioned tables support neither 'NOT VALID' foreign keys nor keys 'USING INDEX'
+                deferred.append((name, ADD_CONSTRAINT, "ALTER TABLE {} ADD CONSTRAINT {} {};".format(table, name, definition)))
+            else:
+                # The key's index is built at the same time as the other indexes, then attached
+                deferred.append((name, BUILD_INDEX, _rebuildIndexCommand(indexDefinition)))
+                deferred.append((name, ADD_CONSTRAINT, "ALTER TABLE {} ADD CONSTRAINT {} {} USING INDEX {};".format(
+                    table, name, 'PRIMARY KEY' if kind == 'p' else 'UNIQUE', name)))
+            drops.append("ALTER TABLE {} DROP CONSTRAINT {};".format(table, name))
+
+        # Indexes not belonging to a key (for instance 'yield_point_org_file' and the spatial index)
+        cursor.execute("""
+SELECT c.relname, pg_get_indexdef(i.indexrelid)
+FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = %s::regclass
+AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conrelid = i.indrelid AND con.conindid = i.indexrelid)
+ORDER BY c.relname;""", (table,))
+        for name, definition in cursor.fetchall():
+            deferred.append((name, BUILD_INDEX, _rebuildIndexCommand(definition)))
+            drops.append("DROP INDEX {};".format(name))
+
+        for name, step, command in deferred:
+            cursor.execute("""
+INSERT INTO {}(table_name, object_name, step, command) VALUES (%s, %s, %s, %s)
+ON CONFLICT DO NOTHING;""".format(DEFERRED_TABLE), (table, name, step, command))
+        for command in drops:
+            cursor.execute(command)
+        dropped += len(drops)
+    return dropped
+
+
+def _runDeferred(connect, settings, commands):
+    connection = connect()
+    try:
+        cursor = connection.cursor()
+        for table, name, step, command in commands:
+            # Each command is committed together with the removal of its record (and its settings end with it)
+            for setting in settings:
+                cursor.execute(setting)
+            cursor.execute(command)
+            cursor.execute("DELETE FROM {} WHERE table_name = %s AND object_name = %s AND step = %s;".format(DEFERRED_TABLE),
+                           (table, name, step))
+            connection.commit()
+        cursor.close()
+        return len(commands)
+    finally:
+        pipeline_settings.release(connection)
+
+
+def rebuildDeferred(connect, cursor, workers=4, maintenanceWorkMem=DEFAULT_MAINTENANCE_WORK_MEM,
+                    parallelWorkers=DEFAULT_PARALLEL_WORKERS):
+    """Rebuild the indexes and constraints recorded by 'deferIndexes' over 'workers' connections; returns the commands run.
+
+    Commit the load first. Indexes are built all at the same time; constraints are added and validated
+    one table per connection (commands on the same table would wait for each other's locks).
+    """
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (DEFERRED_TABLE,))
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT table_name, object_name, step, command FROM {} ORDER BY step, table_name, object_name;".format(DEFERRED_TABLE))
+    deferred = cursor.fetchall()
+
+    settings = maintenanceSettings(maintenanceWorkMem, parallelWorkers)
+    commandsRun = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as pool:
+        for step in (BUILD_INDEX, ADD_CONSTRAINT, VALIDATE_CONSTRAINT):
+            commands = [row for row in deferred if row[2] == step]
+            if step == BUILD_INDEX:
+                tasks = [[row] for row in commands]
+            else:
+                tasks = [[row for row in commands if row[0] == table] for table in sorted(set(row[0] for row in commands))]
+            futures = [pool.submit(_runDeferred, connect, settings, task) for task in tasks]
+            for future in concurrent.futures.as_completed(futures):
+                commandsRun += future.result()
+    return commandsRun
+
+
+def analyzeTables(cursor, tables=BULK_LOAD_TABLES):
+    """Update the planner statistics of 'tables' (of every partition too, for a partitioned table)."""
+    for table in tables:
+        cursor.execute("ANALYZE {};".format(table))
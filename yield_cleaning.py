@@ -0,0 +1,347 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Rule-based cleaning of raw yield monitor points, applied to each chunk of rows before it is
+copied to the database (a chunk transform of 'yield_ingest.py'), so junk points never reach
+'yield_point', its indexes or the map tiles.
+        -- Points logged with the header raised ('area_count' = 'Off')
+        -- Ground speed, grain flow, grain moisture and swath width outside plausible limits
+        -- The first and last points of each pass (grain flow delay of the combine at the
+           start and end of a pass)
+        -- Yield outside absolute limits, then more than 'yieldStdLimit' standard deviations
+           from the mean of its file and product
+Every rule is a vectorized ('pandas'/'numpy') mask over the chunk. Points are counted under
+the first rule removing them; the counts are printed and recorded with the step metrics.
+The pass edges and the yield mean/standard deviation are those of the whole file, whatever the
+chunk size: the last points of each chunk are held back until the next chunk (or the end of the
+file), and a first pass over the file ('YieldCleaner.startFile') accumulates the yield statistics.
+
+Main components to be changed by user:
+1) Thresholds of each vendor ('VENDOR_RULES'); 'None' turns a limit off
+
+"""
+
+# Import necessary Python packages and libraries
+import time
+import itertools
+import collections
+import numpy as np
+import pandas as pd
+import pipeline_metrics
+
+CleaningRules = collections.namedtuple('CleaningRules', [
+    'dropAreaOff',                  # drop points logged with the header raised
+    'minSpeed', 'maxSpeed',         # ground speed (mph; 'speed_mph_')
+    'minFlow', 'maxFlow',           # grain mass flow (lb/s; 'crop_flw_m')
+    'minMoisture', 'maxMoisture',   # grain moisture (%; 'moisture__')
+    'minSwath', 'maxSwath',         # swath width (ft; 'swth_wdth')
+    'passStartPoints',              # points dropped at the start of each pass
+    'passEndPoints',                # points dropped at the end of each pass
+    'yieldColumn',                  # yield column of the yield limits
+    'minYield', 'maxYield',         # absolute yield limits (units of 'yieldColumn')
+    'yieldStdLimit',                # standard deviations from the file/product mean
+])
+
+###############################################################################
+# Thresholds by vendor
+
+# John Deere logs one point per second: about 4 s of flow delay at the start of a pass and 2 s at the end
+JOHN_DEERE_RULES = CleaningRules(
+    dropAreaOff = True,
+    minSpeed = 1.0, maxSpeed = 8.0,
+    minFlow = 1.0, maxFlow = None,
+    minMoisture = 5.0, maxMoisture = 35.0,
+    minSwath = 5.0, maxSwath = 60.0,
+    passStartPoints = 4, passEndPoints = 2,
+    yieldColumn = 'yld_vol_dr',
+    minYield = 1.0, maxYield = 500.0,
+    yieldStdLimit = 3.0)
+
+# AgFiniti exports one point every 2 seconds
+AGFINITI_RULES = JOHN_DEERE_RULES._replace(passStartPoints = 2, passEndPoints = 1)
+
+VENDOR_RULES = {
+    'johndeere': JOHN_DEERE_RULES,
+    'agfiniti': AGFINITI_RULES,
+}
+
+###############################################################################
+# Rules
+
+def _outside(series, minimum, maximum):
+    values = series.to_numpy(dtype = 'float64', na_value = np.nan)
+    mask = np.zeros(len(values), dtype = bool)
+    if minimum is not None:
+        mask |= values < minimum
+    if maximum is not None:
+        mask |= values > maximum
+    return mask
+
+
+def areaOffMask(df, rules):
+    """Points logged with the header raised."""
+    if not rules.dropAreaOff:
+        return np.zeros(len(df), dtype = bool)
+    # Compared once per distinct value
+    areaCount = df['area_count'].astype('category')
+    offCodes = np.flatnonzero(areaCount.cat.categories.astype(str).str.lower() == 'off')
+    return np.isin(areaCount.cat.codes.to_numpy(), offCodes)
+
+
+def passPositions(df, firstPosition=0):
+    """Return the position of each point in its pass and the number of points after it in 'df' (consecutive rows of one file and pass).
+
+    'firstPosition' is the number of points of the first pass of 'df' in earlier chunks of its file.
+    """
+    passes = df['pass_num'].to_numpy(dtype = 'float64', na_value = np.nan)
+    files = pd.factorize(df['org_file'])[0]
+    newPass = np.ones(len(df), dtype = bool)
+    newPass[1:] = (passes[1:] != passes[:-1]) | (files[1:] != files[:-1])
+    starts = np.flatnonzero(newPass)
+    ends = np.append(starts[1:], len(df))
+    passIndex = np.cumsum(newPass) - 1
+    position = np.arange(len(df)) - starts[passIndex]
+    position[:ends[0]] += firstPosition
+    remaining = ends[passIndex] - np.arange(len(df)) - 1
+    return position, remaining
+
+
+def passEdgeMask(df, rules, firstPosition=0):
+    """The first 'passStartPoints' and last 'passEndPoints' points of each pass (see 'passPositions')."""
+    mask = np.zeros(len(df), dtype = bool)
+    if not len(df) or not (rules.passStartPoints or rules.passEndPoints):
+        return mask
+    position, remaining = passPositions(df, firstPosition)
+    return (position < (rules.passStartPoints or 0)) | (remaining < (rules.passEndPoints or 0))
+
+
+def yieldStdMask(df, rules, keep, yieldStats=None):
+    """Points more than 'yieldStdLimit' standard deviations from the mean yield of their file and product (of the kept points).
+
+    'yieldStats' holds the statistics of the whole file ('addYieldStats'); without it they are
+    computed over 'df' (one file) alone.
+    """
+    if rules.yieldStdLimit is None:
+        return np.zeros(len(df), dtype = bool)
+    values = df[rules.yieldColumn].to_numpy(dtype = 'float64', na_value = np.nan)
+    if yieldStats is None:
+        yieldStats = addYieldStats({}, df, rules, keep)
+    # Group on the integer codes of product (rows without a product, code -1, use the last slot)
+    codes, products = pd.factorize(df['product'])
+    mean = np.full(len(products) + 1, np.nan)
+    std = np.full(len(products) + 1, np.nan)
+    for code, product in enumerate(list(products) + [None]):
+        count, productMean, sumSquares = yieldStats.get(product, (0, np.nan, 0.0))
+        mean[code] = productMean
+        if count > 1:
+            std[code] = np.sqrt(sumSquares / (count - 1))
+    with np.errstate(invalid = 'ignore'):
+        return np.abs(values - mean[codes]) > rules.yieldStdLimit * std[codes]
+
+
+def addYieldStats(yieldStats, df, rules, keep):
+    """Add the kept yields of 'df' (one file) to 'yieldStats': product -> (count, mean, sum of squared deviations).
+
+    Chunks are merged with the parallel form of Welford's algorithm, so the statistics match one pass over the file.
+    """
+    values = pd.Series(df[rules.yieldColumn].to_numpy(dtype = 'float64', na_value = np.nan)[keep])
+    products = pd.Series(df['product'].to_numpy(dtype = object)[keep])
+    codes, uniques = pd.factorize(products)
+    grouped = values.groupby(codes, sort = False)
+    counts, means, variances = grouped.count(), grouped.mean(), grouped.var(ddof = 0)
+    for code in counts.index:
+        count, mean = int(counts[code]), means[code]
+        if not count:
+            continue
+        product = None if code < 0 else uniques[code]
+        sumSquares = variances[code] * count
+        total, totalMean, totalSquares = yieldStats.get(product, (0, 0.0, 0.0))
+        delta = mean - totalMean
+        merged = total + count
+        yieldStats[product] = (merged, totalMean + delta * count / merged,
+                               totalSquares + sumSquares + delta * delta * total * count / merged)
+    return yieldStats
+
+
+# Rules in the order they are applied: (name, function returning the mask of points to remove)
+RULES = [
+    ('area_off', areaOffMask),
+    ('speed', lambda df, rules: _outside(df['speed_mph_'], rules.minSpeed, rules.maxSpeed)),
+    ('flow', lambda df, rules: _outside(df['crop_flw_m'], rules.minFlow, rules.maxFlow)),
+    ('moisture', lambda df, rules: _outside(df['moisture__'], rules.minMoisture, rules.maxMoisture)),
+    ('swath_width', lambda df, rules: _outside(df['swth_wdth'], rules.minSwath, rules.maxSwath)),
+    ('pass_edge', passEdgeMask),
+    ('yield_limits', lambda df, rules: _outside(df[rules.yieldColumn], rules.minYield, rules.maxYield)),
+]
+
+
+def cleaningMasks(df, rules, passPosition=0, yieldStats=None):
+    """Return an ordered dictionary of rule name -> mask of the points removed by that rule (and no earlier rule).
+
+    'passPosition' and 'yieldStats' carry the state of the file from earlier chunks ('passEdgeMask', 'yieldStdMask');
+    'yieldStats' of False skips the standard deviation limit (the masks of the other rules are still returned).
+    """
+    masks = collections.OrderedDict()
+    keep = np.ones(len(df), dtype = bool)
+    for name, ruleMask in RULES:
+        if ruleMask is passEdgeMask:
+            masks[name] = passEdgeMask(df, rules, passPosition) & keep
+        else:
+            masks[name] = ruleMask(df, rules) & keep
+        keep &= ~masks[name]
+    # The standard deviation limit uses the points kept by the other rules
+    if yieldStats is not False:
+        masks['yield_std'] = yieldStdMask(df, rules, keep, yieldStats) & keep
+    return masks
+
+
+class YieldCleaner(object):
+    """Chunk transform removing the points caught by the cleaning rules of the chunk's vendor.
+
+    The chunks of a file are cleaned in order ('yield_ingest.iterYieldChunks'): 'startFile' accumulates
+    the yield statistics of the file, the last points of each chunk are held back until the next chunk
+    (their pass may go on), and 'finishFile' cleans the points held back at the end of the file and
+    prints and records the counts of the whole file once.
+    'removed' counts the points removed by each rule (in this process; the parse
+    processes of the parallel ingest print and record their own counts).
+    """
+
+    def __init__(self, vendorRules=None, stage=None):
+        self.vendorRules = dict(vendorRules or VENDOR_RULES)
+        self.stage = stage
+        self.removed = collections.Counter()
+        self.points = 0
+        self._resetFile()
+        self._resetCounts()
+
+    def _resetCounts(self):
+        # Counts of the file being cleaned, printed and recorded once by 'finishFile'
+        self._fileName = None
+        self._filePoints = 0
+        self._fileKept = 0
+        self._fileRemoved = collections.OrderedDict()
+        self._fileSeconds = 0.0
+
+    def _resetFile(self):
+        self._held = None           # last points of the previous chunk, cleaned with the next chunk
+        self._heldPosition = 0      # points of the pass of the first held point in earlier chunks
+        self._yieldStats = None     # yield statistics of the file ('startFile')
+
+    def _rules(self, df):
+        return self.vendorRules[df['file_source'].iat[0]]
+
+    def _nextMasks(self, df, final, yieldStats):
+        """Return the points cleaned now (the held points, then 'df', less the points held back) and their masks."""
+        if self._held is not None:
+            df = self._held if df is None else pd.concat([self._held, df])
+        self._held = None
+        if df is None or not len(df):
+            return df, None
+        rules = self._rules(df)
+        # Masks over every point, so the points before those held back see that their pass goes on
+        masks = cleaningMasks(df, rules, self._heldPosition, yieldStats)
+        hold = 0 if final else min(len(df), max(rules.passEndPoints or 0, 1))
+        if hold:
+            self._heldPosition = int(passPositions(df, self._heldPosition)[0][len(df) - hold])
+            self._held = df.iloc[len(df) - hold:]
+            df = df.iloc[:len(df) - hold]
+            masks = collections.OrderedDict((name, mask[:len(df)]) for name, mask in masks.items())
+        return df, masks
+
+    def startFile(self, chunks):
+        """First pass over the raw chunks of a file: the yield statistics of the points kept by the other rules."""
+        startTime = time.time()
+        self._resetFile()
+        self._resetCounts()
+        yieldStats = {}
+        for df in itertools.chain(chunks, [None]):
+            if df is not None and len(df) and self._rules(df).yieldStdLimit is None:
+                break
+            df, masks = self._nextMasks(df, df is None, False)
+            if masks is not None and len(df):
+                keep = ~np.logical_or.reduce(list(masks.values()))
+                addYieldStats(yieldStats, df, self._rules(df), keep)
+        self._resetFile()
+        self._yieldStats = yieldStats
+        self._fileSeconds += time.time() - startTime
+
+    def finishFile(self):
+        """Clean the points held back at the end of the file; prints and records the counts of the file."""
+        df = self._clean(None, True)
+        self._resetFile()
+        self._reportFile()
+        return df
+
+    def cleanFile(self, df):
+        """Clean all the points of one file at once."""
+        self.startFile([df])
+        df = self._clean(df, True)
+        self._resetFile()
+        self._reportFile()
+        return df
+
+    def _reportFile(self):
+        if self._fileName is not None:
+            removed = self._filePoints - self._fileKept
+            print("Cleaned " + self._fileName + ": removed " + str(removed) + " of " + str(self._filePoints) + " points "
+                  + str(dict((name, count) for name, count in self._fileRemoved.items() if count)))
+            if self.stage is not None:
+                pipeline_metrics.record(self.stage, 'clean_points', self._fileSeconds, rows = self._fileKept,
+                                        org_file = self._fileName, removed = self._fileRemoved)
+        self._resetCounts()
+
+    def __call__(self, df):
+        return self._clean(df, False)
+
+    def _clean(self, df, final):
+        startTime = time.time()
+        df, masks = self._nextMasks(df, final, self._yieldStats)
+        if masks is None or not len(df):
+            return df
+        drop = np.zeros(len(df), dtype = bool)
+        counts = collections.OrderedDict()
+        for name, mask in masks.items():
+            counts[name] = int(mask.sum())
+            drop |= mask
+        self.points += len(df)
+        self.removed.update(counts)
+        self._fileName = str(df['org_file'].iat[0])
+        self._filePoints += len(df)
+        self._fileKept += int(len(df) - drop.sum())
+        for name, count in counts.items():
+            self._fileRemoved[name] = self._fileRemoved.get(name, 0) + count
+        self._fileSeconds += time.time() - startTime
+        return df[~drop]
+
+    def report(self):
+        """Return a text summary of the points removed by each rule."""
+        total = sum(self.removed.values())
+        lines = ["Removed {} of {} points ({:.1f}%)".format(total, self.points, 100.0 * total / self.points if self.points else 0.0)]
+        for name, count in self.removed.items():
+            lines.append("        -- {}: {}".format(name, count))
+        return '\n'.join(lines)
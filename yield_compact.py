@@ -0,0 +1,126 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Compact storage schema of 'yield_point' and the yield scratch tables '_CSVimport_yield_point_*'
+(created by '1_CreatingDatabaseTables.py' when 'compactSchema' is True; existing tables are converted
+by '12_MigrateCompactSchema.py').
+        -- 'numeric' columns are variable-length values of up to 20 bytes or more, slow to aggregate;
+           the monitor readings have at most 7 significant digits and are stored as 'real' (4 bytes)
+        -- counts and identifiers (object id, pass number, active rows) are stored as integers
+        -- coordinates keep 8 decimals of a degree (about 1 mm) as 'double precision' (8 bytes);
+           'real' would keep about 1 m
+Narrower rows are copied faster and more of them fit in memory ('shared_buffers').
+
+"""
+
+# Import necessary Python packages and libraries
+import re
+
+# Table names are lower case in the database
+COMPACT_TABLES = ['_csvimport_yield_point_jd', '_csvimport_yield_point_agfiniti', 'yield_point']
+
+# Monitor readings and values derived from them (at most 7 significant digits)
+REAL_COLUMNS = ['distance_f', 'track_deg_', 'duration_s', 'elevation_', 'swth_wdth', 'x_offset_f', 'y_offset_f',
+                'hding_veh_', 'vdop', 'hdop', 'pdop', 'crop_flw_m', 'moisture__', 'humidity__', 'air_temp__',
+                'grain_temp', 'soil_temp_', 'soil_temp__', 'wind_speed', 'yld_mass_d', 'yld_vol_dr', 'yld_mass_w',
+                'yld_vol_we', 'speed_mph_', 'prod_ac_h_', 'crop_flw_v']
+# Column -> compact data type
+COMPACT_COLUMN_TYPES = dict([(column, 'real') for column in REAL_COLUMNS] + [
+    ('longitude', 'double precision'),
+    ('latitude', 'double precision'),
+    ('obj__id', 'integer'),
+    ('pass_num', 'smallint'),
+    ('active_row', 'smallint'),
+    ('satellites', 'smallint'),
+])
+
+# Column definition of a 'CREATE TABLE' command: name, then a 'numeric'/'double precision' type
+_COLUMN_DEFINITION = re.compile(r'^("?)(\w+)\1 (numeric\(\d+,\d+\)|double precision)(?=\s)', re.MULTILINE | re.IGNORECASE)
+
+
+def compactCreateCommand(command):
+    """Return the 'CREATE TABLE' command 'command' with the compact data type of each column of 'COMPACT_COLUMN_TYPES'."""
+    def compactType(match):
+        newType = COMPACT_COLUMN_TYPES.get(match.group(2).lower())
+        if newType is None:
+            return match.group(0)
+        return '{0}{1}{0} {2}'.format(match.group(1), match.group(2), newType)
+    return _COLUMN_DEFINITION.sub(compactType, command)
+
+
+def migrationCommand(cursor, table):
+    """Return the 'ALTER TABLE' command converting the columns of 'table' to their compact data types (None if compact).
+
+    The table (every partition of a partitioned table) and its indexes are rewritten once, whatever the number of columns.
+    """
+    cursor.execute("""
+SELECT column_name, data_type FROM information_schema.columns
+WHERE table_name = %s AND table_schema = current_schema()
+ORDER BY ordinal_position;""", (table,))
+    changes = ['ALTER COLUMN {} TYPE {}'.format(name, COMPACT_COLUMN_TYPES[name])
+               for name, dataType in cursor.fetchall()
+               if name in COMPACT_COLUMN_TYPES and dataType != COMPACT_COLUMN_TYPES[name]]
+    if not changes:
+        return None
+    return 'ALTER TABLE {}\n{};'.format(table, ',\n'.join(changes))
+
+
+def tableSize(cursor, table, sampleRows=10000):
+    """Return (total bytes including indexes and TOAST, estimated rows, average row bytes) of 'table'.
+
+    A partitioned table is measured over its partitions (PostgreSQL 12 or later); the row width is
+    averaged over the first 'sampleRows' rows.
+    """
+    cursor.execute("""
+SELECT COALESCE(sum(pg_total_relation_size(t.relid)), 0)::bigint, COALESCE(sum(GREATEST(c.reltuples, 0)), 0)::bigint
+FROM pg_partition_tree(%s::regclass) t JOIN pg_class c ON c.oid = t.relid;""", (table,))
+    totalBytes, rows = cursor.fetchone()
+    cursor.execute("SELECT avg(pg_column_size(t.*)) FROM (SELECT * FROM {} LIMIT %s) t;".format(table), (sampleRows,))
+    rowBytes = cursor.fetchone()[0]
+    return totalBytes, rows, float(rowBytes) if rowBytes is not None else None
+
+
+def sizeReport(before, after):
+    """Return the lines of a report of the table sizes 'before' and 'after' (dictionaries of table -> 'tableSize')."""
+    def megabytes(size):
+        return '{:.1f} MB'.format(size / 1048576.0)
+
+    def width(rowBytes):
+        return '{:.0f} bytes'.format(rowBytes) if rowBytes is not None else '-'
+
+    lines = []
+    for table in before:
+        oldBytes, rows, oldRow = before[table]
+        newBytes, rows, newRow = after[table]
+        change = ' ({:+.0f}%)'.format(100.0 * (newBytes - oldBytes) / oldBytes) if oldBytes else ''
+        lines.append('{}: {} -> {}{}, row width {} -> {}, about {} rows'.format(
+            table, megabytes(oldBytes), megabytes(newBytes), change, width(oldRow), width(newRow), rows))
+    totalBefore = sum(size[0] for size in before.values())
+    totalAfter = sum(size[0] for size in after.values())
+    lines.append('Total: {} -> {}'.format(megabytes(totalBefore), megabytes(totalAfter)))
+    return lines
@@ -0,0 +1,265 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Embedded DuckDB backend of the core pipeline (scripts 1, 2, 4 and 5), so a trial run, a
+benchmark or a single farm needs no Postgres server: the tables live in one database file.
+Selected with 'backend = duckdb' in the [pipeline] section of 'pipeline.ini' (file path in
+the [duckdb] section); each of those scripts then calls the functions below instead of its
+Postgres code.
+        -- the same tables and columns as the Postgres schema ('farmer', 'owner', 'products',
+           'field', '_CSVimport_field_key', 'yield_point', 'field_polygons_v1'); numeric
+           columns are 'DOUBLE', 'serial' columns use sequences, and there are no foreign keys
+        -- geometry ('geom_3857', field polygons) requires the 'spatial' extension
+1) The raw vendor CSVs are read by DuckDB's own (multi-threaded) CSV reader, every file of
+   a vendor in one 'read_csv' with the declared column types ('vendor_schemas.py'), and moved
+   to 'yield_point' in one 'INSERT ... SELECT' that also joins the field key and product
+   flags and computes the Web Mercator point
+2) Rows of files loaded again replace their earlier rows
+The chunk transforms of the streaming ingest (cleaning, outlier filter, field boundaries) and
+the stages after script 5 are Postgres only.
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import pipeline_settings
+import vendor_schemas
+import yield_geometry
+
+DEFAULT_DATABASE_FILE = os.path.join(pipeline_settings.SCRIPT_DIR, 'PrecisionAg_v1.duckdb')
+FIELD_TABLE = 'field_polygons_v1'
+# DuckDB types of the vendor schema's 'pandas' types
+COLUMN_TYPES = {vendor_schemas.NUMBER: 'DOUBLE', vendor_schemas.TEXT: 'VARCHAR', vendor_schemas.DATE: 'DATE', 'Int16': 'SMALLINT', 'Int32': 'INTEGER'}
+# Columns added to the vendor columns of 'yield_point' (as in '1_CreatingDatabaseTables.py')
+EXTRA_COLUMNS = [('org_file', 'VARCHAR(100)'), ('file_source', 'VARCHAR(20)'), ('corn', 'SMALLINT'), ('soybean', 'SMALLINT'),
+                 ('spatial_outlier', 'SMALLINT'), ('owner_id', 'SMALLINT'), ('field_id', 'SMALLINT'), ('farmer_id', 'SMALLINT')]
+
+# Operational CSVs (loaded on the first run) -> table and columns, in CSV column order
+OPERATIONAL_TABLES = [
+    ('Table_Farmers.csv', 'farmer', ['first_name', 'middle_name', 'last_name', 'address1', 'address2', 'city', 'state', 'zip',
+                                     'phone_cell', 'phone_home']),
+    ('Table_Owners.csv', 'owner', ['first_name', 'middle_name', 'last_name', 'address1', 'address2', 'city', 'state', 'zip',
+                                   'phone_cell', 'phone_home']),
+    ('products_combined.csv', 'products', ['productname', 'count', 'source', 'product', 'corn', 'soybean', 'company',
+                                           'document1', 'document2']),
+    ('Farm_Fields.csv', '_CSVimport_field', ['jd_farm', 'jd_field', 'fv_farm', 'fv_field', 'agf_farm', 'agf_field',
+                                             'final_farm', 'finalfield', 'field_id', 'owner_id']),
+]
+# List of every raw file name (reloaded on every run, so new files are identified)
+FIELD_KEY_TABLE = ('AllFiles_Farm_Fields.csv', '_CSVimport_field_key',
+                   ['file_name', 'source', 'event', 'year', 'farmerid', 'final_farm', 'final_field', 'notes'])
+
+CREATE_TABLE_COMMANDS = [
+"""
+CREATE SEQUENCE IF NOT EXISTS farmer_id_seq;
+CREATE TABLE IF NOT EXISTS farmer(
+farmer_id INTEGER DEFAULT nextval('farmer_id_seq') PRIMARY KEY,
+first_name VARCHAR(30) NOT NULL, middle_name VARCHAR(30), last_name VARCHAR(100) NOT NULL,
+address1 VARCHAR(50), address2 VARCHAR(50), city VARCHAR(30), state VARCHAR(2), zip VARCHAR(12),
+phone_cell VARCHAR(20), phone_home VARCHAR(20)
+);""",
+"""
+CREATE SEQUENCE IF NOT EXISTS owner_id_seq;
+CREATE TABLE IF NOT EXISTS owner(
+owner_id INTEGER DEFAULT nextval('owner_id_seq') PRIMARY KEY,
+first_name VARCHAR(30) NOT NULL, middle_name VARCHAR(30), last_name VARCHAR(100) NOT NULL,
+address1 VARCHAR(50), address2 VARCHAR(50), city VARCHAR(30), state VARCHAR(2), zip VARCHAR(12),
+phone_cell VARCHAR(20), phone_home VARCHAR(20)
+);""",
+"""
+CREATE TABLE IF NOT EXISTS _CSVimport_field(
+jd_farm VARCHAR(30), jd_field VARCHAR(30), fv_farm VARCHAR(30), fv_field VARCHAR(30), agf_farm VARCHAR(30),
+agf_field VARCHAR(30), final_farm VARCHAR(30), finalfield VARCHAR(40), field_id SMALLINT NOT NULL, owner_id SMALLINT NOT NULL
+);""",
+"""
+CREATE TABLE IF NOT EXISTS field(
+field_id SMALLINT PRIMARY KEY,
+farm_name VARCHAR(30) NOT NULL,
+field_name VARCHAR(40) NOT NULL,
+owner_id SMALLINT NOT NULL
+);""",
+"""
+CREATE TABLE IF NOT EXISTS _CSVimport_field_key(
+file_name VARCHAR(100), source VARCHAR(30), event VARCHAR(30), year SMALLINT, farmerid SMALLINT,
+final_farm VARCHAR(30) NOT NULL, final_field VARCHAR(30) NOT NULL, notes VARCHAR(150)
+);""",
+"""
+CREATE TABLE IF NOT EXISTS products(
+productname VARCHAR(30) NOT NULL, count INTEGER NOT NULL, source VARCHAR(20) NOT NULL, product VARCHAR(20) NOT NULL,
+corn SMALLINT NOT NULL, soybean SMALLINT NOT NULL, company VARCHAR(30), document1 VARCHAR(100), document2 VARCHAR(100)
+);""",
+]
+
+
+def databasePath():
+    """Return the path of the DuckDB database file ([duckdb] 'database' in 'pipeline.ini', or the default)."""
+    return pipeline_settings.setting('duckdb', 'database', DEFAULT_DATABASE_FILE)
+
+
+def connect(path=None, spatial=True):
+    """Open the DuckDB database (created if missing), loading the 'spatial' extension unless 'spatial' is False."""
+    import duckdb
+    connection = duckdb.connect(path or databasePath())
+    threads = pipeline_settings.setting('duckdb', 'threads')
+    if threads:
+        connection.execute("SET threads = {};".format(int(threads)))
+    if spatial:
+        try:
+            connection.execute("LOAD spatial;")
+        except Exception:
+            # Downloaded once, on first use
+            connection.execute("INSTALL spatial;")
+            connection.execute("LOAD spatial;")
+    return connection
+
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def yieldPointColumns(geometry=True):
+    """Return (column, DuckDB type) of 'yield_point': the vendors' final columns, the extra columns and 'geom_3857'."""
+    columns = []
+    seen = set()
+    for schema in vendor_schemas.VENDOR_SCHEMAS.values():
+        for column in schema.columns:
+            if column.final not in seen:
+                seen.add(column.final)
+                columns.append((column.final, COLUMN_TYPES[column.dtype]))
+    columns += EXTRA_COLUMNS
+    if geometry:
+        columns.append(('geom_3857', 'GEOMETRY'))
+    return columns
+
+
+def createTables(connection, geometry=True):
+    """Create the tables of the core pipeline (if missing); 'geometry' requires the 'spatial' extension."""
+    for command in CREATE_TABLE_COMMANDS:
+        connection.execute(command)
+    connection.execute("CREATE SEQUENCE IF NOT EXISTS yield_point_id_seq;")
+    connection.execute("CREATE TABLE IF NOT EXISTS yield_point(\nid BIGINT DEFAULT nextval('yield_point_id_seq') PRIMARY KEY,\n{}\n);".format(
+        ',\n'.join('"{}" {}'.format(name, dataType) for name, dataType in yieldPointColumns(geometry))))
+    if geometry:
+        connection.execute("""
+CREATE TABLE IF NOT EXISTS {}(
+id INTEGER PRIMARY KEY, field_id SMALLINT NOT NULL, final_farm VARCHAR NOT NULL, finalfield VARCHAR NOT NULL,
+owner_id SMALLINT NOT NULL, geom GEOMETRY
+);""".format(FIELD_TABLE))
+
+
+def tableIsEmpty(connection, table):
+    """Return True if 'table' has no rows."""
+    return connection.execute("SELECT NOT EXISTS (SELECT 1 FROM {});".format(table)).fetchone()[0]
+
+
+def loadCSV(connection, table, columns, csvPath):
+    """Append the rows of 'csvPath' (heading skipped, columns in the order of 'columns') to 'table'; returns the rows loaded."""
+    before = connection.execute("SELECT count(*) FROM {};".format(table)).fetchone()[0]
+    connection.execute("INSERT INTO {}({}) SELECT * FROM read_csv({}, header = true, all_varchar = true);".format(
+        table, ', '.join(columns), _literal(csvPath)))
+    return connection.execute("SELECT count(*) FROM {};".format(table)).fetchone()[0] - before
+
+
+def loadOperationalTables(connection, directory):
+    """Load the farmer, owner, products and field tables from the operational CSVs in 'directory' (first run only)
+    and reload the field key; returns {table: rows loaded}."""
+    loaded = {}
+    if tableIsEmpty(connection, 'farmer'):
+        for fileName, table, columns in OPERATIONAL_TABLES:
+            loaded[table] = loadCSV(connection, table, columns, os.path.join(directory, fileName))
+        connection.execute("""
+INSERT INTO field(field_id, farm_name, field_name, owner_id)
+SELECT field_id, final_farm, finalfield, owner_id FROM _CSVimport_field;""")
+    fileName, table, columns = FIELD_KEY_TABLE
+    connection.execute("DELETE FROM {};".format(table))
+    loaded[table] = loadCSV(connection, table, columns, os.path.join(directory, fileName))
+    return loaded
+
+
+def geometryExpression(longitude='r.longitude', latitude='r.latitude'):
+    """Return the SQL of the Web Mercator point of 'longitude'/'latitude' (as 'yield_geometry.lonLatToWebMercator')."""
+    clamped = "least(greatest({}, -{limit}), {limit})".format(latitude, limit = repr(yield_geometry.MAX_LATITUDE))
+    return "ST_Point({radius} * radians({lon}), {radius} * ln(tan(pi() / 4 + radians({lat}) / 2)))".format(
+        radius = repr(yield_geometry.EARTH_RADIUS), lon = longitude, lat = clamped)
+
+
+def readCSVFunction(schema, csvPaths):
+    """Return the 'read_csv' call reading every CSV of 'csvPaths' with the vendor's declared column types."""
+    columns = ', '.join('{}: {}'.format(_literal(column.staging), _literal(COLUMN_TYPES[column.dtype])) for column in schema.columns)
+    # The dialect is declared: sniffed from the first file, quoting would be missed when it has no quoted values
+    return "read_csv([{}], header = true, delim = ',', quote = '\"', escape = '\"', columns = {{{}}}, dateformat = {}, filename = true)".format(
+        ', '.join(_literal(csvPath) for csvPath in csvPaths), columns, _literal(schema.dateFormat))
+
+
+def ingestVendorCSVs(connection, schema, directory, geometry=True):
+    """Load every CSV of 'directory' into 'yield_point' (replacing the rows of files loaded before); returns {org_file: rows}."""
+    csvPaths = [os.path.join(directory, input_file) for input_file in sorted(os.listdir(directory)) if input_file[-4:] == '.csv']
+    if not csvPaths:
+        return {}
+    orgFiles = [os.path.basename(csvPath)[:-4] for csvPath in csvPaths]
+    connection.execute("DELETE FROM yield_point WHERE file_source = ? AND list_contains(?, org_file);", [schema.vendor, orgFiles])
+    finalColumns = [column.final for column in schema.columns]
+    selected = ['r.' + column.staging for column in schema.columns]
+    finalColumns += ['org_file', 'file_source', 'field_id', 'farmer_id', 'corn', 'soybean']
+    selected += ['parse_filename(r.filename, true)', _literal(schema.vendor), 'fk.field_id', 'fk.farmerid', 'pr.corn', 'pr.soybean']
+    if geometry:
+        finalColumns.append('geom_3857')
+        selected.append(geometryExpression())
+    connection.execute("""
+INSERT INTO yield_point({columns})
+SELECT {selected}
+FROM {reader} r
+LEFT JOIN (SELECT k.file_name, any_value(f.field_id) AS field_id, any_value(k.farmerid) AS farmerid
+           FROM _CSVimport_field_key k LEFT JOIN field f ON k.final_farm = f.farm_name AND k.final_field = f.field_name
+           GROUP BY k.file_name) fk ON fk.file_name = parse_filename(r.filename, true)
+LEFT JOIN (SELECT productname, any_value(corn) AS corn, any_value(soybean) AS soybean
+           FROM products WHERE source = 'yield_point' GROUP BY productname) pr ON pr.productname = r.product;""".format(
+        columns = ', '.join('"{}"'.format(column) for column in finalColumns), selected = ', '.join(selected),
+        reader = readCSVFunction(schema, csvPaths)))
+    return dict(connection.execute("""
+SELECT org_file, count(*) FROM yield_point WHERE file_source = ? AND list_contains(?, org_file) GROUP BY org_file;""",
+                                   [schema.vendor, orgFiles]).fetchall())
+
+
+def spatiallyEnable(connection):
+    """Compute 'geom_3857' of the rows loaded without it and create the spatial (R-tree) index; returns the rows updated."""
+    connection.execute("ALTER TABLE yield_point ADD COLUMN IF NOT EXISTS geom_3857 GEOMETRY;")
+    rows = connection.execute("UPDATE yield_point SET geom_3857 = {} WHERE geom_3857 IS NULL;".format(
+        geometryExpression('longitude', 'latitude'))).fetchone()[0]
+    connection.execute("CREATE INDEX IF NOT EXISTS yield_point_geom3857 ON yield_point USING RTREE (geom_3857);")
+    return rows
+
+
+def importFieldPolygons(connection, shpPaths):
+    """Replace the field polygons with the features of the shapefiles 'shpPaths' (read by 'ST_Read'); returns the polygons loaded."""
+    connection.execute("DELETE FROM {};".format(FIELD_TABLE))
+    for shpPath in shpPaths:
+        connection.execute("""
+INSERT INTO {}(id, field_id, final_farm, finalfield, owner_id, geom)
+SELECT id, field_id, Final_Farm, FinalField, owner_id, geom FROM ST_Read({});""".format(FIELD_TABLE, _literal(shpPath)))
+    return connection.execute("SELECT count(*) FROM {};".format(FIELD_TABLE)).fetchone()[0]
@@ -0,0 +1,264 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+GeoParquet export of 'yield_point' for analysis outside the database (notebooks, DuckDB,
+Spark), so reading a season or a field does not scan the production tables.
+        -- one folder per partition, 'year=2016/crop=corn/field_id=19/' ('Hive' layout read
+           by 'pyarrow.dataset', DuckDB and Spark); points without a field are written to
+           'field_id=__HIVE_DEFAULT_PARTITION__'
+        -- columns: the columns of 'yield_point' (numeric columns as double), the resolved
+           farm, field and farmer names, and the point as WKB ('geometry', WGS84 lon/lat)
+        -- row groups of 'ROW_GROUP_ROWS' points, with min/max statistics of every column,
+           sorted by harvest date, so readers skip the row groups a filter excludes
+1) Rows are read from a server-side cursor in batches of 'ROW_GROUP_ROWS', ordered by
+   partition, so memory holds one batch whatever the size of the table
+2) Incremental export: only the year/field groups of the files loaded since the last export
+   (the 'loaded_at' of 'ingest_manifest', kept in the export folder's 'export_state.json')
+   are written again; the old crop folders of each group are replaced
+Requires 'pyarrow'.
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import json
+import shutil
+import numpy as np
+import yield_summary
+import yield_ingest
+
+EXPORT_STATE_FILE = 'export_state.json'
+# Points per row group (and per batch fetched from the server-side cursor)
+ROW_GROUP_ROWS = 131072
+# Partition folder value of points without a field (default of the 'Hive' layout)
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+# Stands for a NULL 'field_id' in the arrays of groups sent to the database
+NULL_FIELD = -1
+# Columns of 'yield_point' left out of the files: the partition column and the geometry columns (see 'geometry')
+EXCLUDED_COLUMNS = ['field_id']
+# Resolved names joined to every point
+NAME_COLUMNS = [('farm_name', 'f.farm_name'), ('field_name', 'f.field_name'),
+                ('farmer_name', "concat_ws(' ', fa.first_name, fa.last_name)")]
+# WKB point: byte order (1 = little endian), geometry type (1 = point), x, y
+WKB_POINT_DTYPE = np.dtype([('byteOrder', 'u1'), ('geometryType', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+
+def _arrowTypes():
+    import pyarrow as pa
+    return {'smallint': pa.int16(), 'integer': pa.int32(), 'bigint': pa.int64(), 'real': pa.float32(),
+            'double precision': pa.float64(), 'numeric': pa.float64(), 'date': pa.date32(),
+            'timestamp without time zone': pa.timestamp('us'), 'boolean': pa.bool_()}
+
+
+def exportColumns(cursor, table='yield_point'):
+    """Return (column, data type) of the columns of 'table' written to the files, in table order."""
+    cursor.execute("""
+SELECT column_name, data_type FROM information_schema.columns
+WHERE table_name = %s AND table_schema = current_schema() AND udt_name <> 'geometry'
+ORDER BY ordinal_position;""", (table,))
+    return [(name, dataType) for name, dataType in cursor.fetchall() if name not in EXCLUDED_COLUMNS]
+
+
+def exportSchema(columns):
+    """Return the 'pyarrow' schema (with GeoParquet metadata) of the files for 'exportColumns'."""
+    import pyarrow as pa
+    types = _arrowTypes()
+    fields = [pa.field(name, types.get(dataType, pa.string())) for name, dataType in columns]
+    fields += [pa.field(name, pa.string()) for name, expression in NAME_COLUMNS]
+    fields.append(pa.field('geometry', pa.binary()))
+    # Coordinates are longitude/latitude (the GeoParquet default, 'OGC:CRS84', when no 'crs' is given)
+    geo = {'version': '1.0.0', 'primary_column': 'geometry',
+           'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': ['Point']}}}
+    return pa.schema(fields).with_metadata({'geo': json.dumps(geo)})
+
+
+def selectCommand(columns, groups=None):
+    """Return the query of the points to export, ordered by partition then date (parameters: the arrays of 'groups')."""
+    types = _arrowTypes()
+    selected = []
+    for name, dataType in columns:
+        if dataType == 'numeric':
+            selected.append('p.{0}::double precision AS {0}'.format(name))
+        elif dataType in types:
+            selected.append('p.' + name)
+        else:
+            selected.append('p.{0}::text AS {0}'.format(name))
+    selected += ['{} AS {}'.format(expression, name) for name, expression in NAME_COLUMNS]
+    source = "yield_point p"
+    if groups is not None:
+        # Date ranges (rather than date_part) let partitioned tables and date indexes skip other seasons
+        source += """
+JOIN unnest(%s::smallint[], %s::smallint[]) AS g(field_id, year)
+ON COALESCE(p.field_id, {}) = g.field_id AND p.date >= make_date(g.year, 1, 1) AND p.date < make_date(g.year + 1, 1, 1)""".format(NULL_FIELD)
+    return """
+SELECT date_part('year', p.date)::integer AS partition_year, {crop} AS partition_crop, p.field_id AS partition_field,
+       {columns}
+FROM {source}
+LEFT JOIN field f ON f.field_id = p.field_id
+LEFT JOIN farmer fa ON fa.farmer_id = p.farmer_id
+ORDER BY 1, 2, 3, p.date, p.org_file;""".format(crop = yield_summary.CROP_EXPRESSION,
+                                               columns = ',\n       '.join(selected), source = source)
+
+
+def groupParameters(groups):
+    """Return the (field_id, year) arrays of 'groups' for 'selectCommand' (NULL fields as 'NULL_FIELD')."""
+    groups = sorted(groups, key = lambda group: (NULL_FIELD if group[0] is None else group[0], group[1]))
+    return ([NULL_FIELD if group[0] is None else int(group[0]) for group in groups], [int(group[1]) for group in groups])
+
+
+def partitionPath(exportDirectory, year, crop=None, fieldID=None):
+    """Return the folder of a partition (the year folder when 'crop' is None)."""
+    path = os.path.join(exportDirectory, 'year={}'.format(year))
+    if crop is None:
+        return path
+    return os.path.join(path, 'crop={}'.format(crop), 'field_id={}'.format(NULL_PARTITION if fieldID is None else fieldID))
+
+
+def pointsToWKB(longitude, latitude):
+    """Return a 'pyarrow' binary array of WKB points for arrays of longitude/latitude."""
+    import pyarrow as pa
+    points = np.empty(len(longitude), dtype = WKB_POINT_DTYPE)
+    points['byteOrder'] = 1
+    points['geometryType'] = 1
+    points['x'] = longitude
+    points['y'] = latitude
+    offsets = np.arange(len(points) + 1, dtype = 'int32') * WKB_POINT_DTYPE.itemsize
+    return pa.Array.from_buffers(pa.binary(), len(points), [None, pa.py_buffer(offsets), pa.py_buffer(points.tobytes())])
+
+
+def _batchTable(rows, schema):
+    import pyarrow as pa
+    names = schema.names[:-1]
+    values = dict(zip(names, zip(*rows)))
+    arrays = [pa.array(values[name], type = schema.field(name).type) for name in names]
+    arrays.append(pointsToWKB(np.array(values['longitude'], dtype = 'float64'), np.array(values['latitude'], dtype = 'float64')))
+    return pa.Table.from_arrays(arrays, schema = schema)
+
+
+class _PartitionWriter(object):
+    """Writes the row groups of one partition to a temporary file, renamed into place when closed."""
+
+    def __init__(self, exportDirectory, key, schema):
+        import pyarrow.parquet as pq
+        folder = partitionPath(exportDirectory, *key)
+        os.makedirs(folder, exist_ok = True)
+        self.path = os.path.join(folder, 'part-0.parquet')
+        self.writer = pq.ParquetWriter(self.path + '.tmp', schema, compression = 'zstd', write_statistics = True)
+        self.rows = 0
+
+    def write(self, table):
+        self.writer.write_table(table, row_group_size = ROW_GROUP_ROWS)
+        self.rows += table.num_rows
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+def removeGroups(exportDirectory, groups):
+    """Delete the crop partitions of the (field_id, year) 'groups', so crops no longer present do not remain."""
+    for fieldID, year in groups:
+        yearFolder = partitionPath(exportDirectory, year)
+        if not os.path.isdir(yearFolder):
+            continue
+        for cropFolder in os.listdir(yearFolder):
+            fieldFolder = os.path.join(yearFolder, cropFolder, 'field_id={}'.format(NULL_PARTITION if fieldID is None else fieldID))
+            if os.path.isdir(fieldFolder):
+                shutil.rmtree(fieldFolder)
+
+
+def exportPartitions(connection, exportDirectory, columns, groups=None):
+    """Write the points of the (field_id, year) 'groups' (every point when None) as partitioned GeoParquet.
+
+    Reads from a server-side cursor of 'connection'; returns {(year, crop, field_id): rows written}.
+    """
+    schema = exportSchema(columns)
+    cursor = connection.cursor(name = 'yield_point_export')
+    cursor.itersize = ROW_GROUP_ROWS
+    cursor.execute(selectCommand(columns, groups), groupParameters(groups) if groups is not None else None)
+    written = {}
+    writer = None
+    key = None
+    try:
+        while True:
+            rows = cursor.fetchmany(ROW_GROUP_ROWS)
+            if not rows:
+                break
+            start = 0
+            # Rows arrive ordered by partition; a batch is split where the partition changes
+            for position in range(len(rows) + 1):
+                rowKey = tuple(rows[position][:3]) if position < len(rows) else None
+                if position < len(rows) and rowKey == key:
+                    continue
+                if position > start:
+                    writer.write(_batchTable([row[3:] for row in rows[start:position]], schema))
+                if position == len(rows):
+                    break
+                if writer is not None:
+                    writer.close()
+                    written[key] = writer.rows
+                key = rowKey
+                writer = _PartitionWriter(exportDirectory, key, schema)
+                start = position
+        if writer is not None:
+            writer.close()
+            written[key] = writer.rows
+    finally:
+        cursor.close()
+    return written
+
+
+def changedGroups(cursor, since):
+    """Return the set of (field_id, year) groups (field_id None for points without a field) of the files loaded after 'since'.
+
+    The groups of the rows those files replaced are included, so groups a changed file no longer covers are removed too.
+    """
+    cursor.execute("""
+SELECT DISTINCT p.field_id, date_part('year', p.date)::integer
+FROM yield_point p JOIN ingest_manifest m ON m.file_source = p.file_source AND m.org_file = p.org_file
+WHERE m.loaded_at > %s
+UNION
+SELECT field_id, year::integer FROM {} WHERE replaced_at > %s;""".format(yield_ingest.REPLACED_GROUPS_TABLE), (since, since))
+    return set(cursor.fetchall())
+
+
+def readState(exportDirectory):
+    """Return the export state of 'exportDirectory' ({} before the first export)."""
+    path = os.path.join(exportDirectory, EXPORT_STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as stateFile:
+        return json.load(stateFile)
+
+
+def writeState(exportDirectory, state):
+    """Write the export state of 'exportDirectory'."""
+    path = os.path.join(exportDirectory, EXPORT_STATE_FILE)
+    with open(path + '.tmp', 'w') as stateFile:
+        json.dump(state, stateFile, indent = 1)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,202 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Field assignment of the yield points by their position, against the field boundaries of
+'field_polygons_v1' ('5_ImportFieldPolygonsSHP.py'), while the points are ingested.
+The field key ('_CSVimport_field_key') gives every point of a file the same field; a file
+spanning two fields, or a pass crossing a headland into a neighbour's ground, is split here.
+1) The boundaries are read once per run and indexed by a grid of 'CELL_DEGREES' cells
+   (cell -> polygons whose bounding box touches it); the edges of each polygon are also
+   split into horizontal bands of about 'EDGES_PER_BAND' edges
+2) Each chunk of points is tested against the candidate polygons of its cells only, and each
+   point against the edges of its band only, with an even-odd ray casting test on arrays of
+   points and edges ('numpy'); holes and multi-part fields are handled by the even-odd rule
+3) 'field_id' and 'owner_id' of the polygon containing a point replace the field key's;
+   points outside every boundary keep the field key's 'field_id' (and 'owner_id' NULL),
+   or are removed when clipping
+        -- where boundaries overlap, the polygon with the lowest 'id' wins
+
+"""
+
+# Import necessary Python packages and libraries
+import json
+import time
+import numpy as np
+import pandas as pd
+import pipeline_metrics
+
+FIELD_TABLE = 'field_polygons_v1'
+# Width of the index cells (degrees; about 1 km)
+CELL_DEGREES = 0.01
+# Edges of a polygon per horizontal band (a point is only tested against the edges of its band)
+EDGES_PER_BAND = 16
+# Points x edges compared at a time by the ray casting test (memory of the temporary arrays)
+BLOCK_ELEMENTS = 4000000
+# Nullable small integer, written as an empty value (NULL) by COPY when missing
+FIELD_DTYPE = 'Int16'
+
+
+def _rings(geometry):
+    """Return the rings (arrays of longitude/latitude) of a GeoJSON Polygon or MultiPolygon."""
+    polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+    return [np.asarray(ring, dtype = 'float64')[:, :2] for polygon in polygons for ring in polygon]
+
+
+def pointsInPolygon(longitude, latitude, edges):
+    """Return a boolean array, True for the points inside the polygon of 'edges' (rows x1, y1, x2, y2).
+
+    Even-odd rule: a point is inside if a ray from it crosses the polygon's edges an odd number of times.
+    """
+    crossings = np.zeros(len(longitude), dtype = 'int32')
+    if not len(longitude):
+        return crossings.astype(bool)
+    px, py = longitude[:, None], latitude[:, None]
+    step = max(1, BLOCK_ELEMENTS // len(longitude))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        for start in range(0, len(edges), step):
+            x1, y1, x2, y2 = edges[start:start + step].T
+            # Edges straddling the point's latitude (horizontal edges never do), crossed east of the point
+            straddles = (y1 > py) != (y2 > py)
+            crossings += (straddles & (px < x1 + (py - y1) * (x2 - x1) / (y2 - y1))).sum(axis = 1, dtype = 'int32')
+    return (crossings & 1).astype(bool)
+
+
+class FieldBoundaries(object):
+    """Field polygons with a grid index of their bounding boxes; plain arrays, so it can be sent to the parse processes."""
+
+    def __init__(self, polygons, cellDegrees=CELL_DEGREES):
+        """'polygons': list of (field_id, owner_id, rings), rings being arrays of longitude/latitude."""
+        self.cellDegrees = cellDegrees
+        self.fieldIDs = np.array([polygon[0] for polygon in polygons], dtype = 'int32')
+        self.ownerIDs = np.array([polygon[1] for polygon in polygons], dtype = 'int32')
+        self.bands = []
+        self.bounds = np.zeros((len(polygons), 4))
+        self.index = {}
+        for position, (fieldID, ownerID, rings) in enumerate(polygons):
+            # Closing edge of each ring added when the ring is not closed
+            edges = [np.hstack([ring, np.roll(ring, -1, axis = 0)]) for ring in rings if len(ring) > 2]
+            edges = np.vstack(edges) if edges else np.zeros((0, 4))
+            # Horizontal edges never cross a ray
+            edges = edges[edges[:, 1] != edges[:, 3]]
+            if not len(edges):
+                self.bands.append([])
+                continue
+            self.bounds[position] = (min(edges[:, 0].min(), edges[:, 2].min()), min(edges[:, 1].min(), edges[:, 3].min()),
+                                     max(edges[:, 0].max(), edges[:, 2].max()), max(edges[:, 1].max(), edges[:, 3].max()))
+            self.bands.append(self._bandEdges(edges, self.bounds[position][1], self.bounds[position][3]))
+            x0, y0, x1, y1 = np.floor(self.bounds[position] / cellDegrees).astype('int64')
+            for cellX in range(x0, x1 + 1):
+                for cellY in range(y0, y1 + 1):
+                    self.index.setdefault((cellX, cellY), []).append(position)
+
+    @staticmethod
+    def _bandEdges(edges, ymin, ymax):
+        """Return the edges crossing each of the polygon's horizontal bands, from south to north."""
+        bandCount = max(1, len(edges) // EDGES_PER_BAND)
+        limits = np.linspace(ymin, ymax, bandCount + 1)
+        edgeLow = np.minimum(edges[:, 1], edges[:, 3])
+        edgeHigh = np.maximum(edges[:, 1], edges[:, 3])
+        return [edges[(edgeLow <= limits[band + 1]) & (edgeHigh >= limits[band])] for band in range(bandCount)]
+
+    def __len__(self):
+        return len(self.fieldIDs)
+
+    def locate(self, longitude, latitude):
+        """Return the position of the polygon containing each point (-1 outside every polygon)."""
+        longitude = np.asarray(longitude, dtype = 'float64')
+        latitude = np.asarray(latitude, dtype = 'float64')
+        found = np.full(len(longitude), -1, dtype = 'int32')
+        valid = np.isfinite(longitude) & np.isfinite(latitude)
+        cellX = np.floor(np.where(valid, longitude, 0.0) / self.cellDegrees).astype('int64')
+        cellY = np.floor(np.where(valid, latitude, 0.0) / self.cellDegrees).astype('int64')
+        cells, inverse = np.unique(np.stack([cellX, cellY], axis = 1), axis = 0, return_inverse = True)
+        inverse = inverse.ravel()
+        # Cells of the chunk touched by each candidate polygon
+        polygonCells = {}
+        for cellPosition, (x, y) in enumerate(cells):
+            for position in self.index.get((int(x), int(y)), ()):
+                polygonCells.setdefault(position, []).append(cellPosition)
+        for position in sorted(polygonCells):
+            xmin, ymin, xmax, ymax = self.bounds[position]
+            candidates = np.flatnonzero(valid & (found < 0) & np.isin(inverse, polygonCells[position])
+                                        & (longitude >= xmin) & (longitude <= xmax) & (latitude >= ymin) & (latitude <= ymax))
+            bands = self.bands[position]
+            band = np.clip(((latitude[candidates] - ymin) / (ymax - ymin) * len(bands)).astype('int64'), 0, len(bands) - 1)
+            order = np.argsort(band, kind = 'stable')
+            starts = np.searchsorted(band[order], np.arange(len(bands) + 1))
+            for bandPosition in range(len(bands)):
+                points = candidates[order[starts[bandPosition]:starts[bandPosition + 1]]]
+                if len(points):
+                    inside = pointsInPolygon(longitude[points], latitude[points], bands[bandPosition])
+                    found[points[inside]] = position
+        return found
+
+
+def loadFieldBoundaries(cursor, table=FIELD_TABLE, cellDegrees=CELL_DEGREES):
+    """Return the 'FieldBoundaries' of the polygons of 'table' (WGS84, EPSG: 4326)."""
+    cursor.execute("SELECT field_id, owner_id, ST_AsGeoJSON(ST_Transform(geom, 4326)) FROM {} WHERE geom IS NOT NULL ORDER BY id;".format(table))
+    return FieldBoundaries([(fieldID, ownerID, _rings(json.loads(geometry))) for fieldID, ownerID, geometry in cursor.fetchall()],
+                           cellDegrees)
+
+
+class FieldAssigner(object):
+    """Chunk transform setting 'field_id' and 'owner_id' of a dataframe of yield points from the field boundaries.
+
+    Runs after the field key lookups ('yield_lookups.YieldLookups'); with 'clip' the points
+    outside every boundary are removed.
+    """
+
+    def __init__(self, boundaries, clip=False, stage=None):
+        self.boundaries = boundaries
+        self.clip = clip
+        self.stage = stage
+
+    def __call__(self, df):
+        if not len(df):
+            df['owner_id'] = pd.array([], dtype = FIELD_DTYPE)
+            return df
+        startTime = time.time()
+        found = self.boundaries.locate(df['longitude'].to_numpy(), df['latitude'].to_numpy())
+        inside = found >= 0
+        fieldKeyIDs = df['field_id'].array if 'field_id' in df else pd.array([None] * len(df), dtype = FIELD_DTYPE)
+        fieldIDs = pd.array(fieldKeyIDs, dtype = FIELD_DTYPE, copy = True)
+        fieldIDs[inside] = self.boundaries.fieldIDs[found[inside]]
+        ownerIDs = pd.array([None] * len(df), dtype = FIELD_DTYPE)
+        ownerIDs[inside] = self.boundaries.ownerIDs[found[inside]]
+        # Points whose polygon differs from the field of their file in the field key
+        moved = int((fieldIDs != pd.array(fieldKeyIDs, dtype = FIELD_DTYPE)).fillna(True)[inside].sum())
+        df['field_id'] = fieldIDs
+        df['owner_id'] = ownerIDs
+        outside = int(len(df) - inside.sum())
+        orgFile = str(df['org_file'].iat[0])
+        print("Fields of " + orgFile + ": " + str(moved) + " points assigned to another field than the field key's, "
+              + str(outside) + " points outside every boundary" + (" (removed)" if self.clip else ""))
+        if self.stage is not None:
+            pipeline_metrics.record(self.stage, 'assign_fields', time.time() - startTime, rows = int(inside.sum()),
+                                    org_file = orgFile, moved = moved, outside = outside)
+        return df[inside] if self.clip else df
@@ -0,0 +1,85 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Vectorized ('numpy') geometry helpers for the yield points.
+1) Project longitude/latitude (WGS84, EPSG: 4326) to 'Web Mercator' (EPSG: 3857)
+2) Encode points as hex EWKB, the text form PostGIS accepts for a geometry column
+   in 'COPY', so 'geom_3857' can be written together with the rest of each row
+   instead of by a full-table 'UPDATE' after the load (see '4_SpatiallyEnable.py')
+
+"""
+
+# Import necessary Python packages and libraries
+import numpy as np
+
+WEB_MERCATOR_SRID = 3857
+# Radius of the WGS84 ellipsoid used by the spherical 'Web Mercator' projection (meters)
+EARTH_RADIUS = 6378137.0
+# Web Mercator is undefined at the poles; latitudes are clamped as in PostGIS/PROJ tiling
+MAX_LATITUDE = 85.0511287798066
+
+# EWKB point: byte order (1 = little endian), geometry type with SRID flag, SRID, x, y
+EWKB_POINT_WITH_SRID = 0x20000001
+EWKB_POINT_DTYPE = np.dtype([('byteOrder', 'u1'), ('geometryType', '<u4'), ('srid', '<u4'), ('x', '<f8'), ('y', '<f8')])
+# Two hexadecimal characters for every possible byte value
+HEX_BYTES = np.array([('%02X' % i).encode('ascii') for i in range(256)], dtype = 'S2')
+
+
+def lonLatToWebMercator(longitude, latitude):
+    """Return arrays of Web Mercator x/y (meters) for arrays of WGS84 longitude/latitude (degrees)."""
+    longitude = np.asarray(longitude, dtype = 'float64')
+    latitude = np.clip(np.asarray(latitude, dtype = 'float64'), -MAX_LATITUDE, MAX_LATITUDE)
+    x = EARTH_RADIUS * np.radians(longitude)
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4.0 + np.radians(latitude) / 2.0))
+    return x, y
+
+
+def webMercatorToLonLat(x, y):
+    """Return arrays of WGS84 longitude/latitude (degrees) for arrays of Web Mercator x/y (meters)."""
+    longitude = np.degrees(np.asarray(x, dtype = 'float64') / EARTH_RADIUS)
+    latitude = np.degrees(2.0 * np.arctan(np.exp(np.asarray(y, dtype = 'float64') / EARTH_RADIUS)) - np.pi / 2.0)
+    return longitude, latitude
+
+
+def pointsToEWKBHex(x, y, srid=WEB_MERCATOR_SRID):
+    """Return an array of hex EWKB strings for point coordinates 'x'/'y' in 'srid'."""
+    points = np.empty(len(x), dtype = EWKB_POINT_DTYPE)
+    points['byteOrder'] = 1
+    points['geometryType'] = EWKB_POINT_WITH_SRID
+    points['srid'] = srid
+    points['x'] = x
+    points['y'] = y
+    rawBytes = points.view('u1').reshape(len(points), EWKB_POINT_DTYPE.itemsize)
+    return HEX_BYTES[rawBytes].view('S' + str(2 * EWKB_POINT_DTYPE.itemsize)).ravel().astype(str)
+
+
+def addWebMercatorGeometry(df):
+    """Add column 'geom_3857' (hex EWKB points) to a dataframe of yield points; returns 'df'."""
+    x, y = lonLatToWebMercator(df['longitude'].to_numpy(), df['latitude'].to_numpy())
+    df['geom_3857'] = pointsToEWKBHex(x, y)
+    return df
@@ -0,0 +1,238 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Multi-resolution grid of the yield points ('yield_grid_z{zoom}' tables), so maps zoomed out
+to field or farm level draw a few thousand cells instead of millions of points.
+        -- the points are binned into square Web Mercator (EPSG: 3857) cells aligned with the
+           map tiles: 'CELLS_PER_TILE' cells across a tile of the level's zoom (8 pixels each)
+        -- one row per cell, field, year and crop: number of points and mean/min/max of each
+           yield metric ('GRID_METRICS'), with the cell square as 'geom_3857'
+        -- points without a field ('field_id' NULL) or geometry are not binned
+1) Only the finest level is binned from 'yield_point'; each coarser level is aggregated from the
+   next finer one (the cells nest, as the cell size doubles per zoom level), so 'yield_point'
+   is read once. Means of coarser cells are weighted by the point count of the finer cells
+2) Table 'yield_grid_level' lists the levels (zoom, cell size, table) for the web map and the
+   tile seeding, and the 'ingest_manifest' time each level was refreshed through, so only the
+   field/year groups of files loaded since are recomputed
+
+"""
+
+# Import necessary Python packages and libraries
+import yield_summary
+import yield_ingest
+import yield_tiles
+
+GRID_LEVEL_TABLE = 'yield_grid_level'
+# Zoom levels binned by default (zoom 10 cells are about 1.2 km wide, zoom 16 cells about 19 m; Web Mercator meters)
+GRID_ZOOMS = [10, 11, 12, 13, 14, 15, 16]
+# Cells across a 256 pixel tile of the level's zoom
+CELLS_PER_TILE = 32
+GRID_METRICS = yield_tiles.METRICS
+STATISTICS = ['mean', 'min', 'max']
+
+
+def gridTable(zoom):
+    """Return the name of the grid table of 'zoom'."""
+    return 'yield_grid_z{}'.format(zoom)
+
+
+def cellSize(zoom):
+    """Return the width of a grid cell of 'zoom' (Web Mercator meters)."""
+    return 2.0 * yield_tiles.WORLD_HALF_WIDTH / (1 << zoom) / CELLS_PER_TILE
+
+
+def _statisticColumns():
+    return ['{}_{}'.format(metric, statistic) for metric in GRID_METRICS for statistic in STATISTICS]
+
+
+def createGridLevelTableCommand():
+    """Return the 'CREATE TABLE IF NOT EXISTS' command of the grid level table."""
+    return """
+CREATE TABLE IF NOT EXISTS {0}(
+zoom smallint NOT NULL,
+cell_size double precision NOT NULL,   -- cell width (Web Mercator meters)
+table_name VARCHAR(30) NOT NULL,
+refreshed_through timestamp NULL,      -- latest 'loaded_at' of 'ingest_manifest' binned
+CONSTRAINT {0}_pkey PRIMARY KEY (zoom)
+);""".format(GRID_LEVEL_TABLE)
+
+
+def createGridTableCommands(zoom):
+    """Return the commands creating the grid table of 'zoom' and its spatial index (if missing)."""
+    table = gridTable(zoom)
+    # 'real' (4 bytes) keeps the cells compact; the statistics need no more precision than the monitors
+    columns = ''.join('{} real NULL,\n'.format(name) for name in _statisticColumns())
+    return ["""
+CREATE TABLE IF NOT EXISTS {0}(
+field_id smallint NOT NULL,
+year smallint NOT NULL,
+crop VARCHAR(10) NOT NULL,
+cell_x integer NOT NULL,   -- column of the cell from the west edge of the world
+cell_y integer NOT NULL,   -- row of the cell from the north edge of the world (as the map tiles)
+point_count integer NOT NULL,
+{1}geom_3857 geometry(Polygon, 3857) NOT NULL,
+CONSTRAINT {0}_pkey PRIMARY KEY (field_id, year, crop, cell_x, cell_y),
+FOREIGN KEY (field_id) REFERENCES field (field_id)
+);""".format(table, columns),
+            "CREATE INDEX IF NOT EXISTS {0}_geom_3857_idx ON {0} USING gist (geom_3857);".format(table)]
+
+
+def ensureGridTables(cursor, zooms=GRID_ZOOMS):
+    """Create the level table and the grid tables of 'zooms' (if missing) and list the levels in the level table."""
+    cursor.execute(createGridLevelTableCommand())
+    for zoom in zooms:
+        for command in createGridTableCommands(zoom):
+            cursor.execute(command)
+        cursor.execute("""
+INSERT INTO {}(zoom, cell_size, table_name) VALUES (%s, %s, %s)
+ON CONFLICT (zoom) DO NOTHING;""".format(GRID_LEVEL_TABLE), (zoom, cellSize(zoom), gridTable(zoom)))
+
+
+def gridLevels(cursor):
+    """Return {zoom: refreshed_through} of the levels listed in the level table."""
+    cursor.execute("SELECT zoom, refreshed_through FROM {} ORDER BY zoom;".format(GRID_LEVEL_TABLE))
+    return dict(cursor.fetchall())
+
+
+def changedGroups(cursor, since):
+    """Return the set of (field_id, year) groups of the files recorded in 'ingest_manifest' after 'since'.
+
+    The groups of the rows those files replaced are included, so the cells of groups a changed file no longer covers are removed too.
+    """
+    cursor.execute("""
+SELECT DISTINCT p.field_id, date_part('year', p.date)::integer
+FROM yield_point p JOIN ingest_manifest m ON m.file_source = p.file_source AND m.org_file = p.org_file
+WHERE m.loaded_at > %s AND p.field_id IS NOT NULL
+UNION
+SELECT field_id, year::integer FROM {} WHERE replaced_at > %s AND field_id IS NOT NULL;""".format(yield_ingest.REPLACED_GROUPS_TABLE),
+                   (since, since))
+    return set(cursor.fetchall())
+
+
+def _cellEnvelope(size):
+    half = yield_tiles.WORLD_HALF_WIDTH
+    return "ST_MakeEnvelope({0} + cell_x * {1}, {2} - (cell_y + 1) * {1}, {0} + (cell_x + 1) * {1}, {2} - cell_y * {1}, 3857)".format(
+        -half, repr(size), half)
+
+
+def _binCommand(zoom, source):
+    """INSERT ... SELECT binning the yield points of 'source' into the cells of 'zoom'."""
+    size = cellSize(zoom)
+    half = yield_tiles.WORLD_HALF_WIDTH
+    aggregates = ''.join(', avg({0}), min({0}), max({0})'.format(metric) for metric in GRID_METRICS)
+    metrics = ''.join(', p.{}'.format(metric) for metric in GRID_METRICS)
+    return """
+INSERT INTO {table}(field_id, year, crop, cell_x, cell_y, point_count, {columns}, geom_3857)
+SELECT field_id, year, crop, cell_x, cell_y, count(*){aggregates}, {envelope}
+FROM (SELECT p.field_id, date_part('year', p.date)::smallint AS year, {crop} AS crop,
+             floor((ST_X(p.geom_3857) + {half}) / {size})::integer AS cell_x,
+             floor(({half} - ST_Y(p.geom_3857)) / {size})::integer AS cell_y{metrics}
+      FROM {source}
+      WHERE p.field_id IS NOT NULL AND p.geom_3857 IS NOT NULL) p
+GROUP BY field_id, year, crop, cell_x, cell_y;""".format(
+        table = gridTable(zoom), columns = ', '.join(_statisticColumns()), aggregates = aggregates,
+        envelope = _cellEnvelope(size), crop = yield_summary.CROP_EXPRESSION, half = repr(half), size = repr(size),
+        metrics = metrics, source = source)
+
+
+def _mergeCommand(zoom, finerZoom, source):
+    """INSERT ... SELECT aggregating the cells of 'finerZoom' in 'source' into the cells of 'zoom'."""
+    shift = finerZoom - zoom
+    aggregates = ''
+    for metric in GRID_METRICS:
+        # Means are weighted by the points of the finer cells having the metric
+        aggregates += ', sum(c.{0}_mean * c.point_count) / sum(CASE WHEN c.{0}_mean IS NOT NULL THEN c.point_count END) AS {0}_mean'.format(metric)
+        aggregates += ', min(c.{0}_min) AS {0}_min, max(c.{0}_max) AS {0}_max'.format(metric)
+    return """
+INSERT INTO {table}(field_id, year, crop, cell_x, cell_y, point_count, {columns}, geom_3857)
+SELECT field_id, year, crop, cell_x, cell_y, point_count{statistics}, {envelope}
+FROM (SELECT c.field_id, c.year, c.crop, c.cell_x >> {shift} AS cell_x, c.cell_y >> {shift} AS cell_y,
+             sum(c.point_count)::integer AS point_count{aggregates}
+      FROM {source}
+      GROUP BY 1, 2, 3, 4, 5) c;""".format(
+        table = gridTable(zoom), columns = ', '.join(_statisticColumns()),
+        statistics = ''.join(', ' + name for name in _statisticColumns()), envelope = _cellEnvelope(cellSize(zoom)),
+        shift = shift, aggregates = aggregates, source = source)
+
+
+def refreshGridLevel(cursor, zoom, groups=None, finerZoom=None):
+    """Recompute the cells of 'zoom' for the (field_id, year) 'groups' (every group when None); returns the rows written.
+
+    The cells are binned from 'yield_point', or aggregated from the (already refreshed) level
+    'finerZoom' when given. The old cells are deleted and the new ones inserted in the caller's transaction.
+    """
+    table = gridTable(zoom)
+    finerTable = gridTable(finerZoom) if finerZoom is not None else None
+    if groups is not None:
+        groups = sorted(groups)
+        if not groups:
+            return 0
+        fieldIDs = [int(group[0]) for group in groups]
+        years = [int(group[1]) for group in groups]
+        parameters = (fieldIDs, years)
+        cursor.execute("""
+DELETE FROM {} c USING unnest(%s::smallint[], %s::smallint[]) AS g(field_id, year)
+WHERE c.field_id = g.field_id AND c.year = g.year;""".format(table), parameters)
+        if finerTable is None:
+            # Date ranges (rather than date_part) let partitioned tables and date indexes skip other seasons
+            source = """yield_point p JOIN unnest(%s::smallint[], %s::smallint[]) AS g(field_id, year)
+ON p.field_id = g.field_id AND p.date >= make_date(g.year, 1, 1) AND p.date < make_date(g.year + 1, 1, 1)"""
+        else:
+            source = """{} c JOIN unnest(%s::smallint[], %s::smallint[]) AS g(field_id, year)
+ON c.field_id = g.field_id AND c.year = g.year""".format(finerTable)
+    else:
+        cursor.execute("TRUNCATE {};".format(table))
+        source = "yield_point p" if finerTable is None else finerTable + " c"
+        parameters = None
+    if finerTable is None:
+        cursor.execute(_binCommand(zoom, source), parameters)
+    else:
+        cursor.execute(_mergeCommand(zoom, finerZoom, source), parameters)
+    return cursor.rowcount
+
+
+def setRefreshedThrough(cursor, zooms, refreshedThrough):
+    """Record the 'ingest_manifest' time the levels 'zooms' were refreshed through."""
+    cursor.execute("UPDATE {} SET refreshed_through = %s WHERE zoom = ANY(%s::smallint[]);".format(GRID_LEVEL_TABLE),
+                   (refreshedThrough, list(zooms)))
+
+
+def tileGridTables(zooms, minZoom, maxZoom):
+    """Return {tile zoom: grid table} for the tiles of 'minZoom' to 'maxZoom' drawn from the grid levels 'zooms'.
+
+    A tile uses the level of its own zoom (cells of 8 pixels); tiles zoomed out beyond the coarsest
+    level use the coarsest level, and tiles zoomed in beyond the finest level draw the points.
+    """
+    tables = {}
+    if not zooms:
+        return tables
+    for tileZoom in range(minZoom, maxZoom + 1):
+        candidates = [zoom for zoom in zooms if zoom >= tileZoom]
+        if candidates:
+            tables[tileZoom] = gridTable(min(candidates))
+    return tables
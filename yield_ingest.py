@@ -0,0 +1,423 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Helper functions used by '2_ProcessCSVs.py' to stream the raw precision agriculture
+yield CSVs into the Postgres scratch tables.
+1) Each CSV is read in chunks sized to stay under a memory ceiling, using the
+   vendor's declared column data types (see 'vendor_schemas.py')
+2) Each chunk is written to an in-memory CSV buffer and sent to Postgres
+   with 'COPY ... FROM STDIN' (no appended CSV on disk, and the database server
+   does not need to see the client's file system)
+3) Optionally, files are parsed in a pool of processes while one or more loader
+   threads (each with its own database connection) COPY the parsed chunks, so
+   parsing and loading overlap
+4) Optional chunk transforms (functions taking and returning a dataframe, such as
+   'yield_geometry.addWebMercatorGeometry') add columns to each chunk before COPY;
+   the COPY column list always follows the columns of the chunk
+5) Optionally, an 'ingest_manifest' table records every loaded file (size, modification
+   time, SHA-256 hash and row count) so re-runs only load new or changed files
+
+"""
+
+# Import necessary Python packages and libraries
+import io
+import os
+import sys
+import hashlib
+import datetime
+import collections
+import contextlib
+import threading
+import multiprocessing
+import concurrent.futures
+import vendor_schemas
+import pipeline_settings
+
+# Default memory ceiling (megabytes) for one chunk of raw CSV rows
+DEFAULT_MEMORY_LIMIT_MB = 256
+# Number of rows read from each CSV to estimate the in-memory size of a row
+SAMPLE_ROWS = 1000
+# Default number of parsed chunks waiting for each loader (bounds memory of the parallel pipeline)
+DEFAULT_QUEUE_CHUNKS = 4
+# Block size (bytes) used when hashing a raw CSV for the manifest
+HASH_BLOCK_SIZE = 1024 * 1024
+# Table of the (field_id, year) groups of the 'yield_point' rows replaced by reloaded files
+REPLACED_GROUPS_TABLE = 'ingest_replaced_groups'
+
+
+###############################################################################
+# Chunk sizing and reading
+
+def estimateChunkRows(csvPath, schema, memoryLimitMB=DEFAULT_MEMORY_LIMIT_MB):
+    """Return the number of CSV rows per chunk that keeps one chunk under 'memoryLimitMB'."""
+    sample = vendor_schemas.readVendorCSV(csvPath, schema, nrows = SAMPLE_ROWS)
+    if len(sample) == 0:
+        return SAMPLE_ROWS
+    bytesPerRow = sample.memory_usage(index = True, deep = True).sum() / float(len(sample))
+    # The CSV text buffer handed to COPY holds roughly a second copy of the chunk
+    chunkRows = int((memoryLimitMB * 1024 * 1024) / (bytesPerRow * 2))
+    return max(chunkRows, SAMPLE_ROWS)
+
+
+def _readChunks(csvPath, schema, orgFile, chunkRows):
+    for df in vendor_schemas.readVendorCSV(csvPath, schema, chunksize = chunkRows):
+        # Add column to contain string of original CSV file name
+        df['org_file'] = orgFile
+        df['file_source'] = schema.vendor
+        yield df
+
+
+def _applyTransforms(df, transforms):
+    for transform in transforms:
+        df = transform(df)
+    return df
+
+
+def iterYieldChunks(csvPath, schema, orgFile, memoryLimitMB=DEFAULT_MEMORY_LIMIT_MB, transforms=()):
+    """Yield typed 'pandas' dataframes of at most one memory ceiling's worth of rows from a raw CSV.
+
+    The dataframe index continues across chunks, so it matches the 'id_pd' values
+    written by the original (append CSV) approach. Each function in 'transforms' is
+    applied to every chunk, in order. Transforms working on whole files may also define
+        -- 'startFile(chunks)': called with the raw chunks of the file (a first pass, before any transform)
+        -- 'finishFile()': called at the end of the file; returns the rows it held back (or None, and
+           possibly more than one chunk of rows), which then pass through the later transforms
+    """
+    vendor_schemas.checkHeader(csvPath, schema)
+    chunkRows = estimateChunkRows(csvPath, schema, memoryLimitMB)
+    for transform in transforms:
+        if hasattr(transform, 'startFile'):
+            transform.startFile(_readChunks(csvPath, schema, orgFile, chunkRows))
+    for df in _readChunks(csvPath, schema, orgFile, chunkRows):
+        df = _applyTransforms(df, transforms)
+        # (a transform holding the rows of the file until its end returns an empty chunk)
+        if len(df):
+            yield df
+    for i, transform in enumerate(transforms):
+        if hasattr(transform, 'finishFile'):
+            df = transform.finishFile()
+            if df is not None and len(df):
+                yield _applyTransforms(df, transforms[i + 1:])
+
+
+def listYieldCSVs(directory, files=None):
+    """Return the raw CSV file names in 'directory', skipping appended CSVs from earlier runs.
+
+    If 'files' is given, only those file names are returned.
+    """
+    return sorted(input_file for input_file in os.listdir(directory)
+                  if input_file[-4:] == '.csv' and not input_file.startswith('_csvAppend_')
+                  and (files is None or input_file in files))
+
+
+###############################################################################
+# COPY ... FROM STDIN
+
+def renderCopyChunk(df):
+    """Return the rows of 'df' (index first, as 'id_pd') as CSV text ready for COPY."""
+    buffer = io.StringIO()
+    df.to_csv(buffer, header = False, index = True, encoding = 'utf-8')
+    return buffer.getvalue()
+
+
+def copyColumns(df):
+    """Return the table columns matching 'renderCopyChunk(df)': 'id_pd' then the dataframe columns."""
+    return ['id_pd'] + [str(column) for column in df.columns]
+
+
+def copyCommand(table, columns):
+    return "COPY {}({}) FROM STDIN WITH (FORMAT csv)".format(table, ', '.join(columns))
+
+
+def copyDataFrame(cursor, df, table):
+    """COPY the rows of 'df' (index first, as 'id_pd') into 'table' through STDIN."""
+    cursor.copy_expert(copyCommand(table, copyColumns(df)), io.StringIO(renderCopyChunk(df)))
+    return len(df)
+
+
+def streamYieldDirectory(cursor, directory, schema, memoryLimitMB=DEFAULT_MEMORY_LIMIT_MB, files=None, transforms=()):
+    """Stream the raw CSVs in 'directory' (all, or only 'files') into the vendor's scratch table chunk by chunk.
+
+    Returns a dictionary of org_file -> number of rows loaded.
+    """
+    fileRows = {}
+    for input_file in listYieldCSVs(directory, files):
+        print(input_file)
+        orgFile = str(input_file[:-4])
+        csvPath = os.path.join(directory, input_file)
+        fileRows[orgFile] = 0
+        for df in iterYieldChunks(csvPath, schema, orgFile, memoryLimitMB, transforms):
+            fileRows[orgFile] += copyDataFrame(cursor, df, schema.stagingTable)
+    return fileRows
+
+
+###############################################################################
+# Parallel parse -> COPY pipeline
+#   -- Parse workers (processes) read a CSV in chunks and put the rendered CSV text on a bounded queue
+#   -- Loader workers (threads, one database connection each) drain their queue into COPY
+#   -- Every file is assigned to one loader, so all chunks of a file are loaded on the same connection
+#   -- A queue item is (org_file, columns, csvText, rowCount); csvText of None marks the end of a file
+#   -- Chunk transforms run in the parse workers, so they must be picklable (module-level functions or objects)
+#   -- Workers start with this module as their '__main__' ('_workerMain'), so launching scripts need no guard
+
+def _parseFileToQueue(csvPath, schema, orgFile, memoryLimitMB, transforms, workQueue):
+    rows = 0
+    for df in iterYieldChunks(csvPath, schema, orgFile, memoryLimitMB, transforms):
+        workQueue.put((orgFile, copyColumns(df), renderCopyChunk(df), len(df)))
+        rows += len(df)
+    workQueue.put((orgFile, None, None, rows))
+    return orgFile, rows
+
+
+@contextlib.contextmanager
+def _workerMain():
+    # Spawned processes (Windows, macOS) re-run the launching script as '__mp_main__' unless '__main__' names
+    # a module: this module stands in for it while processes start, so a numbered script run on its own
+    # is not run again by every parse worker
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+def _loadFromQueue(connect, table, workQueue, result):
+    connection = None
+    drained = False
+    try:
+        connection = connect()
+        cursor = connection.cursor()
+        while True:
+            item = workQueue.get()
+            if item is None:
+                drained = True
+                break
+            orgFile, columns, csvText, rows = item
+            if csvText is not None:
+                cursor.copy_expert(copyCommand(table, columns), io.StringIO(csvText))
+                result['rows'] += rows
+        connection.commit()
+        cursor.close()
+    except Exception as error:
+        result['error'] = error
+        # Keep draining so parse workers blocked on a full queue can finish
+        while not drained and workQueue.get() is not None:
+            pass
+    finally:
+        if connection is not None:
+            pipeline_settings.release(connection)
+
+
+def parallelStreamYieldDirectory(connect, directory, schema, memoryLimitMB=DEFAULT_MEMORY_LIMIT_MB,
+                                 parseWorkers=None, loadWorkers=1, queueChunks=DEFAULT_QUEUE_CHUNKS, files=None, transforms=()):
+    """Parse the raw CSVs in 'directory' in a process pool while loader threads COPY them into the vendor's scratch table.
+
+    'connect' is a function returning a psycopg2 connection (one per loader, handed back with
+    'pipeline_settings.release', e.g. 'pipeline_settings.connectionFactory(loadWorkers)'); each loader
+    commits its own connection once its queue is drained. Rows loaded are identical to
+    'streamYieldDirectory'; only the order of the serial 'id' values may differ.
+    Returns a dictionary of org_file -> number of rows loaded.
+    """
+    parseWorkers = parseWorkers or max(1, (os.cpu_count() or 2) - 1)
+    loadWorkers = max(1, loadWorkers)
+
+    with _workerMain():
+        manager = multiprocessing.Manager()
+    workQueues = [manager.Queue(maxsize = queueChunks) for i in range(loadWorkers)]
+    results = [{'rows': 0, 'error': None} for i in range(loadWorkers)]
+    fileRows = {}
+    loaders = [threading.Thread(target = _loadFromQueue, args = (connect, schema.stagingTable, workQueues[i], results[i]))
+               for i in range(loadWorkers)]
+    for loader in loaders:
+        loader.start()
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = parseWorkers) as pool:
+            futures = []
+            # Worker processes are started by 'submit'
+            with _workerMain():
+                for i, input_file in enumerate(listYieldCSVs(directory, files)):
+                    csvPath = os.path.join(directory, input_file)
+                    futures.append(pool.submit(_parseFileToQueue, csvPath, schema, str(input_file[:-4]), memoryLimitMB,
+                                               tuple(transforms), workQueues[i % loadWorkers]))
+            for future in concurrent.futures.as_completed(futures):
+                orgFile, rows = future.result()
+                fileRows[orgFile] = rows
+                print(orgFile + " (" + str(rows) + " rows parsed)")
+    finally:
+        for workQueue in workQueues:
+            workQueue.put(None)
+        for loader in loaders:
+            loader.join()
+        manager.shutdown()
+
+    for result in results:
+        if result['error'] is not None:
+            raise result['error']
+    return fileRows
+
+
+###############################################################################
+# Scratch tables -> 'yield_point'
+
+def yieldPointInsertCommand(schema, extraColumns=('org_file', 'file_source', 'field_id', 'farmer_id'), table='yield_point', where=None):
+    """Return the 'INSERT INTO yield_point ... SELECT' moving the vendor's scratch table rows to 'yield_point'.
+
+    Vendor columns are mapped using the 'final' column names of the vendor schema; columns the vendor
+    does not provide are left NULL. 'extraColumns' have the same name in both tables. 'table' may name
+    a partition of 'yield_point', and 'where' limits the scratch table rows moved.
+    """
+    stagingNames = vendor_schemas.stagingColumns(schema) + list(extraColumns)
+    finalNames = [vendor_schemas.finalColumns(schema).get(name, name) for name in stagingNames]
+    return """
+INSERT INTO {}({})
+SELECT {}
+FROM {}{};""".format(table, ','.join('"' + name + '"' for name in finalNames),
+                     ','.join('"' + name + '"' for name in stagingNames), schema.stagingTable,
+                     '' if where is None else '\nWHERE ' + where)
+
+
+###############################################################################
+# Incremental ingest manifest ('ingest_manifest' table, created by '1_CreatingDatabaseTables.py')
+#   -- A file whose size and modification time match the manifest is skipped without reading it
+#   -- Otherwise the file is hashed; a file whose hash matches the manifest was only touched, and is skipped
+#   -- New and changed files are loaded; the rows of changed files are replaced in 'yield_point' and
+#      the manifest is updated in the same transaction (see 'deleteYieldPointFiles' and 'recordManifest')
+#   -- The groups (and extents) of the replaced rows are recorded first ('recordReplacedGroups'), so the
+#      incremental export, grid and tile seeding also remove the groups and points a changed file no longer covers
+
+ManifestEntry = collections.namedtuple('ManifestEntry', ['input_file', 'org_file', 'file_source', 'file_size',
+                                                         'file_mtime', 'content_hash', 'changed'])
+
+
+def hashFile(csvPath):
+    """Return the SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(csvPath, 'rb') as csvFile:
+        for block in iter(lambda: csvFile.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def planIncrementalLoad(cursor, directory, schema):
+    """Compare the raw CSVs in 'directory' to the manifest; return a list of ManifestEntry for new or changed files."""
+    cursor.execute("SELECT org_file, file_size, file_mtime, content_hash FROM ingest_manifest WHERE file_source = %s",
+                   (schema.vendor,))
+    loaded = dict((row[0], row[1:]) for row in cursor.fetchall())
+    plan = []
+    for input_file in listYieldCSVs(directory):
+        orgFile = str(input_file[:-4])
+        csvPath = os.path.join(directory, input_file)
+        fileStat = os.stat(csvPath)
+        fileMtime = datetime.datetime.fromtimestamp(fileStat.st_mtime)
+        previous = loaded.get(orgFile)
+        if previous is not None and previous[0] == fileStat.st_size and previous[1] == fileMtime:
+            continue
+        contentHash = hashFile(csvPath)
+        if previous is not None and previous[2] == contentHash:
+            # File was touched but its contents did not change
+            cursor.execute("UPDATE ingest_manifest SET file_mtime = %s WHERE file_source = %s AND org_file = %s",
+                           (fileMtime, schema.vendor, orgFile))
+            continue
+        plan.append(ManifestEntry(input_file, orgFile, schema.vendor, fileStat.st_size, fileMtime, contentHash,
+                                  previous is not None))
+    return plan
+
+
+def recordManifest(cursor, plan, fileRows):
+    """Insert or update the manifest rows of the files in 'plan' (call in the transaction that loads them)."""
+    for entry in plan:
+        cursor.execute("""
+INSERT INTO ingest_manifest(org_file, file_source, file_size, file_mtime, content_hash, row_count, loaded_at)
+VALUES (%s, %s, %s, %s, %s, %s, now())
+ON CONFLICT (file_source, org_file) DO UPDATE
+SET file_size = EXCLUDED.file_size, file_mtime = EXCLUDED.file_mtime, content_hash = EXCLUDED.content_hash,
+    row_count = EXCLUDED.row_count, loaded_at = EXCLUDED.loaded_at;""",
+                       (entry.org_file, entry.file_source, entry.file_size, entry.file_mtime, entry.content_hash,
+                        fileRows.get(entry.org_file, 0)))
+
+
+def createReplacedGroupsTableCommand():
+    """Return the 'CREATE TABLE IF NOT EXISTS' command of the table of replaced groups."""
+    return """
+CREATE TABLE IF NOT EXISTS {}(
+field_id smallint NULL,   -- NULL for points without a field
+year smallint NOT NULL,
+replaced_at timestamp NOT NULL DEFAULT now(),   -- 'loaded_at' of the reloaded files in 'ingest_manifest'
+xmin double precision NULL,   -- Web Mercator extent of the replaced rows ('geom_3857'; NULL without geometry)
+ymin double precision NULL,
+xmax double precision NULL,
+ymax double precision NULL
+);""".format(REPLACED_GROUPS_TABLE)
+
+
+def recordReplacedGroups(cursor, plan):
+    """Record the (field_id, year) groups, and their extents, of the 'yield_point' rows of the files in 'plan'.
+
+    Call before the rows are deleted, in the transaction that reloads the files.
+    """
+    # 'geom_3857' is only added to 'yield_point' by '4_SpatiallyEnable.py' when it is not ingested
+    cursor.execute("""
+SELECT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'yield_point' AND column_name = 'geom_3857');""")
+    if cursor.fetchone()[0]:
+        extent, geometry = "ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)", ", ST_Extent(geom_3857) AS e"
+    else:
+        extent, geometry = "NULL, NULL, NULL, NULL", ""
+    for fileSource in sorted(set(entry.file_source for entry in plan)):
+        plannedFiles = [entry.org_file for entry in plan if entry.file_source == fileSource]
+        cursor.execute("""
+INSERT INTO {table}(field_id, year, replaced_at, xmin, ymin, xmax, ymax)
+SELECT field_id, year, now(), {extent}
+FROM (SELECT field_id, date_part('year', date)::smallint AS year{geometry}
+      FROM yield_point WHERE file_source = %s AND org_file = ANY(%s)
+      GROUP BY field_id, date_part('year', date)) t;""".format(table = REPLACED_GROUPS_TABLE, extent = extent, geometry = geometry),
+                       (fileSource, plannedFiles))
+
+
+def deleteYieldPointFiles(cursor, plan, excludeTables=()):
+    """Delete any 'yield_point' rows of the files in 'plan' (call in the transaction that reloads them).
+
+    Rows of new files are deleted too, in case an earlier run moved some of them (for instance
+    partitions loaded on other connections) but failed before updating the manifest. Rows stored in
+    'excludeTables' (partitions that delete their own rows when loaded on other connections) are kept.
+    """
+    for fileSource in sorted(set(entry.file_source for entry in plan)):
+        plannedFiles = [entry.org_file for entry in plan if entry.file_source == fileSource]
+        if excludeTables:
+            cursor.execute("DELETE FROM yield_point WHERE file_source = %s AND org_file = ANY(%s) "
+                           "AND tableoid <> ALL(%s::regclass[]);",
+                           (fileSource, plannedFiles, list(excludeTables)))
+        else:
+            cursor.execute("DELETE FROM yield_point WHERE file_source = %s AND org_file = ANY(%s);",
+                           (fileSource, plannedFiles))
+
+
+def tableIsEmpty(cursor, table):
+    cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM {});".format(table))
+    return cursor.fetchone()[0]
@@ -0,0 +1,102 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+In-memory lookups attached to each chunk of raw yield CSV rows before it is copied
+to the database (see the chunk transforms of 'yield_ingest.py'):
+        -- 'field_id' and 'farmer_id' of the original file name, from '_CSVimport_field_key'
+           (joined to 'field' on the final farm/field names)
+        -- 'corn' and 'soybean' flags of the product name, from 'products'
+Both tables are small and read once per run, which replaces the 'ALTER TABLE' and
+'UPDATE ... FROM' joins that rewrote every row of the scratch tables and 'yield_point'.
+
+Rows without a match are loaded with NULLs; 'unmatchedFiles' and 'unmatchedProducts'
+list them so they can be reported (and added to the operational CSVs).
+
+"""
+
+# Import necessary Python packages and libraries
+import pandas as pd
+
+# Nullable small integer, written as an empty value (NULL) by COPY when missing
+LOOKUP_DTYPE = 'Int16'
+
+
+def loadFieldKey(cursor):
+    """Return a dictionary of original file name -> (field_id, farmer_id)."""
+    cursor.execute("""
+SELECT fk.file_name, f.field_id, fk.farmerid
+FROM _CSVimport_field_key as fk
+LEFT JOIN field as f ON fk.final_farm = f.farm_name AND fk.final_field = f.field_name;""")
+    return dict((fileName, (fieldID, farmerID)) for fileName, fieldID, farmerID in cursor.fetchall())
+
+
+def loadProductFlags(cursor, source='yield_point'):
+    """Return a dictionary of product name -> (corn, soybean) for the products of 'source'."""
+    cursor.execute("SELECT productname, corn, soybean FROM products WHERE source = %s;", (source,))
+    return dict((productName, (corn, soybean)) for productName, corn, soybean in cursor.fetchall())
+
+
+class YieldLookups(object):
+    """Chunk transform adding 'field_id', 'farmer_id', 'corn' and 'soybean' to a dataframe of yield points.
+
+    Plain dictionaries only, so it can be sent to the parse processes of the parallel ingest.
+    """
+
+    def __init__(self, fieldKey, productFlags):
+        self.fieldKey = fieldKey
+        self.productFlags = productFlags
+
+    def __call__(self, df):
+        # Every row of a chunk comes from the same file, so the file is looked up once per distinct name
+        files = df['org_file'].astype('category')
+        fileNames = files.cat.categories
+        for position, column in enumerate(['field_id', 'farmer_id']):
+            values = pd.array([self.fieldKey.get(name, (None, None))[position] for name in fileNames], dtype = LOOKUP_DTYPE)
+            df[column] = values.take(files.cat.codes.to_numpy(), allow_fill = True)
+
+        # Products are looked up once per distinct name; rows without a product (code -1) stay NULL
+        products = df['product'].astype('category')
+        productNames = products.cat.categories
+        for position, column in enumerate(['corn', 'soybean']):
+            values = pd.array([self.productFlags.get(name, (None, None))[position] for name in productNames], dtype = LOOKUP_DTYPE)
+            df[column] = values.take(products.cat.codes.to_numpy(), allow_fill = True)
+        return df
+
+
+def unmatchedFiles(fieldKey, orgFiles):
+    """Return the sorted original file names missing from the field key."""
+    return sorted(orgFile for orgFile in orgFiles if orgFile not in fieldKey)
+
+
+def unmatchedProducts(cursor, table):
+    """Return (product, rows) of the products in scratch 'table' without 'corn'/'soybean' flags."""
+    cursor.execute("""
+SELECT product, count(*) FROM {}
+WHERE product IS NOT NULL AND corn IS NULL
+GROUP BY product ORDER BY product;""".format(table))
+    return cursor.fetchall()
@@ -0,0 +1,185 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Spatial neighborhood outlier filter for yield points (requires 'scipy'), applied to each
+file of rows before it is copied to the database (a chunk transform of 'yield_ingest.py',
+after the rule-based cleaning of 'yield_cleaning.py'). The chunks of a file are held until
+the end of the file, so every point is compared to all its neighbors whatever the chunk size.
+        -- Points of each file and field are projected to meters and put in a KD-tree
+        -- Each point is compared to the median of its neighbors within 'radius' meters; it is
+           an outlier when it differs by more than 'threshold' scaled median absolute
+           deviations (MAD) of those neighbors, e.g. 400 bu/ac in a 200 bu/ac neighborhood
+        -- Outliers are dropped, or flagged in column 'spatial_outlier' (1 = outlier)
+Neighbors are found for batches of points at a time ('cKDTree.query' on arrays) and the
+medians computed on the sorted neighbor arrays, so there is no loop over the points; the
+fields of a file are filtered on several threads at the same time (or, for a file of one
+field, its neighbor queries are split over the threads).
+
+"""
+
+# Import necessary Python packages and libraries
+import time
+import collections
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import yield_geometry
+import pipeline_metrics
+
+# Scale of the median absolute deviation to the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+# Points queried for their neighbors at a time (memory is about 'QUERY_BATCH' * 'neighbors' * 24 bytes)
+QUERY_BATCH = 200000
+
+OutlierSettings = collections.namedtuple('OutlierSettings', [
+    'column',          # yield column compared to its neighbors
+    'radius',          # neighborhood radius (meters)
+    'neighbors',       # most neighbors compared (nearest first)
+    'minNeighbors',    # fewer neighbors within 'radius': the point is kept
+    'threshold',       # scaled MADs from the neighborhood median
+    'minMAD',          # smallest MAD used (units of 'column'), for uniform neighborhoods
+])
+
+DEFAULT_SETTINGS = OutlierSettings(column = 'yld_vol_dr', radius = 15.0, neighbors = 16, minNeighbors = 5,
+                                   threshold = 3.5, minMAD = 5.0)
+
+
+def localMeters(longitude, latitude):
+    """Return x/y (meters) of WGS84 points, Web Mercator scaled to true distance at their mean latitude."""
+    x, y = yield_geometry.lonLatToWebMercator(longitude, latitude)
+    scale = np.cos(np.radians(np.nanmean(latitude))) if len(latitude) else 1.0
+    return x * scale, y * scale
+
+
+def _rowMedians(sortedValues, counts):
+    # Median of the first 'counts' values of each sorted row (NaN where a row has no values)
+    rows = np.arange(len(sortedValues))
+    low = sortedValues[rows, np.maximum((counts - 1) // 2, 0)]
+    high = sortedValues[rows, np.maximum(counts // 2, 0)]
+    return np.where(counts > 0, (low + high) / 2.0, np.nan)
+
+
+def outlierMask(x, y, values, settings=DEFAULT_SETTINGS, workers=1):
+    """Return a boolean array marking the spatial outliers among points 'x'/'y' (meters) with 'values'.
+
+    'workers' threads query the neighbors of each batch of points.
+    """
+    from scipy.spatial import cKDTree
+
+    n = len(values)
+    mask = np.zeros(n, dtype = bool)
+    valid = ~(np.isnan(x) | np.isnan(y) | np.isnan(values))
+    if valid.sum() <= settings.minNeighbors:
+        return mask
+    points = np.column_stack([x[valid], y[valid]])
+    pointValues = values[valid]
+    tree = cKDTree(points)
+    # Missing neighbors are returned as index len(points): pad the values with NaN for them
+    paddedValues = np.append(pointValues, np.nan)
+    validMask = np.zeros(len(points), dtype = bool)
+    for start in range(0, len(points), QUERY_BATCH):
+        batch = points[start:start + QUERY_BATCH]
+        # The nearest neighbor of each point is itself
+        distances, indexes = tree.query(batch, k = settings.neighbors + 1, distance_upper_bound = settings.radius,
+                                        workers = workers)
+        neighborValues = np.sort(paddedValues[indexes[:, 1:]], axis = 1)
+        counts = (~np.isnan(neighborValues)).sum(axis = 1)
+        median = _rowMedians(neighborValues, counts)
+        deviations = np.sort(np.abs(neighborValues - median[:, None]), axis = 1)
+        mad = np.maximum(_rowMedians(deviations, counts) * MAD_SCALE, settings.minMAD)
+        batchValues = pointValues[start:start + QUERY_BATCH]
+        with np.errstate(invalid = 'ignore'):
+            validMask[start:start + QUERY_BATCH] = (counts >= settings.minNeighbors) & (np.abs(batchValues - median) > settings.threshold * mad)
+    mask[valid] = validMask
+    return mask
+
+
+class SpatialOutlierFilter(object):
+    """Chunk transform dropping (or flagging) the spatial outliers of each file and field of yield points.
+
+    Chunks are held until 'finishFile' ('yield_ingest.iterYieldChunks'), which filters the whole file;
+    'filterFile' filters a dataframe of whole files at once.
+    """
+
+    def __init__(self, settings=DEFAULT_SETTINGS, dropOutliers=True, workers=1, stage=None):
+        self.settings = settings
+        self.dropOutliers = dropOutliers
+        self.workers = workers
+        self.stage = stage
+        self.points = 0
+        self.outliers = 0
+        self._chunks = []
+
+    def _groupMask(self, df, positions, workers):
+        longitude = df['longitude'].to_numpy(dtype = 'float64', na_value = np.nan)[positions]
+        latitude = df['latitude'].to_numpy(dtype = 'float64', na_value = np.nan)[positions]
+        values = df[self.settings.column].to_numpy(dtype = 'float64', na_value = np.nan)[positions]
+        x, y = localMeters(longitude, latitude)
+        return positions, outlierMask(x, y, values, self.settings, workers)
+
+    def __call__(self, df):
+        # The neighbors of a point may be in any chunk of its file
+        self._chunks.append(df)
+        return df.iloc[:0]
+
+    def finishFile(self):
+        """Filter the chunks held for the file."""
+        chunks, self._chunks = self._chunks, []
+        if not chunks:
+            return None
+        return self.filterFile(pd.concat(chunks))
+
+    def filterFile(self, df):
+        if not len(df):
+            return df
+        startTime = time.time()
+        # One KD-tree for each file and field (vendor 'field' name)
+        groups = [pd.factorize(df[column])[0] for column in ('org_file', 'field')]
+        groups = list(pd.Series(np.arange(len(df))).groupby(groups, sort = False).indices.values())
+        workers = max(1, self.workers)
+        mask = np.zeros(len(df), dtype = bool)
+        if len(groups) == 1:
+            # The threads split the neighbor queries of the only group
+            positions, groupMask = self._groupMask(df, groups[0], workers)
+            mask[positions] = groupMask
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as pool:
+                for positions, groupMask in pool.map(lambda positions: self._groupMask(df, positions, 1), groups):
+                    mask[positions] = groupMask
+        outliers = int(mask.sum())
+        self.points += len(df)
+        self.outliers += outliers
+        orgFile = str(df['org_file'].iat[0])
+        print("Spatial outliers in " + orgFile + ": " + str(outliers) + " of " + str(len(df)) + " points")
+        if self.stage is not None:
+            pipeline_metrics.record(self.stage, 'spatial_outliers', time.time() - startTime, rows = len(df),
+                                    org_file = orgFile, outliers = outliers)
+        if self.dropOutliers:
+            return df[~mask]
+        df['spatial_outlier'] = mask.astype('int16')
+        return df
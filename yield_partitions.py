@@ -0,0 +1,148 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Helper functions for a partitioned 'yield_point' table (created by '1_CreatingDatabaseTables.py'
+when 'partitionYieldPoint' is True). Requires PostgreSQL 11 or later.
+        -- 'yield_point' is partitioned by range of the harvest 'date', one partition per year
+           (for instance 'yield_point_2016')
+        -- Optionally each year is sub-partitioned by list of 'field_id' (for instance
+           'yield_point_2016_f19'), with a default partition for rows without a field
+1) Partitions are created for every year (and field) found in the scratch tables before
+   their rows are moved to 'yield_point', so new seasons need no manual setup
+2) The rows of each partition can be moved from the scratch tables over separate
+   database connections at the same time
+
+Queries filtering on year (and field) only read the matching partitions and their
+(smaller) indexes.
+
+"""
+
+# Import necessary Python packages and libraries
+import concurrent.futures
+import yield_ingest
+import pipeline_settings
+
+YIELD_POINT = 'yield_point'
+
+
+def isPartitioned(cursor, table=YIELD_POINT):
+    """Return True if 'table' is a partitioned table."""
+    cursor.execute("""
+SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+               WHERE c.relname = %s AND pg_table_is_visible(c.oid));""", (table,))
+    return cursor.fetchone()[0]
+
+
+def partitionName(year, fieldID=None, byField=False):
+    """Return the name of the partition holding 'year' (and 'fieldID' when sub-partitioned by field)."""
+    name = '{}_{}'.format(YIELD_POINT, year)
+    if not byField:
+        return name
+    return name + ('_f{}'.format(fieldID) if fieldID is not None else '_fdefault')
+
+
+def partitionKeys(cursor, schemas, byField=False):
+    """Return the sorted (year, field_id) pairs found in the vendors' scratch tables (field_id None unless 'byField')."""
+    keys = set()
+    for schema in schemas:
+        cursor.execute("SELECT DISTINCT date_part('year', date)::integer, {} FROM {};".format(
+            'field_id' if byField else 'NULL::smallint', schema.stagingTable))
+        keys.update(cursor.fetchall())
+    return sorted(keys, key = lambda key: (key[0], -1 if key[1] is None else key[1]))
+
+
+def ensurePartitions(cursor, keys, byField=False):
+    """Create any missing partitions for the (year, field_id) 'keys'.
+
+    Commit before other connections load the partitions: creating a partition locks 'yield_point'.
+    """
+    for year in sorted(set(key[0] for key in keys)):
+        cursor.execute("""
+CREATE TABLE IF NOT EXISTS {} PARTITION OF {}
+FOR VALUES FROM ('{}-01-01') TO ('{}-01-01'){};""".format(partitionName(year), YIELD_POINT, year, year + 1,
+                                                      ' PARTITION BY LIST (field_id)' if byField else ''))
+        if byField:
+            # Rows without a field (file not found in the field key) go to the default partition
+            cursor.execute("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT;".format(
+                partitionName(year, None, True), partitionName(year)))
+    if byField:
+        for year, fieldID in keys:
+            if fieldID is not None:
+                cursor.execute("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({});".format(
+                    partitionName(year, fieldID, True), partitionName(year), int(fieldID)))
+
+
+def _insertPartition(connect, command, parameters, deleteCommand=None, deleteParameters=None):
+    connection = connect()
+    try:
+        cursor = connection.cursor()
+        if deleteCommand:
+            cursor.execute(deleteCommand, deleteParameters)
+        cursor.execute(command, parameters)
+        rows = cursor.rowcount
+        connection.commit()
+        cursor.close()
+        return rows
+    finally:
+        pipeline_settings.release(connection)
+
+
+def parallelInsertPartitions(connect, schemas, keys, extraColumns, byField=False, workers=4, plan=()):
+    """Move the scratch table rows into their 'yield_point' partitions, one partition per connection at a time.
+
+    Each partition commits on its own connection; the existing rows of the reloaded files in 'plan'
+    (manifest entries) are deleted from the partition in that same transaction, so within a loaded
+    partition readers never see both the old and the new rows. Old rows in partitions that are not
+    loaded (a changed file moved to another year or field) are deleted by the caller, whose commit
+    may come after these ones. Returns the number of rows moved.
+    """
+    tasks = []
+    for schema in schemas:
+        plannedFiles = [entry.org_file for entry in plan if entry.file_source == schema.vendor]
+        for year, fieldID in keys:
+            where = "date >= %s AND date < %s"
+            parameters = ['{}-01-01'.format(year), '{}-01-01'.format(year + 1)]
+            if byField and fieldID is None:
+                where += " AND field_id IS NULL"
+            elif byField:
+                where += " AND field_id = %s"
+                parameters.append(int(fieldID))
+            partition = partitionName(year, fieldID, byField)
+            command = yield_ingest.yieldPointInsertCommand(schema, extraColumns, partition, where)
+            deleteCommand = deleteParameters = None
+            if plannedFiles:
+                deleteCommand = "DELETE FROM {} WHERE file_source = %s AND org_file = ANY(%s);".format(partition)
+                deleteParameters = (schema.vendor, plannedFiles)
+            tasks.append((command, tuple(parameters), deleteCommand, deleteParameters))
+
+    totalRows = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(_insertPartition, connect, *task) for task in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            totalRows += future.result()
+    return totalRows
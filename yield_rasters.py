@@ -0,0 +1,202 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Interpolated yield surfaces of each field, used by '8_InterpolateYieldRasters.py'. Kept in a
+module so the work of one field can be sent to the worker processes of a process pool.
+        -- The yield points of a field and year inside its boundary ('field_polygons_v1') are
+           read in Web Mercator ('geom_3857'), the map's coordinate system
+        -- Grid cells are interpolated by inverse distance weighting (IDW) of the nearest
+           points, found for whole arrays of cells at a time with a KD-tree (requires 'scipy')
+        -- Cells outside the field boundary, or without points within 'radius', are NoData
+        -- Each year/metric is written as a Cloud-Optimized GeoTIFF (tiled, compressed, with
+           overviews; requires GDAL, with the 'COG' driver of GDAL 3.1 or later when available)
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import math
+import time
+import numpy as np
+import psycopg2
+import yield_styles
+
+NODATA = -9999.0
+WEB_MERCATOR_SRID = 3857
+# Cells interpolated at a time (memory is about 'QUERY_BATCH' * 'neighbors' * 24 bytes)
+QUERY_BATCH = 250000
+OVERVIEW_LEVELS = [2, 4, 8, 16]
+
+
+def rasterName(fieldID, year, metric):
+    """Return the file name of the raster of a field, year and metric."""
+    return 'yield_{}_field{}_{}.tif'.format(year, fieldID, yield_styles.METRIC_NAMES.get(metric, metric))
+
+
+def fieldYears(cursor, years=None):
+    """Return the sorted (field_id, year) pairs with yield points and a field boundary (from 'yield_summary')."""
+    cursor.execute("""
+SELECT DISTINCT s.field_id, s.year FROM yield_summary s
+WHERE EXISTS (SELECT 1 FROM field_polygons_v1 f WHERE f.field_id = s.field_id)
+AND (%s::integer[] IS NULL OR s.year = ANY(%s::integer[]))
+ORDER BY 1, 2;""", (years, years))
+    return cursor.fetchall()
+
+
+def loadFieldPoints(cursor, fieldID, year, metrics):
+    """Return the x, y and metric arrays (Web Mercator) of the points of a field and year inside its boundary."""
+    cursor.execute("""
+SELECT ST_X(p.geom_3857), ST_Y(p.geom_3857), {}
+FROM yield_point p
+WHERE p.field_id = %s AND p.date >= make_date(%s, 1, 1) AND p.date < make_date(%s + 1, 1, 1)
+AND EXISTS (SELECT 1 FROM field_polygons_v1 f
+            WHERE f.field_id = p.field_id AND ST_Intersects(ST_Transform(f.geom, 3857), p.geom_3857));""".format(
+        ', '.join('p.{}::double precision'.format(metric) for metric in metrics)), (fieldID, year, year))
+    rows = np.array(cursor.fetchall(), dtype = 'float64').reshape(-1, 2 + len(metrics))
+    return rows[:, 0], rows[:, 1], dict((metric, rows[:, 2 + i]) for i, metric in enumerate(metrics))
+
+
+def loadFieldBoundary(cursor, fieldID):
+    """Return the WKB of the field boundary (all polygons of the field) in Web Mercator."""
+    cursor.execute("""
+SELECT ST_AsBinary(ST_Transform(ST_Union(geom), 3857)) FROM field_polygons_v1 WHERE field_id = %s;""", (fieldID,))
+    return bytes(cursor.fetchone()[0])
+
+
+def gridCells(xmin, ymin, xmax, ymax, cellSize):
+    """Return the origin (top left), shape and cell center coordinates of a grid covering the bounds."""
+    columns = max(1, int(math.ceil((xmax - xmin) / cellSize)))
+    rows = max(1, int(math.ceil((ymax - ymin) / cellSize)))
+    centerX = xmin + (np.arange(columns) + 0.5) * cellSize
+    centerY = ymax - (np.arange(rows) + 0.5) * cellSize
+    return (xmin, ymax), (rows, columns), centerX, centerY
+
+
+def idwGrid(tree, values, cellX, cellY, power=2.0, neighbors=12, radius=None):
+    """Return IDW estimates of 'values' (points of KD-tree 'tree') at cells 'cellX'/'cellY' (NaN without neighbors)."""
+    estimates = np.full(len(cellX), np.nan)
+    paddedValues = np.append(values, np.nan)
+    bound = radius if radius is not None else np.inf
+    k = min(neighbors, len(values))
+    for start in range(0, len(cellX), QUERY_BATCH):
+        cells = np.column_stack([cellX[start:start + QUERY_BATCH], cellY[start:start + QUERY_BATCH]])
+        distances, indexes = tree.query(cells, k = k, distance_upper_bound = bound)
+        distances = distances.reshape(len(cells), k)
+        indexes = indexes.reshape(len(cells), k)
+        neighborValues = paddedValues[indexes]
+        found = np.isfinite(distances) & ~np.isnan(neighborValues)
+        with np.errstate(divide = 'ignore'):
+            weights = np.where(found, 1.0 / np.power(distances, power), 0.0)
+        # A cell center on a point takes the point's value
+        exact = found & (distances == 0)
+        weights = np.where(exact.any(axis = 1)[:, None], exact.astype('float64'), weights)
+        totals = weights.sum(axis = 1)
+        with np.errstate(invalid = 'ignore'):
+            estimates[start:start + QUERY_BATCH] = np.where(totals > 0, (weights * np.nan_to_num(neighborValues)).sum(axis = 1) / totals, np.nan)
+    return estimates
+
+
+def boundaryMask(boundaryWKB, origin, shape, cellSize):
+    """Return a boolean array of the grid cells whose centers are inside the boundary (GDAL rasterize)."""
+    from osgeo import gdal, ogr, osr
+
+    spatialReference = osr.SpatialReference()
+    spatialReference.ImportFromEPSG(WEB_MERCATOR_SRID)
+    vectorSource = ogr.GetDriverByName('Memory').CreateDataSource('boundary')
+    layer = vectorSource.CreateLayer('boundary', spatialReference, ogr.wkbMultiPolygon)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(ogr.CreateGeometryFromWkb(boundaryWKB))
+    layer.CreateFeature(feature)
+    maskRaster = gdal.GetDriverByName('MEM').Create('', shape[1], shape[0], 1, gdal.GDT_Byte)
+    maskRaster.SetGeoTransform((origin[0], cellSize, 0, origin[1], 0, -cellSize))
+    gdal.RasterizeLayer(maskRaster, [1], layer, burn_values = [1])
+    return maskRaster.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+def writeCOG(path, array, origin, cellSize, nodata=NODATA):
+    """Write a float32 array as a Cloud-Optimized GeoTIFF (tiled, compressed, with overviews) in Web Mercator."""
+    from osgeo import gdal, osr
+
+    spatialReference = osr.SpatialReference()
+    spatialReference.ImportFromEPSG(WEB_MERCATOR_SRID)
+    memoryRaster = gdal.GetDriverByName('MEM').Create('', array.shape[1], array.shape[0], 1, gdal.GDT_Float32)
+    memoryRaster.SetGeoTransform((origin[0], cellSize, 0, origin[1], 0, -cellSize))
+    memoryRaster.SetProjection(spatialReference.ExportToWkt())
+    band = memoryRaster.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+    band.WriteArray(np.where(np.isnan(array), nodata, array).astype('float32'))
+    if gdal.GetDriverByName('COG') is not None:
+        options = ['COMPRESS=DEFLATE', 'PREDICTOR=YES', 'BLOCKSIZE=256', 'OVERVIEW_RESAMPLING=AVERAGE']
+        gdal.GetDriverByName('COG').CreateCopy(path, memoryRaster, options = options)
+    else:
+        # Before GDAL 3.1: tiled GeoTIFF with the overviews copied ahead of the full resolution data
+        memoryRaster.BuildOverviews('AVERAGE', [level for level in OVERVIEW_LEVELS if min(array.shape) // level >= 1])
+        options = ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE', 'PREDICTOR=3', 'COPY_SRC_OVERVIEWS=YES']
+        gdal.GetDriverByName('GTiff').CreateCopy(path, memoryRaster, options = options)
+    memoryRaster = None
+
+
+def interpolateField(connectionString, fieldID, year, metrics, outputDir, cellSize=5.0, power=2.0, neighbors=12, radius=20.0):
+    """Write the IDW rasters of every metric of a field and year; returns (field_id, year, points, file names, seconds).
+
+    'cellSize' and 'radius' are ground distances (meters); they are scaled to Web Mercator units at the field's latitude.
+    """
+    from scipy.spatial import cKDTree
+
+    startTime = time.time()
+    connection = psycopg2.connect(connectionString)
+    try:
+        cursor = connection.cursor()
+        x, y, values = loadFieldPoints(cursor, fieldID, year, metrics)
+        boundaryWKB = loadFieldBoundary(cursor, fieldID) if len(x) else None
+        cursor.close()
+    finally:
+        connection.close()
+    if not len(x):
+        return fieldID, year, 0, [], time.time() - startTime
+
+    # Web Mercator units are 1 / cos(latitude) ground meters
+    latitude = math.degrees(2.0 * math.atan(math.exp(float(np.mean(y)) / 6378137.0)) - math.pi / 2.0)
+    scale = 1.0 / math.cos(math.radians(latitude))
+    mapCellSize, mapRadius = cellSize * scale, radius * scale
+    origin, shape, centerX, centerY = gridCells(x.min(), y.min(), x.max(), y.max(), mapCellSize)
+    cellX, cellY = [grid.ravel() for grid in np.meshgrid(centerX, centerY)]
+    inside = boundaryMask(boundaryWKB, origin, shape, mapCellSize).ravel()
+
+    rasterFiles = []
+    for metric in metrics:
+        valid = ~np.isnan(values[metric])
+        if not valid.any():
+            continue
+        tree = cKDTree(np.column_stack([x[valid], y[valid]]))
+        surface = np.full(len(cellX), np.nan)
+        surface[inside] = idwGrid(tree, values[metric][valid], cellX[inside], cellY[inside], power, neighbors, mapRadius)
+        fileName = rasterName(fieldID, year, metric)
+        writeCOG(os.path.join(outputDir, fileName), surface.reshape(shape), origin, mapCellSize)
+        rasterFiles.append(fileName)
+    return fieldID, year, len(x), rasterFiles, time.time() - startTime
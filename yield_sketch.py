@@ -0,0 +1,216 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Mergeable quantile sketches of the yield metrics, used to compute map class breaks
+(see '7_GenerateYieldStyles.py') without sorting every point of a season.
+        -- Values are counted in logarithmic buckets: bucket i holds the values between
+           GAMMA^(i-1) and GAMMA^i, so any quantile is returned within 'RELATIVE_ACCURACY'
+           of its true value; zero and negative values share one bucket
+        -- A sketch is only a set of bucket counts, so sketches of separate files (or
+           chunks) merge exactly by adding their counts
+1) Table 'yield_sketch' holds the bucket counts of every loaded file, by year, crop and
+   metric; the counts are computed by Postgres ('GROUP BY') from the rows of the loaded
+   files only, and replaced when a changed file is reloaded
+2) The sketch of any year/crop subset is the sum of its files' counts (a few hundred rows)
+3) 'QuantileSketch' returns quantile breaks or natural (Jenks) breaks of the merged counts
+
+"""
+
+# Import necessary Python packages and libraries
+import math
+import numpy as np
+import yield_summary
+
+SKETCH_TABLE = 'yield_sketch'
+# Relative error of the quantiles returned by a sketch (0.5%: about 600 buckets for values from 1 to 400)
+RELATIVE_ACCURACY = 0.005
+GAMMA = (1.0 + RELATIVE_ACCURACY) / (1.0 - RELATIVE_ACCURACY)
+# Bucket of the values at or below 'MIN_VALUE' (zero yields at headlands and turns)
+MIN_VALUE = 1e-6
+ZERO_BUCKET = -1000000
+# Metrics sketched during ingest
+METRICS = ['yld_vol_dr', 'yld_mass_d']
+
+###############################################################################
+# Sketch
+
+class QuantileSketch(object):
+    """Counts of values in logarithmic buckets; mergeable and accurate to 'RELATIVE_ACCURACY'."""
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def add(self, values):
+        """Count an array of values (NaN values are skipped); returns the sketch."""
+        values = np.asarray(values, dtype = 'float64')
+        values = values[~np.isnan(values)]
+        buckets = np.full(len(values), ZERO_BUCKET, dtype = 'int64')
+        positive = values > MIN_VALUE
+        buckets[positive] = np.ceil(np.log(values[positive]) / math.log(GAMMA))
+        for bucket, count in zip(*np.unique(buckets, return_counts = True)):
+            self.counts[int(bucket)] = self.counts.get(int(bucket), 0) + int(count)
+        return self
+
+    def merge(self, other):
+        """Add the counts of sketch 'other'; returns the sketch."""
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        return self
+
+    def weightedValues(self):
+        """Return sorted arrays of bucket values and counts."""
+        buckets = np.array(sorted(self.counts), dtype = 'int64')
+        counts = np.array([self.counts[bucket] for bucket in buckets], dtype = 'float64')
+        return bucketValue(buckets), counts
+
+    def quantile(self, q):
+        """Return the value at fraction 'q' (0 to 1) of the counted values."""
+        values, counts = self.weightedValues()
+        if not len(values):
+            raise ValueError("Empty sketch")
+        rank = q * (counts.sum() - 1)
+        return float(values[np.searchsorted(np.cumsum(counts) - 1, rank, side = 'left')])
+
+    def quantileBreaks(self, classes):
+        """Return the 'classes' - 1 ascending breaks putting an equal number of values in each class."""
+        return [self.quantile(float(i) / classes) for i in range(1, classes)]
+
+    def naturalBreaks(self, classes):
+        """Return the 'classes' - 1 ascending natural (Jenks) breaks of the counted values.
+
+        Classes minimize the sum of squared deviations from each class mean, weighting
+        each bucket value by its count.
+        """
+        values, counts = self.weightedValues()
+        n = len(values)
+        if n <= classes:
+            return [float(value) for value in values[1:]]
+        weight = np.concatenate([[0.0], np.cumsum(counts)])
+        sum1 = np.concatenate([[0.0], np.cumsum(counts * values)])
+        sum2 = np.concatenate([[0.0], np.cumsum(counts * values * values)])
+
+        def deviations(starts, end):
+            # Sum of squared deviations of buckets starts..end-1 (vector of starts)
+            w = weight[end] - weight[starts]
+            return (sum2[end] - sum2[starts]) - (sum1[end] - sum1[starts]) ** 2 / w
+
+        # cost[j]: least deviations of buckets 0..j-1 in the current number of classes
+        cost = np.concatenate([[0.0], deviations(np.zeros(n, dtype = 'int64'), np.arange(1, n + 1))])
+        starts = []
+        for c in range(1, classes):
+            newCost = np.full(n + 1, np.inf)
+            start = np.zeros(n + 1, dtype = 'int64')
+            for end in range(c + 1, n + 1):
+                candidates = np.arange(c, end)
+                total = cost[candidates] + deviations(candidates, end)
+                best = int(np.argmin(total))
+                newCost[end], start[end] = total[best], candidates[best]
+            cost = newCost
+            starts.append(start)
+        # Walk back from the last bucket to the first bucket of each class
+        breaks = []
+        end = n
+        for start in reversed(starts):
+            end = int(start[end])
+            breaks.append(float(values[end]))
+        return sorted(breaks)
+
+
+def bucketValue(buckets):
+    """Return the value represented by each bucket (the value with the least relative error)."""
+    buckets = np.asarray(buckets, dtype = 'int64')
+    values = 2.0 * np.power(GAMMA, buckets.astype('float64')) / (GAMMA + 1.0)
+    return np.where(buckets == ZERO_BUCKET, 0.0, values)
+
+###############################################################################
+# Sketches in the database
+
+def createSketchTableCommand():
+    """Return the 'CREATE TABLE IF NOT EXISTS' command of the sketch table."""
+    return """
+CREATE TABLE IF NOT EXISTS {0}(
+file_source VARCHAR(20) NOT NULL,
+org_file VARCHAR(100) NOT NULL,
+year smallint NOT NULL,
+crop VARCHAR(10) NOT NULL,   -- 'corn', 'soybean' or 'other' (as in 'yield_summary')
+metric VARCHAR(20) NOT NULL,
+bucket integer NOT NULL,
+point_count bigint NOT NULL,
+CONSTRAINT {0}_pkey PRIMARY KEY (file_source, org_file, year, crop, metric, bucket)
+);""".format(SKETCH_TABLE)
+
+
+def bucketExpression(column):
+    """Return the SQL expression of the sketch bucket of 'column' (same buckets as 'QuantileSketch.add')."""
+    return "CASE WHEN {0} > {1} THEN ceil(ln({0}) / {2})::integer ELSE {3} END".format(
+        column, MIN_VALUE, repr(math.log(GAMMA)), ZERO_BUCKET)
+
+
+def refreshFileSketches(cursor, plan=None, metrics=METRICS):
+    """Recompute the sketches of the files in 'plan' (every file when None) from 'yield_point'; returns the rows written.
+
+    The old counts are deleted and the new ones inserted in the caller's transaction.
+    """
+    metricValues = ', '.join("('{0}', {0})".format(metric) for metric in metrics)
+    command = """
+INSERT INTO {0}(file_source, org_file, year, crop, metric, bucket, point_count)
+SELECT p.file_source, p.org_file, date_part('year', p.date)::smallint, {1}, m.metric, {2}, count(*)
+FROM yield_point p CROSS JOIN LATERAL (VALUES {3}) AS m(metric, value)
+WHERE m.value IS NOT NULL{{}}
+GROUP BY 1, 2, 3, 4, 5, 6;""".format(SKETCH_TABLE, yield_summary.CROP_EXPRESSION, bucketExpression('m.value'), metricValues)
+    if plan is None:
+        cursor.execute("TRUNCATE {};".format(SKETCH_TABLE))
+        cursor.execute(command.format(''))
+        return cursor.rowcount
+    rows = 0
+    for fileSource in sorted(set(entry.file_source for entry in plan)):
+        plannedFiles = [entry.org_file for entry in plan if entry.file_source == fileSource]
+        cursor.execute("DELETE FROM {} WHERE file_source = %s AND org_file = ANY(%s);".format(SKETCH_TABLE),
+                       (fileSource, plannedFiles))
+        cursor.execute(command.format(" AND p.file_source = %s AND p.org_file = ANY(%s)"), (fileSource, plannedFiles))
+        rows += cursor.rowcount
+    return rows
+
+
+def loadSketch(cursor, metric, year=None, crop=None):
+    """Return the merged 'QuantileSketch' of 'metric' for every file of 'year' and 'crop' (all when None)."""
+    cursor.execute("""
+SELECT bucket, sum(point_count) FROM {}
+WHERE metric = %s AND (%s IS NULL OR year = %s) AND (%s IS NULL OR crop = %s)
+GROUP BY bucket;""".format(SKETCH_TABLE), (metric, year, year, crop, crop))
+    return QuantileSketch((bucket, int(count)) for bucket, count in cursor.fetchall())
+
+
+def sketchSubsets(cursor, metric):
+    """Return the sorted (year, crop) subsets with counts of 'metric'."""
+    cursor.execute("SELECT DISTINCT year, crop FROM {} WHERE metric = %s ORDER BY 1, 2;".format(SKETCH_TABLE), (metric,))
+    return cursor.fetchall()
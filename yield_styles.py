@@ -0,0 +1,104 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+GeoServer point styles (YSLD) of the yield layers, with class breaks computed from the data
+(see 'yield_sketch.py') instead of written by hand.
+        -- Same layout and color ramp as 'yield_point_2016_corn_yieldvolume.ysld': the highest
+           class first (green), the lowest last (red)
+        -- Other numbers of classes interpolate the same ramp
+
+"""
+
+# Import necessary Python packages and libraries
+import numpy as np
+
+# Red-yellow-green ramp, highest class first
+COLOR_RAMP = ['#1a9850', '#91cf60', '#d9ef8b', '#ffffbf', '#fee08b', '#fc8d59', '#d73027']
+POINT_SIZE = 4.50
+# Layer name part of each metric ('yield_point_<year>_<crop>_<name>')
+METRIC_NAMES = {'yld_vol_dr': 'yieldvolume', 'yld_mass_d': 'yieldmass'}
+
+RULE_TEMPLATE = """  - filter: ${{{filter}}}
+    symbolizers:
+    - point:
+        size: {size:.2f}
+        symbols:
+        - mark:
+            shape: circle
+            fill-color: '{color}'
+"""
+
+
+def layerName(year, crop, metric):
+    """Return the GeoServer layer (and style) name of a year/crop/metric subset."""
+    return 'yield_point_{}_{}_{}'.format(year, crop, METRIC_NAMES.get(metric, metric))
+
+
+def rampColors(classes, ramp=COLOR_RAMP):
+    """Return 'classes' colors along 'ramp' (highest class first)."""
+    if classes == len(ramp):
+        return list(ramp)
+    rgb = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] for color in ramp], dtype = 'float64')
+    positions = np.linspace(0, len(ramp) - 1, classes)
+    colors = []
+    for position in positions:
+        low = int(np.floor(position))
+        high = min(low + 1, len(ramp) - 1)
+        value = rgb[low] + (rgb[high] - rgb[low]) * (position - low)
+        colors.append('#' + ''.join('{:02x}'.format(int(round(channel))) for channel in value))
+    return colors
+
+
+def classFilters(metric, breaks, decimals=2):
+    """Return the YSLD filter of each class, highest class first, for ascending 'breaks'.
+
+    Breaks equal once rounded to 'decimals' are merged, so no class is empty (one color fewer each).
+    """
+    text = ['{:.{}f}'.format(value, decimals) for value in sorted(set(round(float(value), decimals) for value in breaks), reverse = True)]
+    if not text:
+        return ['{} IS NOT NULL'.format(metric)]
+    filters = ['{} >= {}'.format(metric, text[0])]
+    for upper, lower in zip(text[:-1], text[1:]):
+        filters.append('{0} < {1} AND {0} >= {2}'.format(metric, upper, lower))
+    filters.append('{} < {}'.format(metric, text[-1]))
+    return filters
+
+
+def renderYSLD(name, metric, breaks, ramp=COLOR_RAMP, size=POINT_SIZE):
+    """Return the YSLD text of a point style classifying 'metric' at ascending 'breaks'."""
+    filters = classFilters(metric, breaks)
+    text = "name: {0}\ntitle: '{0}'\nfeature-styles:\n- name: Rule\n  rules:\n".format(name)
+    for classFilter, color in zip(filters, rampColors(len(filters), ramp)):
+        text += RULE_TEMPLATE.format(filter = classFilter, size = size, color = color)
+    return text
+
+
+def writeYSLD(path, name, metric, breaks, ramp=COLOR_RAMP, size=POINT_SIZE):
+    """Write the YSLD point style of 'metric' to 'path'."""
+    with open(path, 'w') as styleFile:
+        styleFile.write(renderYSLD(name, metric, breaks, ramp, size))
@@ -0,0 +1,162 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Pre-aggregated yield summaries of 'yield_point', one row per field, year and crop
+('yield_summary'), so the web app's summary chart and other reporting read a few hundred
+rows instead of scanning every yield point.
+        -- number of points, sum, mean and percentiles of 'yld_vol_dr' (dry volume, bu/ac)
+           and 'yld_mass_d' (dry mass)
+        -- points without a field ('field_id' NULL) are not summarized
+1) After each load only the field/year groups touched by the loaded files are recomputed:
+   the groups of the rows being replaced ('fileGroups', before they are deleted) and the
+   groups of the new rows in the scratch tables ('stagingGroups')
+2) 'exportSummaryChartCSV' writes the layout read by the web app's Plotly chart
+   ('Data_SummaryChart_Yield_Dry_CORN.csv')
+
+"""
+
+# Import necessary Python packages and libraries
+import csv
+
+SUMMARY_TABLE = 'yield_summary'
+# Percentiles stored for each measure (column suffix -> fraction)
+PERCENTILES = [('p10', 0.1), ('p25', 0.25), ('p50', 0.5), ('p75', 0.75), ('p90', 0.9)]
+MEASURES = ['yld_vol_dr', 'yld_mass_d']
+# Crop of a yield point from the 'corn'/'soybean' product flags
+CROP_EXPRESSION = "CASE WHEN corn = 1 THEN 'corn' WHEN soybean = 1 THEN 'soybean' ELSE 'other' END"
+# Layout of the web app's summary chart CSV
+SUMMARY_CHART_COLUMNS = ['field_id', 'farm_name', 'field_name', 'year', 'corn', 'soybean',
+                         'avg_yield_dry_corn', 'avg_yield_dry_soybean']
+
+
+def _measureColumns():
+    names = []
+    for measure in MEASURES:
+        names += ['{}_sum'.format(measure), '{}_mean'.format(measure)]
+        names += ['{}_{}'.format(measure, suffix) for suffix, fraction in PERCENTILES]
+    return names
+
+
+def createSummaryTableCommand():
+    """Return the 'CREATE TABLE IF NOT EXISTS' command of the summary table."""
+    columns = ''.join('{} double precision NULL,\n'.format(name) for name in _measureColumns())
+    return """
+CREATE TABLE IF NOT EXISTS {0}(
+field_id smallint NOT NULL,
+year smallint NOT NULL,
+crop VARCHAR(10) NOT NULL,   -- 'corn', 'soybean' or 'other' (product not flagged)
+point_count bigint NOT NULL,
+{1}refreshed_at timestamp NOT NULL DEFAULT now(),
+CONSTRAINT {0}_pkey PRIMARY KEY (field_id, year, crop),
+FOREIGN KEY (field_id) REFERENCES field (field_id)
+);""".format(SUMMARY_TABLE, columns)
+
+
+def _aggregates():
+    expressions = []
+    for measure in MEASURES:
+        # Summed as 'double precision': the sum of 'real' values (compact schema) would be accumulated as 'real'
+        expressions += ['sum({}::double precision)'.format(measure), 'avg({})'.format(measure)]
+        expressions += ['percentile_cont({}) WITHIN GROUP (ORDER BY {})'.format(fraction, measure)
+                        for suffix, fraction in PERCENTILES]
+    return ', '.join(expressions)
+
+
+def fileGroups(cursor, plan):
+    """Return the set of (field_id, year) groups of the 'yield_point' rows of the files in 'plan'.
+
+    Call before the rows of changed files are deleted, so their old groups are recomputed too.
+    """
+    groups = set()
+    for fileSource in sorted(set(entry.file_source for entry in plan)):
+        plannedFiles = [entry.org_file for entry in plan if entry.file_source == fileSource]
+        cursor.execute("""
+SELECT DISTINCT field_id, date_part('year', date)::integer FROM yield_point
+WHERE file_source = %s AND org_file = ANY(%s) AND field_id IS NOT NULL;""", (fileSource, plannedFiles))
+        groups.update(cursor.fetchall())
+    return groups
+
+
+def stagingGroups(cursor, schemas):
+    """Return the set of (field_id, year) groups of the rows in the vendors' scratch tables."""
+    groups = set()
+    for schema in schemas:
+        cursor.execute("SELECT DISTINCT field_id, date_part('year', date)::integer FROM {} WHERE field_id IS NOT NULL;".format(
+            schema.stagingTable))
+        groups.update(cursor.fetchall())
+    return groups
+
+
+def refreshSummary(cursor, groups=None):
+    """Recompute the summary rows of the (field_id, year) 'groups' (every group when None); returns the rows written.
+
+    The old rows are deleted and the new ones inserted in the caller's transaction.
+    """
+    if groups is not None:
+        groups = sorted(groups)
+        if not groups:
+            return 0
+        fieldIDs = [int(group[0]) for group in groups]
+        years = [int(group[1]) for group in groups]
+        cursor.execute("""
+DELETE FROM {} s USING unnest(%s::smallint[], %s::smallint[]) AS g(field_id, year)
+WHERE s.field_id = g.field_id AND s.year = g.year;""".format(SUMMARY_TABLE), (fieldIDs, years))
+        # Date ranges (rather than date_part) let partitioned tables and date indexes skip other seasons
+        source = """yield_point p JOIN unnest(%s::smallint[], %s::smallint[]) AS g(field_id, year)
+ON p.field_id = g.field_id AND p.date >= make_date(g.year, 1, 1) AND p.date < make_date(g.year + 1, 1, 1)"""
+        parameters = (fieldIDs, years)
+    else:
+        cursor.execute("TRUNCATE {};".format(SUMMARY_TABLE))
+        source = "yield_point p WHERE p.field_id IS NOT NULL"
+        parameters = None
+    cursor.execute("""
+INSERT INTO {0}(field_id, year, crop, point_count, {1}, refreshed_at)
+SELECT p.field_id, date_part('year', p.date)::smallint, {2}, count(*), {3}, now()
+FROM {4}
+GROUP BY 1, 2, 3;""".format(SUMMARY_TABLE, ', '.join(_measureColumns()), CROP_EXPRESSION, _aggregates(), source),
+                   parameters)
+    return cursor.rowcount
+
+
+def exportSummaryChartCSV(cursor, csvPath, decimals=2):
+    """Write the mean dry yield of every corn and soybean field/year to 'csvPath' in the web app's chart layout; returns the rows written."""
+    cursor.execute("""
+SELECT s.field_id, f.farm_name, f.field_name, s.year, s.crop, s.yld_vol_dr_mean
+FROM {} s JOIN field f ON f.field_id = s.field_id
+WHERE s.crop IN ('corn', 'soybean')
+ORDER BY s.year, s.crop, f.farm_name, f.field_name;""".format(SUMMARY_TABLE))
+    rows = cursor.fetchall()
+    with open(csvPath, 'w', newline = '', encoding = 'utf-8') as outputFile:
+        writer = csv.writer(outputFile)
+        writer.writerow(SUMMARY_CHART_COLUMNS)
+        for fieldID, farmName, fieldName, year, crop, meanYield in rows:
+            meanYield = round(meanYield, decimals) if meanYield is not None else ''
+            isCorn = crop == 'corn'
+            writer.writerow([fieldID, farmName, fieldName, year, int(isCorn), int(not isCorn),
+                             meanYield if isCorn else 0, 0 if isCorn else meanYield])
+    return len(rows)
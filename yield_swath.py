@@ -0,0 +1,207 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Bulk loading of the swath polygon files written by '3_ConvertSHPs_toCSVs.py' ('wkb_csv', 'wkt_csv'
+or 'geoparquet') into table 'yield_swath', used by '9_LoadSwathPolygons.py'.
+        -- Each CSV is streamed unchanged into a temporary table of text columns with
+           'COPY ... FROM STDIN', then moved to 'yield_swath' by one 'INSERT ... SELECT' that
+           converts the values and geometry (to Web Mercator, EPSG: 3857)
+        -- GeoParquet files (requires 'pyarrow') are read one batch at a time and streamed through
+           the same temporary table as CSV rows, with the WKB geometry as hex ('WKB' column)
+        -- 'field_id', 'farmer_id' and 'year' come from the field key of the original file name,
+           and the 'corn'/'soybean' flags from the products, as for the yield points
+        -- Simplified copies of each polygon ('geom_simple_<tolerance>') are stored at load time,
+           so low zoom maps and summaries never read the full resolution polygons
+
+"""
+
+# Import necessary Python packages and libraries
+import csv
+import io
+import json
+
+SWATH_TABLE = 'yield_swath'
+# Swath attributes kept: shapefile field (matched without regard to case) -> 'yield_swath' column
+SWATH_COLUMNS = [('Product', 'product'), ('Yld_Vol_Dr', 'yld_vol_dr'), ('Yld_Mass_D', 'yld_mass_d'),
+                 ('Moisture__', 'moisture__')]
+TEXT_COLUMNS = ['product']
+# Simplification tolerances (Web Mercator meters) of the simplified geometry columns
+SIMPLIFY_TOLERANCES = [2, 10, 50]
+# Coordinate system of the swath shapefiles (WGS84)
+SOURCE_SRID = 4326
+# Rows of a GeoParquet file converted to CSV text at a time
+PARQUET_BATCH_SIZE = 10000
+
+
+def simplifiedColumn(tolerance):
+    """Return the name of the geometry column simplified at 'tolerance'."""
+    return 'geom_simple_{}'.format(tolerance)
+
+
+def createSwathTableCommands():
+    """Return the 'CREATE TABLE/INDEX IF NOT EXISTS' commands of the swath table."""
+    simplified = ''.join('{} geometry(MultiPolygon, 3857) NULL,\n'.format(simplifiedColumn(tolerance))
+                         for tolerance in SIMPLIFY_TOLERANCES)
+    commands = ["""
+CREATE TABLE IF NOT EXISTS {0}(
+id serial,
+org_file VARCHAR(100) NOT NULL,
+file_source VARCHAR(20) NOT NULL,
+field_id smallint NULL REFERENCES field (field_id),
+farmer_id smallint NULL REFERENCES farmer (farmer_ID),
+year smallint NULL,
+product VARCHAR(100) NULL,
+corn smallint NULL,
+soybean smallint NULL,
+yld_vol_dr double precision NULL,
+yld_mass_d double precision NULL,
+moisture__ double precision NULL,
+geom geometry(MultiPolygon, 3857) NULL,
+{1}CONSTRAINT {0}_pkey PRIMARY KEY (id)
+);""".format(SWATH_TABLE, simplified),
+        "CREATE INDEX IF NOT EXISTS {0}_org_file ON {0} (file_source, org_file);".format(SWATH_TABLE)]
+    return commands
+
+
+def createSwathIndexCommands():
+    """Return the spatial index commands of the geometry columns (run after a bulk load)."""
+    return ["CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} USING gist({1});".format(SWATH_TABLE, column)
+            for column in ['geom'] + [simplifiedColumn(tolerance) for tolerance in SIMPLIFY_TOLERANCES]]
+
+
+def readHeader(csvPath):
+    """Return the column headings of a swath CSV."""
+    with open(csvPath, newline = '', encoding = 'utf-8') as csvFile:
+        return next(csv.reader(csvFile))
+
+
+def insertCommand(header, sourceSRID=SOURCE_SRID):
+    """Return the 'INSERT ... SELECT' moving the temporary table of a CSV with 'header' into 'yield_swath'.
+
+    Parameters: org_file, file_source, field_id, farmer_id, year.
+    """
+    positions = dict((name.lower(), 'c{}'.format(i)) for i, name in enumerate(header))
+    values = []
+    for source, column in SWATH_COLUMNS:
+        if source.lower() not in positions:
+            values.append('NULL::text' if column in TEXT_COLUMNS else 'NULL::double precision')
+        elif column in TEXT_COLUMNS:
+            values.append("NULLIF({}, '')".format(positions[source.lower()]))
+        else:
+            values.append("NULLIF({}, '')::double precision".format(positions[source.lower()]))
+    if 'wkb' in positions:
+        geometry = "ST_GeomFromWKB(decode(NULLIF({}, ''), 'hex'), {})".format(positions['wkb'], sourceSRID)
+    else:
+        geometry = "ST_GeomFromText(NULLIF({}, ''), {})".format(positions['wkt'], sourceSRID)
+    simplified = ''.join(', ST_Multi(ST_SimplifyPreserveTopology(s.geom, {}))'.format(tolerance) for tolerance in SIMPLIFY_TOLERANCES)
+    return """
+INSERT INTO {0}(org_file, file_source, field_id, farmer_id, year, {1}, corn, soybean, geom{2})
+SELECT %s, %s, %s, %s, %s, {3}, pr.corn, pr.soybean, s.geom{4}
+FROM (SELECT {5}, ST_Multi(ST_Transform({6}, 3857)) AS geom FROM _swath_import) s
+LEFT JOIN products pr ON pr.productname = s.product AND pr.source = 'yield_point';""".format(
+        SWATH_TABLE, ', '.join(column for source, column in SWATH_COLUMNS),
+        ''.join(', ' + simplifiedColumn(tolerance) for tolerance in SIMPLIFY_TOLERANCES),
+        ', '.join('s.' + column for source, column in SWATH_COLUMNS), simplified,
+        ', '.join('{} AS {}'.format(value, column) for value, (source, column) in zip(values, SWATH_COLUMNS)), geometry)
+
+
+def loadSwathCSV(cursor, csvPath, orgFile, fileSource, fieldKey, sourceSRID=SOURCE_SRID):
+    """Replace the swath polygons of one CSV in 'yield_swath' (in the caller's transaction); returns the number loaded.
+
+    'fieldKey' is the dictionary of 'loadSwathFieldKey'.
+    """
+    header = readHeader(csvPath)
+    with open(csvPath, encoding = 'utf-8') as csvFile:
+        return _loadSwath(cursor, header, csvFile, csvPath, orgFile, fileSource, fieldKey, sourceSRID)
+
+
+def loadSwathParquet(cursor, parquetPath, orgFile, fileSource, fieldKey, sourceSRID=SOURCE_SRID):
+    """Replace the swath polygons of one GeoParquet file in 'yield_swath' (in the caller's transaction); returns the number loaded.
+
+    'fieldKey' is the dictionary of 'loadSwathFieldKey'.
+    """
+    import pyarrow.parquet as pq
+
+    parquetFile = pq.ParquetFile(parquetPath)
+    # The WKB geometry column is named in the GeoParquet metadata
+    geoMetadata = (parquetFile.schema_arrow.metadata or {}).get(b'geo')
+    geometryColumn = json.loads(geoMetadata).get('primary_column', 'geometry') if geoMetadata else 'geometry'
+    header = ['WKB' if name == geometryColumn else name for name in parquetFile.schema_arrow.names]
+    return _loadSwath(cursor, header, _ParquetCSVStream(parquetFile, header), parquetPath, orgFile, fileSource, fieldKey, sourceSRID)
+
+
+class _ParquetCSVStream(object):
+    """Read-only file of CSV text converted from a GeoParquet file one batch at a time (for 'copy_expert')."""
+
+    def __init__(self, parquetFile, header):
+        self.batches = parquetFile.iter_batches(batch_size = PARQUET_BATCH_SIZE)
+        self.geometryIndex = header.index('WKB')
+        self.buffer = self._csvText([header])
+
+    def _csvText(self, rows):
+        text = io.StringIO()
+        csv.writer(text, lineterminator = '\n').writerows(rows)
+        return text.getvalue()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            batch = next(self.batches, None)
+            if batch is None:
+                break
+            columns = batch.to_pydict()
+            columns = [columns[name] for name in batch.schema.names]
+            columns[self.geometryIndex] = [None if wkb is None else wkb.hex() for wkb in columns[self.geometryIndex]]
+            self.buffer += self._csvText(['' if value is None else value for value in row] for row in zip(*columns))
+        if size < 0:
+            size = len(self.buffer)
+        text, self.buffer = self.buffer[:size], self.buffer[size:]
+        return text
+
+
+def _loadSwath(cursor, header, csvFile, path, orgFile, fileSource, fieldKey, sourceSRID):
+    """Stream 'csvFile' (with 'header') into '_swath_import' and replace the swath polygons of 'orgFile' from it."""
+    if not any(name.lower() in ('wkb', 'wkt') for name in header):
+        raise ValueError("No 'WKB' or 'WKT' geometry column in " + path)
+    # Text columns named by position, so any shapefile field names can be loaded
+    cursor.execute("CREATE TEMPORARY TABLE _swath_import ({});".format(', '.join('c{} text'.format(i) for i in range(len(header)))))
+    cursor.copy_expert("COPY _swath_import FROM STDIN WITH (FORMAT csv, HEADER true)", csvFile)
+    cursor.execute("DELETE FROM {} WHERE file_source = %s AND org_file = %s;".format(SWATH_TABLE), (fileSource, orgFile))
+    fieldID, farmerID, year = fieldKey.get(orgFile, (None, None, None))
+    cursor.execute(insertCommand(header, sourceSRID), (orgFile, fileSource, fieldID, farmerID, year))
+    rows = cursor.rowcount
+    cursor.execute("DROP TABLE _swath_import;")
+    return rows
+
+
+def loadSwathFieldKey(cursor):
+    """Return a dictionary of original file name -> (field_id, farmer_id, year) from the field key."""
+    cursor.execute("""
+SELECT fk.file_name, f.field_id, fk.farmerid, fk.year
+FROM _CSVimport_field_key as fk
+LEFT JOIN field as f ON fk.final_farm = f.farm_name AND fk.final_field = f.field_name;""")
+    return dict((fileName, (fieldID, farmerID, year)) for fileName, fieldID, farmerID, year in cursor.fetchall())
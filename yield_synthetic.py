@@ -0,0 +1,181 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Synthetic raw yield CSVs for benchmarking the ingest at production volumes (see 'benchmark_ingest.py').
+1) A profile of a vendor's columns is learned from sample CSVs (such as the files of
+   'SampleData_1_PointData_PrecisionAg_CSVs.zip'):
+        -- number columns: quantiles (sampled by inverse CDF) and fraction of missing values
+        -- text columns: frequency of each value (one product, dataset and date per file, as harvested)
+        -- extent (bounding box) of each sample field
+2) Harvest CSVs with the vendor's layout are written from a profile: points follow
+   back-and-forth passes across a sample field's extent, with 'Obj__Id', 'Pass_Num' and
+   'Track_deg_' following the passes; every other column is drawn (independently) from its learned distribution
+3) The same profile, row count and seed always write the same files; profiles can be saved
+   as JSON so the samples are not needed to regenerate the data
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import json
+import numpy as np
+import pandas as pd
+import vendor_schemas
+
+# Number of quantiles kept for every number column
+PROFILE_QUANTILES = 101
+# Rows written to each synthetic CSV (a season is many files, not one)
+DEFAULT_ROWS_PER_FILE = 250000
+# Rows generated and written at a time
+WRITE_CHUNK_ROWS = 100000
+# Columns generated from the passes of the harvester rather than from their distribution
+PASS_COLUMNS = ('Longitude', 'Latitude', 'Obj__Id', 'Pass_Num', 'Track_deg_')
+# Columns holding one value per file
+FILE_COLUMNS = ('Field', 'Dataset', 'Product')
+
+
+def learnProfile(directory, schema):
+    """Return the profile (a dictionary, JSON serializable) of the vendor's CSVs in 'directory'."""
+    import yield_ingest
+    frames = []
+    for input_file in yield_ingest.listYieldCSVs(directory):
+        df = vendor_schemas.readVendorCSV(os.path.join(directory, input_file), schema)
+        df['org_file'] = input_file[:-4]
+        frames.append(df)
+    if not frames:
+        raise ValueError("No sample CSVs for vendor '{}' in {}".format(schema.vendor, directory))
+    sample = pd.concat(frames, ignore_index = True)
+
+    profile = {'vendor': schema.vendor, 'rows': len(sample), 'numbers': {}, 'texts': {}, 'fields': []}
+    for column in schema.columns:
+        values = sample[column.staging]
+        if column.dtype == vendor_schemas.DATE:
+            # Dates are written as text in the vendor's format
+            values = values.dt.strftime(schema.dateFormat)
+        if column.dtype in (vendor_schemas.TEXT, vendor_schemas.DATE):
+            frequencies = values.astype(object).value_counts(normalize = True)
+            profile['texts'][column.source] = {'values': [str(value) for value in frequencies.index],
+                                               'weights': [float(weight) for weight in frequencies.values]}
+        else:
+            numbers = values.astype('float64').to_numpy()
+            present = numbers[~np.isnan(numbers)]
+            profile['numbers'][column.source] = {
+                'quantiles': [float(q) for q in np.quantile(present, np.linspace(0, 1, PROFILE_QUANTILES))] if len(present) else [0.0],
+                'missing': float(1 - len(present) / float(len(numbers))),
+                'integer': bool(len(present) and np.all(present == np.round(present)))}
+
+    for orgFile, points in sample.groupby('org_file'):
+        profile['fields'].append([float(points['longitude'].min()), float(points['latitude'].min()),
+                                  float(points['longitude'].max()), float(points['latitude'].max())])
+    return profile
+
+
+def saveProfile(profile, path):
+    with open(path, 'w') as profileFile:
+        json.dump(profile, profileFile, indent = 1)
+
+
+def loadProfile(path):
+    with open(path) as profileFile:
+        return json.load(profileFile)
+
+
+def _drawNumbers(rng, spec, rows):
+    """Draw 'rows' values from a number column's quantiles (NaN for the missing fraction)."""
+    quantiles = np.asarray(spec['quantiles'])
+    values = np.interp(rng.random(rows), np.linspace(0, 1, len(quantiles)), quantiles)
+    if spec['integer']:
+        values = np.round(values)
+    if spec['missing'] > 0:
+        values[rng.random(rows) < spec['missing']] = np.nan
+    return values
+
+
+def _drawText(rng, spec, rows):
+    weights = np.asarray(spec['weights'])
+    return np.asarray(spec['values'], dtype = object)[rng.choice(len(weights), size = rows, p = weights / weights.sum())]
+
+
+def _passPositions(first, rows, totalRows, extent, rng):
+    """Return lon, lat, point number, pass number and heading of points 'first'..'first + rows' of a field."""
+    minLon, minLat, maxLon, maxLat = extent
+    # Square-ish grid of passes over the extent
+    perPass = max(2, int(np.ceil(np.sqrt(totalRows))))
+    passes = max(2, int(np.ceil(totalRows / float(perPass))))
+    index = np.arange(first, first + rows)
+    passNumber = index // perPass
+    position = index % perPass
+    # Every other pass runs back the other way
+    position = np.where(passNumber % 2 == 1, perPass - 1 - position, position)
+    longitude = minLon + (maxLon - minLon) * position / float(perPass - 1)
+    latitude = minLat + (maxLat - minLat) * passNumber / float(passes - 1)
+    # GPS noise of about a meter
+    longitude = longitude + rng.normal(0, 1e-5, rows)
+    latitude = latitude + rng.normal(0, 1e-5, rows)
+    heading = np.where(passNumber % 2 == 1, 270.0, 90.0)
+    return longitude, latitude, index + 1, passNumber + 1, heading
+
+
+def generateYieldCSVs(profile, schema, outputDir, totalRows, rowsPerFile=DEFAULT_ROWS_PER_FILE, seed=0, prefix='Synthetic'):
+    """Write 'totalRows' synthetic points as CSVs with the vendor's layout into 'outputDir'; returns the file paths."""
+    rng = np.random.default_rng(seed)
+    columns = [column.source for column in schema.columns]
+    dateColumns = [column.source for column in schema.columns if column.dtype == vendor_schemas.DATE]
+    paths = []
+    fileIndex = 0
+    remaining = totalRows
+    while remaining > 0:
+        fileRows = min(rowsPerFile, remaining)
+        extent = profile['fields'][fileIndex % len(profile['fields'])]
+        # One field, dataset, product and harvest date per file
+        fileValues = dict((name, _drawText(rng, profile['texts'][name], 1)[0]) for name in FILE_COLUMNS if name in profile['texts'])
+        fileValues['Field'] = '{} {}'.format(prefix, fileIndex + 1)
+        harvestDate = _drawText(rng, profile['texts'][dateColumns[-1]], 1)[0] if dateColumns else None
+
+        path = os.path.join(outputDir, '{}_{}_{}_{}_1.csv'.format(prefix, schema.vendor, fileIndex + 1, harvestDate[-4:] if harvestDate else ''))
+        for first in range(0, fileRows, WRITE_CHUNK_ROWS):
+            rows = min(WRITE_CHUNK_ROWS, fileRows - first)
+            longitude, latitude, pointNumber, passNumber, heading = _passPositions(first, rows, fileRows, extent, rng)
+            data = {'Longitude': np.round(longitude, 8), 'Latitude': np.round(latitude, 8), 'Obj__Id': pointNumber,
+                    'Pass_Num': passNumber, 'Track_deg_': heading}
+            for name in columns:
+                if name in data:
+                    continue
+                if name in fileValues:
+                    data[name] = np.full(rows, fileValues[name], dtype = object)
+                elif name in dateColumns:
+                    data[name] = np.full(rows, harvestDate, dtype = object)
+                elif name in profile['numbers']:
+                    data[name] = np.round(_drawNumbers(rng, profile['numbers'][name], rows), 4)
+                else:
+                    data[name] = _drawText(rng, profile['texts'][name], rows)
+            pd.DataFrame(data, columns = columns).to_csv(path, mode = 'w' if first == 0 else 'a', header = first == 0, index = False)
+        paths.append(path)
+        remaining -= fileRows
+        fileIndex += 1
+    return paths
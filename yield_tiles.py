@@ -0,0 +1,353 @@
+#==============================================================================
+# MIT License
+#
+# Copyright (c) 2017 Angelo Podagrosi
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+#==============================================================================
+# -*- coding: utf-8 -*-
+"""
+MODULE OVERVIEW
+
+Mapbox Vector Tile (MVT) pyramid of the yield points, rendered by PostGIS ('ST_AsMVT') and
+written to a static tile cache, so the web map needs no render server on the request path.
+        -- layer 'yield': one point per yield point carrying 'field_id', 'year', 'crop' and the
+           yield metrics ('METRICS'); the map filters by year/crop and styles by metric
+           instead of needing one WMS layer for every year/crop/metric
+        -- layer 'fields': the field polygons ('field_polygons_v1'), when loaded
+        -- zoomed out tiles may draw the 'yield' layer from the grid cells of 'yield_grid.py'
+           instead of the points: one square per cell carrying the mean of each metric (under
+           the metric's name) and 'point_count'
+1) Tiles use the 'XYZ' scheme of web maps (EPSG: 3857, tile 0/0/0 covers the world, y from the top)
+2) Tiles are rendered on several database connections at the same time; the cache is written
+   by the calling thread only
+        -- 'MBTilesCache': one SQLite file (MBTiles 1.3; tiles stored gzip compressed)
+        -- 'DirectoryCache': '{z}/{x}/{y}.pbf' files, served as static files
+3) Incremental seeding: only the tiles intersecting the extent of files loaded since the last
+   seed (the 'loaded_at' of 'ingest_manifest'), and the extent of the rows those files replaced,
+   are rendered again
+
+"""
+
+# Import necessary Python packages and libraries
+import os
+import gzip
+import json
+import math
+import sqlite3
+import concurrent.futures
+import yield_geometry
+import yield_summary
+import yield_ingest
+import pipeline_settings
+
+# Half the width of the Web Mercator world (meters)
+WORLD_HALF_WIDTH = math.pi * yield_geometry.EARTH_RADIUS
+# Tile coordinate extent and the buffer (in tile coordinates) kept around each tile for symbols at tile edges
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+# Attributes of the 'yield' layer carried for every point (in addition to 'field_id', 'year' and 'crop')
+METRICS = ['yld_vol_dr', 'yld_mass_d', 'moisture__']
+POINT_LAYER = 'yield'
+FIELD_LAYER = 'fields'
+FIELD_TABLE = 'field_polygons_v1'
+# Tiles rendered on one connection per task
+BATCH_TILES = 64
+
+###############################################################################
+# Tile coordinates
+
+def tileBounds(zoom, x, y):
+    """Return the (xmin, ymin, xmax, ymax) Web Mercator bounds of tile 'zoom'/'x'/'y'."""
+    size = 2.0 * WORLD_HALF_WIDTH / (1 << zoom)
+    return (-WORLD_HALF_WIDTH + x * size, WORLD_HALF_WIDTH - (y + 1) * size,
+            -WORLD_HALF_WIDTH + (x + 1) * size, WORLD_HALF_WIDTH - y * size)
+
+
+def tilesForBounds(bounds, zoom):
+    """Return the (zoom, x, y) tiles whose buffered area intersects the Web Mercator 'bounds'."""
+    tiles = 1 << zoom
+    size = 2.0 * WORLD_HALF_WIDTH / tiles
+    # Points within the buffer of a neighbouring tile are drawn in that tile too
+    margin = size * TILE_BUFFER / TILE_EXTENT
+    xmin, ymin, xmax, ymax = bounds
+
+    def clamp(value):
+        return min(tiles - 1, max(0, int(math.floor(value))))
+    x0, x1 = clamp((xmin - margin + WORLD_HALF_WIDTH) / size), clamp((xmax + margin + WORLD_HALF_WIDTH) / size)
+    y0, y1 = clamp((WORLD_HALF_WIDTH - ymax - margin) / size), clamp((WORLD_HALF_WIDTH - ymin + margin) / size)
+    return [(zoom, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def pyramidTiles(boundsList, minZoom, maxZoom):
+    """Return the sorted tiles of zoom levels 'minZoom' to 'maxZoom' intersecting any of 'boundsList'."""
+    tiles = set()
+    for bounds in boundsList:
+        for zoom in range(minZoom, maxZoom + 1):
+            tiles.update(tilesForBounds(bounds, zoom))
+    return sorted(tiles)
+
+###############################################################################
+# Extents to seed
+
+def _extents(cursor, command, parameters=None):
+    cursor.execute(command, parameters)
+    return [tuple(row) for row in cursor.fetchall() if row[0] is not None]
+
+
+def dataExtent(cursor, includeFields=True):
+    """Return the Web Mercator extents of every yield point (and field polygon)."""
+    extents = _extents(cursor, """
+SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) FROM (SELECT ST_Extent(geom_3857) AS e FROM yield_point) t;""")
+    if includeFields:
+        extents += _extents(cursor, """
+SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+FROM (SELECT ST_Extent(ST_Transform(geom, 3857)) AS e FROM {}) t;""".format(FIELD_TABLE))
+    return extents
+
+
+def changedFileExtents(cursor, since):
+    """Return the Web Mercator extent of each file recorded in 'ingest_manifest' after 'since' (all files when None)."""
+    return _extents(cursor, """
+SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+FROM (SELECT ST_Extent(p.geom_3857) AS e
+      FROM yield_point p JOIN ingest_manifest m ON m.file_source = p.file_source AND m.org_file = p.org_file
+      WHERE %s IS NULL OR m.loaded_at > %s
+      GROUP BY p.file_source, p.org_file) t;""", (since, since))
+
+
+def replacedExtents(cursor, since):
+    """Return the Web Mercator extents of the rows replaced by the files loaded after 'since' (their old points)."""
+    return _extents(cursor, """
+SELECT xmin, ymin, xmax, ymax FROM {} WHERE replaced_at > %s AND xmin IS NOT NULL;""".format(
+        yield_ingest.REPLACED_GROUPS_TABLE), (since,))
+
+
+def manifestLoadedAt(cursor):
+    """Return the latest 'loaded_at' of 'ingest_manifest' (None when empty); stored as the seed watermark."""
+    cursor.execute("SELECT max(loaded_at) FROM ingest_manifest;")
+    return cursor.fetchone()[0]
+
+
+def tableExists(cursor, table):
+    """Return True if 'table' exists in the database."""
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+    return cursor.fetchone()[0]
+
+###############################################################################
+# Rendering
+
+def tileCommand(metrics=METRICS, includeFields=True, gridTable=None):
+    """Return the query rendering one tile (parameters 'xmin', 'ymin', 'xmax', 'ymax') as MVT bytes.
+
+    The 'yield' layer is drawn from the cells of 'gridTable' (a 'yield_grid_z{zoom}' table) when given.
+    """
+    if gridTable is None:
+        pointColumns = ''.join(', p.{}'.format(metric) for metric in metrics)
+        points = """
+    SELECT ST_AsMVTGeom(p.geom_3857, bounds.geom, {extent}, {buffer}, true) AS geom,
+           p.field_id, date_part('year', p.date)::integer AS year, {crop} AS crop{pointColumns}
+    FROM yield_point p, bounds""".format(extent = TILE_EXTENT, buffer = TILE_BUFFER, crop = yield_summary.CROP_EXPRESSION,
+                                          pointColumns = pointColumns)
+    else:
+        cellColumns = ''.join(', p.{0}_mean AS {0}'.format(metric) for metric in metrics)
+        points = """
+    SELECT ST_AsMVTGeom(p.geom_3857, bounds.geom, {extent}, {buffer}, true) AS geom,
+           p.field_id, p.year::integer AS year, p.crop, p.point_count{cellColumns}
+    FROM {table} p, bounds""".format(extent = TILE_EXTENT, buffer = TILE_BUFFER, cellColumns = cellColumns, table = gridTable)
+    command = """
+WITH bounds AS (SELECT ST_MakeEnvelope(%(xmin)s, %(ymin)s, %(xmax)s, %(ymax)s, 3857) AS geom),
+points AS ({points}
+    WHERE p.geom_3857 && ST_Expand(bounds.geom, (%(xmax)s - %(xmin)s) * {buffer} / {extent})
+)""".format(points = points, extent = TILE_EXTENT, buffer = TILE_BUFFER)
+    layers = ["COALESCE((SELECT ST_AsMVT(points, '{}', {}, 'geom') FROM points WHERE geom IS NOT NULL), ''::bytea)".format(
+        POINT_LAYER, TILE_EXTENT)]
+    if includeFields:
+        command += """,
+fields AS (
+    SELECT ST_AsMVTGeom(ST_Transform(f.geom, 3857), bounds.geom, {extent}, {buffer}, true) AS geom,
+           f.field_id, f.final_farm AS farm_name, f.finalfield AS field_name
+    FROM {table} f, bounds
+    WHERE f.geom && ST_Transform(bounds.geom, 4326)
+)""".format(extent = TILE_EXTENT, buffer = TILE_BUFFER, table = FIELD_TABLE)
+        layers.append("COALESCE((SELECT ST_AsMVT(fields, '{}', {}, 'geom') FROM fields WHERE geom IS NOT NULL), ''::bytea)".format(
+            FIELD_LAYER, TILE_EXTENT))
+    # Layers of an MVT are concatenated protocol buffer messages
+    return command + "\nSELECT " + " || ".join(layers) + ";"
+
+
+def _renderBatch(connect, commands, tiles):
+    connection = connect()
+    try:
+        cursor = connection.cursor()
+        rendered = []
+        for zoom, x, y in tiles:
+            xmin, ymin, xmax, ymax = tileBounds(zoom, x, y)
+            cursor.execute(commands[zoom], {'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax})
+            rendered.append((zoom, x, y, bytes(cursor.fetchone()[0])))
+        connection.rollback()
+        cursor.close()
+        return rendered
+    finally:
+        pipeline_settings.release(connection)
+
+
+def seedTiles(connect, cache, tiles, metrics=METRICS, includeFields=True, workers=4, gridTables=None):
+    """Render 'tiles' on 'workers' connections at the same time and write them to 'cache'.
+
+    'connect' returns a connection for each batch of tiles (handed back with 'pipeline_settings.release',
+    e.g. 'pipeline_settings.connectionFactory(workers)').
+
+    Tiles of the zoom levels in 'gridTables' ({zoom: grid table}) draw the grid cells instead of the points.
+    Empty tiles are removed from the cache; returns (tiles written, tiles removed).
+    """
+    gridTables = gridTables or {}
+    commands = dict((zoom, tileCommand(metrics, includeFields, gridTables.get(zoom)))
+                    for zoom in set(tile[0] for tile in tiles))
+    batches = [tiles[i:i + BATCH_TILES] for i in range(0, len(tiles), BATCH_TILES)]
+    written = removed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(_renderBatch, connect, commands, batch) for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            for zoom, x, y, data in future.result():
+                if data:
+                    cache.put(zoom, x, y, data)
+                    written += 1
+                else:
+                    removed += cache.remove(zoom, x, y)
+            cache.flush()
+    return written, removed
+
+
+def tileJSON(metrics=METRICS, includeFields=True, minZoom=0, maxZoom=22, gridTables=None):
+    """Return the 'vector_layers' description of the tiles (MBTiles metadata 'json')."""
+    pointFields = dict((name, 'Number') for name in ['field_id', 'year'] + list(metrics))
+    if gridTables:
+        # Only in the tiles drawn from grid cells
+        pointFields['point_count'] = 'Number'
+    pointFields['crop'] = 'String'
+    layers = [{'id': POINT_LAYER, 'fields': pointFields, 'minzoom': minZoom, 'maxzoom': maxZoom}]
+    if includeFields:
+        layers.append({'id': FIELD_LAYER, 'fields': {'field_id': 'Number', 'farm_name': 'String', 'field_name': 'String'},
+                       'minzoom': minZoom, 'maxzoom': maxZoom})
+    return json.dumps({'vector_layers': layers})
+
+
+def lonLatBounds(boundsList, previous=None):
+    """Return the 'west,south,east,north' text of the union of Web Mercator 'boundsList' (and 'previous' text)."""
+    xmin = min(bounds[0] for bounds in boundsList)
+    ymin = min(bounds[1] for bounds in boundsList)
+    xmax = max(bounds[2] for bounds in boundsList)
+    ymax = max(bounds[3] for bounds in boundsList)
+    longitude, latitude = yield_geometry.webMercatorToLonLat([xmin, xmax], [ymin, ymax])
+    west, south, east, north = longitude[0], latitude[0], longitude[1], latitude[1]
+    if previous:
+        previousWest, previousSouth, previousEast, previousNorth = [float(value) for value in previous.split(',')]
+        west, south = min(west, previousWest), min(south, previousSouth)
+        east, north = max(east, previousEast), max(north, previousNorth)
+    return ','.join('{:.6f}'.format(value) for value in (west, south, east, north))
+
+###############################################################################
+# Tile caches
+
+class MBTilesCache(object):
+    """Tiles and metadata in one MBTiles (SQLite) file."""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metadata (name text PRIMARY KEY, value text);")
+        self.connection.execute("""
+CREATE TABLE IF NOT EXISTS tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob,
+                                  PRIMARY KEY (zoom_level, tile_column, tile_row));""")
+
+    def put(self, zoom, x, y, data):
+        # MBTiles rows count from the bottom ('TMS' scheme)
+        self.connection.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?);",
+                                (zoom, x, (1 << zoom) - 1 - y, sqlite3.Binary(gzip.compress(data))))
+
+    def remove(self, zoom, x, y):
+        return self.connection.execute("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?;",
+                                       (zoom, x, (1 << zoom) - 1 - y)).rowcount
+
+    def getMetadata(self, name, default=None):
+        row = self.connection.execute("SELECT value FROM metadata WHERE name = ?;", (name,)).fetchone()
+        return row[0] if row else default
+
+    def setMetadata(self, values):
+        self.connection.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?);",
+                                    [(name, str(value)) for name, value in values.items()])
+
+    def flush(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class DirectoryCache(object):
+    """Tiles as '{z}/{x}/{y}.pbf' files (uncompressed) with the metadata in 'metadata.json'."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self.metadataPath = os.path.join(path, 'metadata.json')
+        self.metadata = {}
+        if os.path.exists(self.metadataPath):
+            with open(self.metadataPath) as metadataFile:
+                self.metadata = json.load(metadataFile)
+
+    def tilePath(self, zoom, x, y):
+        return os.path.join(self.path, str(zoom), str(x), '{}.pbf'.format(y))
+
+    def put(self, zoom, x, y, data):
+        tilePath = self.tilePath(zoom, x, y)
+        os.makedirs(os.path.dirname(tilePath), exist_ok = True)
+        # Written beside the tile and renamed, so a map never reads a partly written tile
+        with open(tilePath + '.tmp', 'wb') as tileFile:
+            tileFile.write(data)
+        os.replace(tilePath + '.tmp', tilePath)
+
+    def remove(self, zoom, x, y):
+        tilePath = self.tilePath(zoom, x, y)
+        if os.path.exists(tilePath):
+            os.remove(tilePath)
+            return 1
+        return 0
+
+    def getMetadata(self, name, default=None):
+        return self.metadata.get(name, default)
+
+    def setMetadata(self, values):
+        self.metadata.update((name, str(value)) for name, value in values.items())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with open(self.metadataPath, 'w') as metadataFile:
+            json.dump(self.metadata, metadataFile, indent = 1)
+
+
+def openCache(path):
+    """Open an MBTiles file (path ending '.mbtiles') or a tile directory."""
+    if path.lower().endswith('.mbtiles'):
+        return MBTilesCache(path)
+    return DirectoryCache(path)